@@ -1,2 +1,11 @@
 from .cmk_RESTAPI import *
-from .cmkSite import *
\ No newline at end of file
+from .cmkSite import *
+from .cmkFleet import *
+from .cmkSnapshotStore import *
+from .cmkInventorySnapshot import *
+from .cmkReconciler import *
+from .cmkFolderTree import *
+from .cmkLivestatus import *
+from .cmkActivation import *
+from .cmkPendingChanges import *
+from .cmkJobTracker import *
\ No newline at end of file
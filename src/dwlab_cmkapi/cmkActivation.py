@@ -0,0 +1,518 @@
+import sys
+import time
+import json
+import uuid
+import queue
+import sqlite3
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from dwlab_cmkapi import cmk_RESTAPI
+
+import logging
+logger=logging.getLogger(__name__)
+
+class LeaseLostError(RuntimeError):
+    # A cmkActivationCoordinator leader's lease expired and another worker
+    # took it over.
+    pass
+
+class cmkActivationEvent:
+    QUEUED="queued"
+    RUNNING="running"
+    DONE="done"
+    FAILED="failed"
+
+    def __init__(self,
+                 siteID="",
+                 state="",
+                 attempt=0,
+                 duration=None,
+                 message="",
+                 activationID=""
+                 ):
+        self._siteID=siteID
+        self._state=state
+        self._attempt=attempt
+        self._duration=duration
+        self._message=message
+        self._activationID=activationID
+        self._time=time.time()
+
+    @property
+    def siteID(self):
+        return self._siteID
+
+    @property
+    def state(self):
+        return self._state
+
+    @property
+    def attempt(self):
+        return self._attempt
+
+    @property
+    def duration(self):
+        return self._duration
+
+    @property
+    def message(self):
+        return self._message
+
+    @property
+    def activationID(self):
+        return self._activationID
+
+    @property
+    def time(self):
+        return self._time
+
+    @property
+    def final(self):
+        return self._state in [self.DONE, self.FAILED]
+
+    def to_dict(self):
+        return {
+            "siteID": self._siteID,
+            "state": self._state,
+            "attempt": self._attempt,
+            "duration": self._duration,
+            "message": self._message,
+            "activationID": self._activationID,
+            "time": self._time
+        }
+
+class cmkActivationResult:
+    def __init__(self,
+                 done=None,
+                 failed=None,
+                 events=None
+                 ):
+        self._done=done if done is not None else []
+        self._failed=failed if failed is not None else {}
+        self._events=events if events is not None else []
+
+    @property
+    def done(self):
+        return self._done
+
+    @property
+    def failed(self):
+        # Message of the last failed attempt keyed by site id
+        return self._failed
+
+    @property
+    def events(self):
+        return self._events
+
+    @property
+    def ok(self):
+        return len(self._failed)==0
+
+class cmkActivationOrchestrator:
+    # Activates pending changes site group by site group instead of in one
+    # request for all sites, so a site that fails only fails its own group.
+    # Up to maxParallel groups are activated at once; sites that failed are
+    # retried, in their original groups, up to retries times. Progress is
+    # reported as cmkActivationEvent per site, through run() as a generator
+    # and through the onEvent callback.
+    # Groups are started one at a time and only followed in parallel: each
+    # start changes the pending changes' ETag, so concurrent starts would
+    # send stale If-Match headers and fail each other with 412.
+    # Where other workers activate the same site through a
+    # cmkActivationCoordinator, pass it as coordinator: every group is then
+    # activated through it instead of directly, and a failed group fails
+    # and is retried as a whole.
+    def __init__(self,
+                 cmkAccess=None,
+                 groupSize=1,
+                 maxParallel=4,
+                 pollInterval=2,
+                 timeout=900,
+                 retries=1,
+                 onEvent=None,
+                 coordinator=None
+                 ):
+        function_name = sys._getframe().f_code.co_name
+        class_name=self.__class__.__name__
+        function_name=class_name+"."+function_name
+        logger.debug("Entering function "+str(function_name))
+
+        if not isinstance(cmkAccess, cmk_RESTAPI.RestAPIcredentials):
+            raise TypeError("cmkAccess must be an instance of RestAPIcredentials")
+        if not isinstance(groupSize, int) or groupSize < 1:
+            raise ValueError("groupSize must be a positive integer")
+        if not isinstance(maxParallel, int) or maxParallel < 1:
+            raise ValueError("maxParallel must be a positive integer")
+        if coordinator is not None and not isinstance(coordinator, cmkActivationCoordinator):
+            raise TypeError("coordinator must be an instance of cmkActivationCoordinator")
+        self._cmkAccess=cmkAccess
+        self._groupSize=groupSize
+        self._maxParallel=maxParallel
+        self._pollInterval=pollInterval
+        self._timeout=timeout
+        self._retries=retries
+        self._onEvent=onEvent
+        self._coordinator=coordinator
+        self._startLock=threading.Lock()
+
+    def siteGroups(self, siteIDs):
+        siteIDs=list(siteIDs)
+        return [siteIDs[start:start+self._groupSize] for start in range(0, len(siteIDs), self._groupSize)]
+
+    def run(self, sites=None, groups=None, force_foreign_changes=False):
+        # Yields events until every site is done or failed for good. groups
+        # gives explicit site groups, otherwise sites are grouped by
+        # groupSize. No or empty sites mean all connected sites, as for
+        # activatePendingChanges.
+        function_name = sys._getframe().f_code.co_name
+        logger.debug("Entering function "+str(function_name))
+
+        if groups is None:
+            if sites is None or len(sites) == 0:
+                sites=cmk_RESTAPI.SiteAllConnections(cmkAccess=self._cmkAccess).getConnectedSiteIDs()
+            groups=self.siteGroups(sites)
+        groups=[list(group) for group in groups if len(group) > 0]
+
+        events=queue.Queue()
+        for attempt in range(self._retries+1):
+            failed=set()
+            for group in groups:
+                for siteID in group:
+                    yield self._emit(events, cmkActivationEvent(siteID=siteID, state=cmkActivationEvent.QUEUED, attempt=attempt), queued=False)
+
+            with ThreadPoolExecutor(max_workers=self._maxParallel) as executor:
+                futures={executor.submit(self._activateGroup, group, attempt, force_foreign_changes, events): tuple(group) for group in groups}
+                while True:
+                    try:
+                        event=events.get(timeout=0.1)
+                    except queue.Empty:
+                        if all(future.done() for future in futures) and events.empty():
+                            break
+                        continue
+                    if event.state == cmkActivationEvent.FAILED:
+                        failed.add(event.siteID)
+                    yield event
+                for future, group in futures.items():
+                    exception=future.exception()
+                    if exception is not None:
+                        for siteID in group:
+                            failed.add(siteID)
+                            yield self._emit(events, cmkActivationEvent(
+                                siteID=siteID, state=cmkActivationEvent.FAILED, attempt=attempt, message=str(exception)
+                            ), queued=False)
+
+            if len(failed) == 0:
+                break
+            groups=[[siteID for siteID in group if siteID in failed] for group in groups]
+            groups=[group for group in groups if len(group) > 0]
+            if attempt < self._retries:
+                logger.warning("Retrying the activation of "+", ".join(sorted(failed)))
+
+        logger.debug("Leaving function "+str(function_name))
+
+    def activate(self, sites=None, groups=None, force_foreign_changes=False):
+        # Runs to completion and returns a cmkActivationResult.
+        lastEvents={}
+        allEvents=[]
+        for event in self.run(sites=sites, groups=groups, force_foreign_changes=force_foreign_changes):
+            allEvents.append(event)
+            lastEvents[event.siteID]=event
+        return cmkActivationResult(
+            done=sorted(siteID for siteID, event in lastEvents.items() if event.state == cmkActivationEvent.DONE),
+            failed={siteID: event.message for siteID, event in lastEvents.items() if event.state == cmkActivationEvent.FAILED},
+            events=allEvents
+        )
+
+    def _emit(self, events, event, queued=True):
+        if self._onEvent is not None:
+            try:
+                self._onEvent(event)
+            except Exception as e:
+                logger.error("onEvent failed: "+str(e))
+        if queued:
+            events.put(event)
+        return event
+
+    def _activateGroup(self, group, attempt, force_foreign_changes, events):
+        started=time.monotonic()
+        def finish(state, message="", activationID=""):
+            for siteID in group:
+                self._emit(events, cmkActivationEvent(
+                    siteID=siteID, state=state, attempt=attempt,
+                    duration=time.monotonic()-started, message=message, activationID=activationID
+                ))
+
+        if self._coordinator is not None:
+            for siteID in group:
+                self._emit(events, cmkActivationEvent(
+                    siteID=siteID, state=cmkActivationEvent.RUNNING, attempt=attempt,
+                    duration=time.monotonic()-started
+                ))
+            response=self._coordinator.activate(cmkAccess=self._cmkAccess, sites=group, force_foreign_changes=force_foreign_changes)
+            if response == "Done":
+                finish(cmkActivationEvent.DONE)
+            else:
+                finish(cmkActivationEvent.FAILED, message=str(response))
+            return
+
+        with self._startLock:
+            activation=cmk_RESTAPI.AllActivations(cmkAccess=self._cmkAccess, loadChanges=False)
+            response=activation.activatePendingChanges(
+                cmkAccess=self._cmkAccess,
+                redirect=False,
+                sites=group,
+                force_foreign_changes=force_foreign_changes
+            )
+        if response == "Done":
+            finish(cmkActivationEvent.DONE)
+            return
+        if response == 422:
+            finish(cmkActivationEvent.DONE, message="No pending changes")
+            return
+        if response != "Started" or activation.lastActivationRun is None:
+            finish(cmkActivationEvent.FAILED, message="Activation was refused with status code "+str(response))
+            return
+
+        activationRun=activation.lastActivationRun
+        for siteID in group:
+            self._emit(events, cmkActivationEvent(
+                siteID=siteID, state=cmkActivationEvent.RUNNING, attempt=attempt,
+                duration=time.monotonic()-started, activationID=activationRun.id
+            ))
+        while activationRun.is_running:
+            if time.monotonic()-started > self._timeout:
+                finish(cmkActivationEvent.FAILED, message="Activation did not finish within "+str(self._timeout)+"s", activationID=activationRun.id)
+                return
+            time.sleep(self._pollInterval)
+            activationRun=cmk_RESTAPI.ActivationRun.ShowActivation(activationID=activationRun.id, cmkAccess=self._cmkAccess)
+
+        for siteID in group:
+            failed=activationRun.siteFailed(siteID)
+            status=activationRun.status_per_site.get(siteID, {})
+            self._emit(events, cmkActivationEvent(
+                siteID=siteID,
+                state=cmkActivationEvent.FAILED if failed else cmkActivationEvent.DONE,
+                attempt=attempt,
+                duration=time.monotonic()-started,
+                message=str(status.get("status_details", status.get("status_text", ""))) if failed else "",
+                activationID=activationRun.id
+            ))
+
+class cmkActivationCoordinator:
+    # Serialises activations of a central site across threads and processes
+    # sharing the same SQLite file. Every caller enqueues a ticket; whoever
+    # obtains the site's lease activates once for all tickets waiting at
+    # that moment, the others wait for the outcome of that activation. N
+    # callers colliding therefore cause one activation, or two when some
+    # arrive while one is already running.
+    # The lease must outlast the longest request made between two renewals,
+    # the activation start with its 412 retries; by default it is derived
+    # from the request timeout of cmkAccess. A leader that finds its lease
+    # taken over stops and leaves its tickets to the new leader.
+    # cmkActivationOrchestrator takes a coordinator, so both can be used
+    # for the same site; activating it directly bypasses the lease.
+    WAITING="waiting"
+    RUNNING="running"
+    DONE="done"
+
+    SCHEMA=[
+        """CREATE TABLE IF NOT EXISTS tickets (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            site TEXT,
+            sites TEXT,
+            force INTEGER,
+            state TEXT,
+            batch TEXT,
+            result TEXT,
+            requested REAL,
+            finished REAL
+        )""",
+        "CREATE INDEX IF NOT EXISTS tickets_site_state ON tickets (site, state)",
+        """CREATE TABLE IF NOT EXISTS leases (
+            site TEXT PRIMARY KEY,
+            holder TEXT,
+            expires REAL
+        )"""
+    ]
+
+    def __init__(self,
+                 path=None,
+                 leaseTime=None,
+                 pollInterval=1,
+                 timeout=900,
+                 keepTickets=86400,
+                 retries=3
+                 ):
+        function_name = sys._getframe().f_code.co_name
+        class_name=self.__class__.__name__
+        function_name=class_name+"."+function_name
+        logger.debug("Entering function "+str(function_name))
+
+        if path is None:
+            raise ValueError("path is empty")
+        self._path=Path(path)
+        self._leaseTime=leaseTime
+        self._pollInterval=pollInterval
+        self._timeout=timeout
+        self._keepTickets=keepTickets
+        self._retries=retries
+        db=self._connect()
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            for statement in self.SCHEMA:
+                db.execute(statement)
+        finally:
+            db.close()
+
+    @property
+    def path(self):
+        return self._path
+
+    def leaseTimeFor(self, cmkAccess):
+        # Seconds a lease is taken or renewed for. Starting an activation
+        # sends up to retries+1 POSTs, each after an ETag fetch that may
+        # need a HEAD and a GET; every one of them may run into the
+        # connect and read timeouts of cmkAccess.
+        if self._leaseTime is not None:
+            return self._leaseTime
+        timeout=cmkAccess.timeout
+        if timeout is None:
+            raise ValueError("cmkAccess has no request timeout, leaseTime must be given")
+        requestTime=sum(timeout) if isinstance(timeout, (tuple, list)) else timeout
+        return requestTime*3*(self._retries+1)+self._pollInterval
+
+    def _connect(self):
+        # One connection per call keeps the coordinator usable from several
+        # threads; transactions are opened explicitly with BEGIN IMMEDIATE.
+        return sqlite3.connect(str(self._path), timeout=30, isolation_level=None)
+
+    def activate(self, cmkAccess=None, sites=None, force_foreign_changes=False):
+        # Returns what AllActivations.activatePendingChanges would return for
+        # the activation covering this call, once that activation finished:
+        # "Done", or the status code / message of the failure.
+        function_name = sys._getframe().f_code.co_name
+        logger.debug("Entering function "+str(function_name))
+
+        if not isinstance(cmkAccess, cmk_RESTAPI.RestAPIcredentials):
+            raise TypeError("cmkAccess must be an instance of RestAPIcredentials")
+        site=cmkAccess.siteKey
+        leaseTime=self.leaseTimeFor(cmkAccess)
+        deadline=time.monotonic()+self._timeout
+
+        db=self._connect()
+        try:
+            ticketID=db.execute(
+                "INSERT INTO tickets (site, sites, force, state, requested) VALUES (?, ?, ?, ?, ?)",
+                (site, json.dumps(sites), int(bool(force_foreign_changes)), self.WAITING, time.time())
+            ).lastrowid
+            while True:
+                batch=self._lead(db, site, leaseTime)
+                if batch is not None:
+                    self._runBatch(db, cmkAccess, site, leaseTime, *batch)
+                state, result=db.execute("SELECT state, result FROM tickets WHERE id = ?", (ticketID,)).fetchone()
+                if state == self.DONE:
+                    logger.debug("Leaving function "+str(function_name))
+                    return json.loads(result)
+                if time.monotonic() > deadline:
+                    db.execute("DELETE FROM tickets WHERE id = ? AND state = ?", (ticketID, self.WAITING))
+                    raise RuntimeError("No activation of "+str(site)+" finished within "+str(self._timeout)+"s")
+                time.sleep(self._pollInterval)
+        finally:
+            db.close()
+
+    def _lead(self, db, site, leaseTime):
+        # Takes the site's lease if it is free or expired and claims all
+        # waiting tickets. Returns (holder, tickets) or None.
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            now=time.time()
+            lease=db.execute("SELECT holder, expires FROM leases WHERE site = ?", (site,)).fetchone()
+            if lease is not None and lease[1] > now:
+                db.execute("COMMIT")
+                return None
+            if lease is not None:
+                # The previous leader died; its tickets are activated again.
+                logger.warning("Taking over the expired activation lease of "+str(site))
+                db.execute("UPDATE tickets SET state = ?, batch = NULL WHERE site = ? AND state = ?", (self.WAITING, site, self.RUNNING))
+            db.execute("DELETE FROM tickets WHERE state = ? AND finished < ?", (self.DONE, now-self._keepTickets))
+            tickets=db.execute("SELECT id, sites, force FROM tickets WHERE site = ? AND state = ?", (site, self.WAITING)).fetchall()
+            if len(tickets) == 0:
+                db.execute("DELETE FROM leases WHERE site = ?", (site,))
+                db.execute("COMMIT")
+                return None
+            holder=uuid.uuid4().hex
+            db.execute("INSERT OR REPLACE INTO leases (site, holder, expires) VALUES (?, ?, ?)", (site, holder, now+leaseTime))
+            db.executemany("UPDATE tickets SET state = ?, batch = ? WHERE id = ?", [(self.RUNNING, holder, ticket[0]) for ticket in tickets])
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        return holder, tickets
+
+    def _renew(self, db, site, holder, leaseTime):
+        # Called before every request of the leader. Raises LeaseLostError
+        # once another worker took the lease over.
+        renewed=db.execute("UPDATE leases SET expires = ? WHERE site = ? AND holder = ?", (time.time()+leaseTime, site, holder)).rowcount
+        if renewed == 0:
+            raise LeaseLostError("The activation lease of "+str(site)+" was taken over")
+
+    def _runBatch(self, db, cmkAccess, site, leaseTime, holder, tickets):
+        # An empty site list activates all sites, so it wins over any subset.
+        requestedSites=[json.loads(ticket[1]) for ticket in tickets]
+        if any(sites is None or len(sites) == 0 for sites in requestedSites):
+            sites=[]
+        else:
+            sites=sorted(set(siteID for siteSet in requestedSites for siteID in siteSet))
+        force_foreign_changes=any(ticket[2] for ticket in tickets)
+        logger.info("Activating "+str(site)+" for "+str(len(tickets))+" queued request(s)")
+
+        try:
+            result=self._activate(db, cmkAccess, site, leaseTime, holder, sites, force_foreign_changes)
+        except LeaseLostError as e:
+            # The new leader has reset these tickets and activates them again
+            logger.warning(str(e)+", leaving the queued requests to the new leader")
+            return
+        except Exception as e:
+            logger.error("Activation of "+str(site)+" failed: "+str(e))
+            result="Failed: "+str(e)
+
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            finished=db.execute("UPDATE tickets SET state = ?, result = ?, finished = ? WHERE batch = ?", (self.DONE, json.dumps(result), time.time(), holder)).rowcount
+            db.execute("DELETE FROM leases WHERE site = ? AND holder = ?", (site, holder))
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        if finished == 0:
+            logger.warning("The activation lease of "+str(site)+" was taken over, its queued requests are activated again")
+
+    def _activate(self, db, cmkAccess, site, leaseTime, holder, sites, force_foreign_changes):
+        self._renew(db, site, holder, leaseTime)
+        activation=cmk_RESTAPI.AllActivations(cmkAccess=cmkAccess, loadChanges=False)
+        response=activation.activatePendingChanges(
+            cmkAccess=cmkAccess,
+            redirect=False,
+            sites=sites,
+            force_foreign_changes=force_foreign_changes,
+            retries=self._retries
+        )
+        if response == 422:
+            # Nothing pending: the waiters' changes are already active.
+            return "Done"
+        if response != "Started" or activation.lastActivationRun is None:
+            return response
+
+        activationRun=activation.lastActivationRun
+        started=time.monotonic()
+        while activationRun.is_running:
+            if time.monotonic()-started > self._timeout:
+                return "Activation "+str(activationRun.id)+" did not finish within "+str(self._timeout)+"s"
+            time.sleep(self._pollInterval)
+            self._renew(db, site, holder, leaseTime)
+            activationRun=cmk_RESTAPI.ActivationRun.ShowActivation(activationID=activationRun.id, cmkAccess=cmkAccess)
+        failedSites=sorted(siteID for siteID in activationRun.status_per_site if activationRun.siteFailed(siteID))
+        if len(failedSites) > 0:
+            return "Failed: "+", ".join(failedSites)
+        return "Done"
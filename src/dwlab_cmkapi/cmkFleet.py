@@ -0,0 +1,168 @@
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dwlab_cmkapi import cmk_RESTAPI
+
+import logging
+logger=logging.getLogger(__name__)
+
+class cmkFleetResult:
+    def __init__(self,
+                 results=None,
+                 errors=None
+                 ):
+        self._results=results if results is not None else {}
+        self._errors=errors if errors is not None else {}
+
+    @property
+    def results(self):
+        return self._results
+
+    @property
+    def errors(self):
+        return self._errors
+
+    @property
+    def ok(self):
+        return len(self._errors)==0
+
+    def __getitem__(self, siteName):
+        if siteName in self._errors:
+            raise self._errors[siteName]
+        return self._results[siteName]
+
+    def __iter__(self):
+        return iter(self._results)
+
+    def __len__(self):
+        return len(self._results)
+
+class cmkSiteFleet:
+    def __init__(self,
+                 sites=None,
+                 maxWorkers=16
+                 ):
+        function_name = sys._getframe().f_code.co_name
+        class_name=self.__class__.__name__
+        function_name=class_name+"."+function_name
+        logger.debug("Entering function "+str(function_name))
+
+        if not isinstance(maxWorkers, int) or maxWorkers < 1:
+            raise ValueError("maxWorkers must be a positive integer")
+        self._maxWorkers=maxWorkers
+        self._sites={}
+        self._lock=threading.Lock()
+        if sites is not None:
+            for siteName, cmkAccess in sites.items():
+                self.addSite(siteName, cmkAccess)
+
+    @property
+    def sites(self):
+        with self._lock:
+            return dict(self._sites)
+
+    @property
+    def siteNames(self):
+        with self._lock:
+            return list(self._sites.keys())
+
+    @property
+    def maxWorkers(self):
+        return self._maxWorkers
+
+    def addSite(self, siteName, cmkAccess):
+        if not isinstance(siteName, str) or siteName == "":
+            raise ValueError("siteName must be a non-empty string")
+        if not isinstance(cmkAccess, cmk_RESTAPI.RestAPIcredentials):
+            raise TypeError("cmkAccess must be an instance of RestAPIcredentials")
+        with self._lock:
+            self._sites[siteName]=cmkAccess
+
+    def removeSite(self, siteName):
+        with self._lock:
+            self._sites.pop(siteName, None)
+
+    def getSite(self, siteName):
+        with self._lock:
+            if siteName not in self._sites:
+                raise ResourceWarning("Site "+str(siteName)+" is not part of the fleet")
+            return self._sites[siteName]
+
+    @classmethod
+    def fromCredentials(cls, siteCredentials=None, maxWorkers=16):
+        # siteCredentials maps site names to keyword arguments for
+        # RestAPIcredentials. The credentials (and thereby the version
+        # lookup of every site) are created concurrently.
+        if siteCredentials is None:
+            raise ValueError("siteCredentials is empty")
+        fleet=cls(maxWorkers=maxWorkers)
+        result=fleet._runConcurrently(
+            lambda siteName: cmk_RESTAPI.RestAPIcredentials(**siteCredentials[siteName]),
+            list(siteCredentials.keys())
+        )
+        for siteName, error in result.errors.items():
+            logger.error("Site "+str(siteName)+" could not be added to the fleet: "+str(error))
+        for siteName, cmkAccess in result.results.items():
+            fleet.addSite(siteName, cmkAccess)
+        return fleet
+
+    def _runConcurrently(self, function, siteNames):
+        results={}
+        errors={}
+        if len(siteNames)==0:
+            return cmkFleetResult(results, errors)
+        def run(siteName):
+            try:
+                return (siteName, function(siteName), None)
+            except Exception as e:
+                return (siteName, None, e)
+        with ThreadPoolExecutor(max_workers=min(self._maxWorkers, len(siteNames))) as executor:
+            for siteName, result, error in executor.map(run, siteNames):
+                if error is None:
+                    results[siteName]=result
+                else:
+                    logger.warning("Query against site "+str(siteName)+" failed: "+str(error))
+                    errors[siteName]=error
+        return cmkFleetResult(results, errors)
+
+    def runOnSites(self, function, sites=None):
+        # Calls function(cmkAccess) for every (or every selected) site
+        # concurrently and returns the results keyed by site name.
+        siteNames=self.siteNames if sites is None else list(sites)
+        return self._runConcurrently(
+            lambda siteName: function(self.getSite(siteName)),
+            siteNames
+        )
+
+    def refreshVersions(self, sites=None):
+        def refresh(cmkAccess):
+            cmkAccess.version=cmk_RESTAPI.Version.getVersion(cmkAccess)
+            return cmkAccess.version
+        return self.runOnSites(refresh, sites)
+
+    def getVersions(self, sites=None):
+        return self.runOnSites(lambda cmkAccess: cmkAccess.version, sites)
+
+    def getHostLists(self, sites=None):
+        return self.runOnSites(
+            lambda cmkAccess: cmk_RESTAPI.HostConfig.ListHosts(cmkAccess=cmkAccess),
+            sites
+        )
+
+    def getPendingChanges(self, sites=None):
+        return self.runOnSites(
+            lambda cmkAccess: cmk_RESTAPI.AllActivations(cmkAccess=cmkAccess).value,
+            sites
+        )
+
+    def getPendingChangeCounts(self, sites=None):
+        return self.runOnSites(
+            lambda cmkAccess: cmk_RESTAPI.AllActivations.pendingChangeCount(cmkAccess=cmkAccess),
+            sites
+        )
+
+    def getSiteConnections(self, sites=None):
+        return self.runOnSites(
+            lambda cmkAccess: cmk_RESTAPI.SiteAllConnections(cmkAccess=cmkAccess),
+            sites
+        )
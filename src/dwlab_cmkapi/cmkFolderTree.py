@@ -0,0 +1,185 @@
+import sys
+from dwlab_cmkapi import cmk_RESTAPI
+
+import logging
+logger=logging.getLogger(__name__)
+
+class cmkFolderTree:
+    # Folder hierarchy of a site indexed by path ("/", "/a", "/a/b"). Hosts
+    # are kept in one list ordered depth-first, so the hosts below any
+    # folder are a contiguous slice of it and hostsIn() needs no tree walk.
+    def __init__(self,
+                 folderConfigs=None,
+                 hostConfigs=None
+                 ):
+        function_name = sys._getframe().f_code.co_name
+        class_name=self.__class__.__name__
+        function_name=class_name+"."+function_name
+        logger.debug("Entering function "+str(function_name))
+
+        if folderConfigs is None:
+            raise ValueError("folderConfigs is empty")
+        self._folders={}
+        self._parents={}
+        self._children={}
+        self._hostsByFolder={}
+        self._hostConfigs={}
+
+        for folder_config in folderConfigs:
+            path=self.normalizePath(folder_config.extensions.path)
+            self._folders[path]=folder_config
+            self._children.setdefault(path, [])
+            self._hostsByFolder[path]=list(folder_config.hostNames)
+        if "/" not in self._folders:
+            self._folders["/"]=cmk_RESTAPI.FolderConfig(id="~", title="Main")
+            self._children.setdefault("/", [])
+            self._hostsByFolder.setdefault("/", [])
+        # Parents missing from a partial listing are added as empty folders
+        # so every path is reachable from the root.
+        for path in list(self._folders.keys()):
+            while path != "/":
+                parent=self.parentPath(path)
+                if parent not in self._folders:
+                    self._folders[parent]=cmk_RESTAPI.FolderConfig(
+                        id=parent.replace("/", "~"),
+                        title=parent.rsplit("/", 1)[-1],
+                        extensions=cmk_RESTAPI.FolderExtensions(path=parent)
+                    )
+                    self._children.setdefault(parent, [])
+                    self._hostsByFolder.setdefault(parent, [])
+                self._parents[path]=parent
+                if path not in self._children[parent]:
+                    self._children[parent].append(path)
+                path=parent
+        for path in self._children:
+            self._children[path].sort()
+
+        if hostConfigs is not None:
+            self._hostsByFolder={path: [] for path in self._folders}
+            for host_config in hostConfigs:
+                path=self.normalizePath(host_config.extensions.folder)
+                if path not in self._folders:
+                    logger.warning("Host "+str(host_config.id)+" is in unknown folder "+str(path))
+                    continue
+                self._hostsByFolder[path].append(host_config.id)
+                self._hostConfigs[host_config.id]=host_config
+
+        self._buildHostIndex()
+        logger.debug("Leaving function "+str(function_name))
+
+    def _buildHostIndex(self):
+        self._hostOrder=[]
+        self._hostRanges={}
+        self._hostFolders={}
+        # Depth-first without recursion, so deep trees don't hit the
+        # recursion limit. A folder is pushed a second time with its own
+        # range to close it once all its subfolders were visited.
+        stack=[("/", None)]
+        while len(stack) > 0:
+            path, ownRange=stack.pop()
+            if ownRange is not None:
+                self._hostRanges[path]=(ownRange[0], ownRange[1], len(self._hostOrder))
+                continue
+            start=len(self._hostOrder)
+            for hostName in sorted(self._hostsByFolder.get(path, [])):
+                self._hostOrder.append(hostName)
+                self._hostFolders[hostName]=path
+            stack.append((path, (start, len(self._hostOrder))))
+            stack.extend((child, None) for child in reversed(self._children[path]))
+
+    @staticmethod
+    def normalizePath(path):
+        # Accepts "/" paths as well as "~" separated folder ids.
+        path=str(path).replace("~", "/")
+        return "/"+path.strip("/")
+
+    @staticmethod
+    def parentPath(path):
+        parent=path.rsplit("/", 1)[0]
+        return parent if parent != "" else "/"
+
+    @classmethod
+    def load(cls, cmkAccess=None, root="/", showHosts=True, parallel=False):
+        # Loads the tree below root with one recursive collection call, or
+        # level by level with one call per folder, bounded by the site's
+        # AdaptiveLimiter, when parallel is set. The latter suits sites whose
+        # recursive listing with hosts is too large for a single response.
+        function_name = sys._getframe().f_code.co_name
+        logger.debug("Entering function "+str(cls.__name__)+"."+str(function_name))
+
+        if not isinstance(cmkAccess, cmk_RESTAPI.RestAPIcredentials):
+            raise TypeError("cmkAccess must be an instance of RestAPIcredentials")
+        rootID=cls.normalizePath(root).replace("/", "~")
+
+        folderConfigs={}
+        rootFolder=cmk_RESTAPI.FolderConfig.ShowFolder(folder=rootID, showHosts=showHosts, cmkAccess=cmkAccess)
+        if rootFolder is None:
+            raise ValueError("Folder "+str(root)+" not found")
+        folderConfigs[cls.normalizePath(rootFolder.extensions.path)]=rootFolder
+
+        if not parallel:
+            for folder_config in cmk_RESTAPI.FolderConfig.ListFolders(parent=rootID, recursive=True, showHosts=showHosts, cmkAccess=cmkAccess):
+                folderConfigs.setdefault(cls.normalizePath(folder_config.extensions.path), folder_config)
+        else:
+            level=[rootID]
+            while len(level) > 0:
+                outcomes=cmkAccess.adaptiveLimiter.map(
+                    lambda folderID: cmk_RESTAPI.FolderConfig.ListFolders(parent=folderID, recursive=False, showHosts=showHosts, cmkAccess=cmkAccess),
+                    level
+                )
+                children=cmk_RESTAPI.BulkOperationError.check("ListFolders", outcomes)
+                level=[]
+                for folderID in children:
+                    for folder_config in children[folderID]:
+                        path=cls.normalizePath(folder_config.extensions.path)
+                        if path not in folderConfigs:
+                            folderConfigs[path]=folder_config
+                            level.append(path.replace("/", "~"))
+
+        logger.info("Loaded "+str(len(folderConfigs))+" folders below "+str(root))
+        return cls(folderConfigs=list(folderConfigs.values()))
+
+    @property
+    def paths(self):
+        return sorted(self._folders.keys())
+
+    def __contains__(self, path):
+        return self.normalizePath(path) in self._folders
+
+    def __len__(self):
+        return len(self._folders)
+
+    def folder(self, path):
+        return self._folders[self.normalizePath(path)]
+
+    def parent(self, path):
+        path=self.normalizePath(path)
+        if path == "/":
+            return None
+        return self._folders[self._parents[path]]
+
+    def children(self, path):
+        return [self._folders[child] for child in self._children[self.normalizePath(path)]]
+
+    def walk(self, path="/"):
+        # Yields the paths of the folder and all subfolders depth-first.
+        stack=[self.normalizePath(path)]
+        while len(stack) > 0:
+            current=stack.pop()
+            yield current
+            stack.extend(reversed(self._children[current]))
+
+    def hostsIn(self, path="/", recursive=True):
+        start, ownEnd, end=self._hostRanges[self.normalizePath(path)]
+        return self._hostOrder[start:end if recursive else ownEnd]
+
+    def hostCount(self, path="/", recursive=True):
+        start, ownEnd, end=self._hostRanges[self.normalizePath(path)]
+        return (end if recursive else ownEnd)-start
+
+    def folderOf(self, hostName):
+        return self._hostFolders.get(hostName)
+
+    def hostConfig(self, hostName):
+        # Only available when the tree was built with hostConfigs.
+        return self._hostConfigs.get(hostName)
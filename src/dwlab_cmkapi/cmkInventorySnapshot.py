@@ -0,0 +1,257 @@
+import sys
+import time
+import mmap
+import struct
+import marshal
+from collections.abc import Mapping
+from pathlib import Path
+from dwlab_cmkapi import cmk_RESTAPI
+
+import logging
+logger=logging.getLogger(__name__)
+
+class SnapshotVersionError(ValueError):
+    pass
+
+class cmkSnapshotRecords(Mapping):
+    # Read-only mapping over records of a memory-mapped snapshot. Records are
+    # unmarshalled and decoded (e.g. through HostConfig.from_dict) only when
+    # they are accessed for the first time.
+    def __init__(self, buffer, index, decode):
+        self._buffer=buffer
+        self._index=index
+        self._decode=decode
+        self._decoded={}
+
+    def __getitem__(self, key):
+        if key not in self._decoded:
+            offset, length=self._index[key]
+            self._decoded[key]=self._decode(marshal.loads(self._buffer[offset:offset+length]))
+        return self._decoded[key]
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, key):
+        return key in self._index
+
+class cmkInventory:
+    def __init__(self,
+                 version=None,
+                 hosts=None,
+                 siteConnections=None,
+                 pendingChanges=None,
+                 created=None
+                 ):
+        if not isinstance(version, cmk_RESTAPI.Version):
+            raise TypeError("version must be an instance of Version")
+        self._version=version
+        self._hosts=hosts if hosts is not None else {}
+        self._siteConnections=siteConnections if siteConnections is not None else {}
+        self._pendingChanges=pendingChanges if pendingChanges is not None else []
+        self._created=created if created is not None else time.time()
+        self._mmap=None
+
+    @property
+    def version(self):
+        return self._version
+
+    @property
+    def hosts(self):
+        return self._hosts
+
+    @property
+    def siteConnections(self):
+        return self._siteConnections
+
+    @property
+    def pendingChanges(self):
+        return self._pendingChanges
+
+    @property
+    def created(self):
+        return self._created
+
+    @classmethod
+    def fetch(cls, cmkAccess=None):
+        function_name = sys._getframe().f_code.co_name
+        logger.debug("Entering function "+str(cls.__name__)+"."+str(function_name))
+
+        if not isinstance(cmkAccess, cmk_RESTAPI.RestAPIcredentials):
+            raise TypeError("cmkAccess must be an instance of RestAPIcredentials")
+        hosts={host_config.id: host_config for host_config in cmk_RESTAPI.HostConfig.ListHosts(cmkAccess=cmkAccess)}
+        siteConnections={site_connection.id: site_connection for site_connection in cmk_RESTAPI.SiteAllConnections(cmkAccess=cmkAccess).value}
+        pendingChanges=list(cmk_RESTAPI.AllActivations(cmkAccess=cmkAccess).value)
+        return cls(
+            version=cmkAccess.version,
+            hosts=hosts,
+            siteConnections=siteConnections,
+            pendingChanges=pendingChanges
+        )
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap=None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+class cmkInventorySnapshot:
+    # File layout:
+    #   fixed header  MAGIC, format version, marshal version, major and minor
+    #                 version of the writing interpreter, flags and the
+    #                 offsets/lengths of the meta and index blocks
+    #   records       one marshalled dict per host, site connection and the
+    #                 list of pending changes
+    #   index         marshalled {kind: {key: (offset, length)}}
+    #   meta          marshalled {"version": Version.to_dict(), "created": ...}
+    #
+    # marshal is only stable within one interpreter version and is not safe
+    # against crafted input, so snapshots are local caches written and read
+    # by the same installation: files from another Python version are
+    # rejected with SnapshotVersionError and must never come from untrusted
+    # sources.
+    MAGIC=b"DWCMKINV"
+    FORMAT_VERSION=2
+    HEADER=struct.Struct("<8sHHBBHQQQQ")
+
+    @classmethod
+    def save(cls, inventory, path=None):
+        function_name = sys._getframe().f_code.co_name
+        logger.debug("Entering function "+str(cls.__name__)+"."+str(function_name))
+
+        if not isinstance(inventory, cmkInventory):
+            raise TypeError("inventory must be an instance of cmkInventory")
+        if path is None:
+            raise ValueError("path is empty")
+        path=Path(path)
+        temporaryPath=path.with_name(path.name+".tmp")
+
+        index={"hosts": {}, "site_connections": {}, "pending_changes": None}
+        with open(temporaryPath, "wb") as snapshotFile:
+            snapshotFile.write(b"\0"*cls.HEADER.size)
+            offset=cls.HEADER.size
+
+            def writeRecord(dataDict):
+                nonlocal offset
+                data=marshal.dumps(dataDict)
+                snapshotFile.write(data)
+                location=(offset, len(data))
+                offset+=len(data)
+                return location
+
+            for hostName in inventory.hosts:
+                host_config=inventory.hosts[hostName]
+                index["hosts"][hostName]=writeRecord({"etag": host_config.etag, "data": host_config.to_dict()})
+            for siteID in inventory.siteConnections:
+                index["site_connections"][siteID]=writeRecord(inventory.siteConnections[siteID].to_dict(version=inventory.version))
+            index["pending_changes"]=writeRecord([change.to_dict() for change in inventory.pendingChanges])
+
+            indexOffset=offset
+            indexData=marshal.dumps(index)
+            indexLength=len(indexData)
+            snapshotFile.write(indexData)
+            metaOffset=indexOffset+indexLength
+            meta=marshal.dumps({"version": inventory.version.to_dict(), "created": inventory.created})
+            snapshotFile.write(meta)
+
+            snapshotFile.seek(0)
+            snapshotFile.write(cls.HEADER.pack(
+                cls.MAGIC, cls.FORMAT_VERSION, marshal.version,
+                sys.version_info[0], sys.version_info[1], 0,
+                metaOffset, len(meta), indexOffset, indexLength
+            ))
+        temporaryPath.replace(path)
+        logger.info("Saved snapshot of "+str(len(inventory.hosts))+" hosts and "+str(len(inventory.siteConnections))+" site connections to "+str(path))
+        return path
+
+    @classmethod
+    def readVersion(cls, path=None):
+        # Reads only the header and meta block, e.g. to decide whether a
+        # snapshot is still usable for the site's current Checkmk version.
+        function_name = sys._getframe().f_code.co_name
+        logger.debug("Entering function "+str(cls.__name__)+"."+str(function_name))
+
+        if path is None:
+            raise ValueError("path is empty")
+        with open(path, "rb") as snapshotFile:
+            buffer=mmap.mmap(snapshotFile.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            meta, index=cls._readHeader(buffer, readIndex=False)
+        finally:
+            buffer.close()
+        return cmk_RESTAPI.Version(**meta["version"])
+
+    @classmethod
+    def _readHeader(cls, buffer, readIndex=True):
+        if len(buffer) < cls.HEADER.size:
+            raise ValueError("Snapshot file is truncated")
+        magic, formatVersion=struct.unpack_from("<8sH", buffer, 0)
+        if magic != cls.MAGIC:
+            raise ValueError("Not a DW-Lab inventory snapshot")
+        if formatVersion != cls.FORMAT_VERSION:
+            raise SnapshotVersionError("Snapshot format "+str(formatVersion)+" is not supported")
+        (magic, formatVersion, marshalVersion, pythonMajor, pythonMinor, flags,
+         metaOffset, metaLength, indexOffset, indexLength)=cls.HEADER.unpack_from(buffer, 0)
+        if marshalVersion != marshal.version or (pythonMajor, pythonMinor) != tuple(sys.version_info[:2]):
+            raise SnapshotVersionError(
+                "Snapshot was written by Python "+str(pythonMajor)+"."+str(pythonMinor)+" (marshal "+str(marshalVersion)+")"
+                +", this is Python "+str(sys.version_info[0])+"."+str(sys.version_info[1])+" (marshal "+str(marshal.version)+")"
+            )
+        meta=marshal.loads(buffer[metaOffset:metaOffset+metaLength])
+        index=marshal.loads(buffer[indexOffset:indexOffset+indexLength]) if readIndex else None
+        return meta, index
+
+    @classmethod
+    def load(cls, path=None, expectedVersion=None):
+        # Memory-maps the snapshot and returns a cmkInventory whose hosts and
+        # site connections are decoded lazily on first access. When
+        # expectedVersion is given, snapshots taken from another Checkmk
+        # version are rejected with SnapshotVersionError.
+        function_name = sys._getframe().f_code.co_name
+        logger.debug("Entering function "+str(cls.__name__)+"."+str(function_name))
+
+        if path is None:
+            raise ValueError("path is empty")
+        with open(path, "rb") as snapshotFile:
+            buffer=mmap.mmap(snapshotFile.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            meta, index=cls._readHeader(buffer)
+            version=cmk_RESTAPI.Version(**meta["version"])
+            if expectedVersion is not None and expectedVersion.checkmk_version != version.checkmk_version:
+                raise SnapshotVersionError("Snapshot was taken from Checkmk "+str(version.checkmk_version)+", expected "+str(expectedVersion.checkmk_version))
+        except Exception:
+            buffer.close()
+            raise
+
+        def decodeHost(record):
+            host_config=cmk_RESTAPI.HostConfig.from_dict(dataDict=record["data"])
+            host_config.etag=record["etag"]
+            return host_config
+
+        def decodeSiteConnection(record):
+            site_connection=cmk_RESTAPI.SiteConnection.from_dict(dataDict=record)
+            site_connection.version=version
+            return site_connection
+
+        offset, length=index["pending_changes"]
+        pendingChanges=[
+            cmk_RESTAPI.Change().map_dataDict_to_Change(changeDict)
+            for changeDict in marshal.loads(buffer[offset:offset+length])
+        ]
+        inventory=cmkInventory(
+            version=version,
+            hosts=cmkSnapshotRecords(buffer, index["hosts"], decodeHost),
+            siteConnections=cmkSnapshotRecords(buffer, index["site_connections"], decodeSiteConnection),
+            pendingChanges=pendingChanges,
+            created=meta["created"]
+        )
+        inventory._mmap=buffer
+        return inventory
@@ -0,0 +1,277 @@
+import sys
+import time
+import asyncio
+import threading
+from concurrent.futures import Future, InvalidStateError
+from dwlab_cmkapi import cmk_RESTAPI
+
+import logging
+logger=logging.getLogger(__name__)
+
+class cmkTrackedJob:
+    def __init__(self,
+                 domainType="",
+                 jobID="",
+                 timeout=None,
+                 interval=1
+                 ):
+        self._domainType=domainType
+        self._jobID=jobID
+        self._future=Future()
+        self._started=time.monotonic()
+        self._deadline=None if timeout is None else self._started+timeout
+        self._interval=interval
+        self._nextPoll=self._started+interval
+        self._polls=0
+        self._failures=0
+        self._lastStatus=None
+
+    @property
+    def key(self):
+        return (self._domainType, self._jobID)
+
+    @property
+    def domainType(self):
+        return self._domainType
+
+    @property
+    def jobID(self):
+        return self._jobID
+
+    @property
+    def future(self):
+        return self._future
+
+    @property
+    def polls(self):
+        return self._polls
+
+    @property
+    def failures(self):
+        # Consecutive failed status reads
+        return self._failures
+
+    @property
+    def lastStatus(self):
+        return self._lastStatus
+
+class cmkJobTracker:
+    # Follows any number of background jobs of one site (service discovery,
+    # bulk discovery, activation runs, generic background jobs) from a
+    # single polling thread. Each job gets a Future resolving to its final
+    # BackgroundJob; tracking the same job twice shares the Future.
+    #
+    # Per round only jobs that are due are polled, and the poll interval of
+    # a job grows from interval to maxInterval while it keeps running.
+    # Running activations are read with one collection request; only the
+    # ones that left it are read individually. The remaining status reads
+    # of a round go out concurrently through the site's AdaptiveLimiter.
+    #
+    # A failed status read is retried with the same backoff; after more
+    # than `retries` failures in a row the job's Future fails. Any other
+    # error of a round fails the Futures of the jobs polled in it, so no
+    # caller is left waiting on a Future the thread no longer serves.
+    def __init__(self,
+                 cmkAccess=None,
+                 interval=1,
+                 maxInterval=15,
+                 backoff=1.5,
+                 timeout=None,
+                 retries=3
+                 ):
+        function_name = sys._getframe().f_code.co_name
+        class_name=self.__class__.__name__
+        function_name=class_name+"."+function_name
+        logger.debug("Entering function "+str(function_name))
+
+        if not isinstance(cmkAccess, cmk_RESTAPI.RestAPIcredentials):
+            raise TypeError("cmkAccess must be an instance of RestAPIcredentials")
+        self._cmkAccess=cmkAccess
+        self._interval=interval
+        self._maxInterval=maxInterval
+        self._backoff=backoff
+        self._timeout=timeout
+        self._retries=retries
+        self._jobs={}
+        self._lock=threading.Lock()
+        self._wakeup=threading.Event()
+        self._thread=None
+        self._runningCollection=True
+        self._requests=0
+
+    @property
+    def pending(self):
+        with self._lock:
+            return len(self._jobs)
+
+    @property
+    def requests(self):
+        # Status requests sent so far
+        return self._requests
+
+    def track(self, job=None, domainType=None, jobID=None, timeout=None):
+        # job is a BackgroundJob or ActivationRun; otherwise domainType and
+        # jobID name the job (jobID is the host name for
+        # service_discovery_run). timeout defaults to the tracker's.
+        if isinstance(job, cmk_RESTAPI.ActivationRun):
+            domainType, jobID="activation_run", job.id
+        elif isinstance(job, cmk_RESTAPI.BackgroundJob):
+            domainType, jobID=job.domainType or "background_job", job.id
+        elif job is not None:
+            raise TypeError("job must be a BackgroundJob or an ActivationRun")
+        if domainType not in cmk_RESTAPI.BackgroundJob.STATUS_URLS:
+            raise ValueError("Unsupported job type "+str(domainType))
+        if jobID is None or jobID == "":
+            raise ValueError("jobID is empty")
+
+        with self._lock:
+            tracked=self._jobs.get((domainType, jobID))
+            if tracked is None:
+                tracked=cmkTrackedJob(
+                    domainType=domainType, jobID=jobID,
+                    timeout=timeout if timeout is not None else self._timeout,
+                    interval=self._interval
+                )
+                self._jobs[tracked.key]=tracked
+            if self._thread is None or not self._thread.is_alive():
+                self._thread=threading.Thread(target=self._run, name="cmkJobTracker", daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+        return tracked.future
+
+    def trackDiscovery(self, hostName, timeout=None):
+        return self.track(domainType="service_discovery_run", jobID=hostName, timeout=timeout)
+
+    def trackDiscoveries(self, discoveries, timeout=None):
+        # Takes the result of HostConfig.executeDiscoveries and returns the
+        # futures keyed by host name; hosts of one bulk discovery share it.
+        futures={}
+        for hostName, discovery in discoveries.items():
+            if isinstance(discovery, cmk_RESTAPI.BackgroundJob):
+                futures[hostName]=self.track(job=discovery, timeout=timeout)
+            else:
+                futures[hostName]=self.trackDiscovery(hostName, timeout=timeout)
+        return futures
+
+    def trackActivation(self, activation, timeout=None):
+        # activation is an ActivationRun or an activation id
+        if isinstance(activation, cmk_RESTAPI.ActivationRun):
+            return self.track(job=activation, timeout=timeout)
+        return self.track(domainType="activation_run", jobID=activation, timeout=timeout)
+
+    def awaitable(self, future):
+        # For use from asyncio code: await tracker.awaitable(future)
+        return asyncio.wrap_future(future)
+
+    def _run(self):
+        try:
+            while True:
+                with self._lock:
+                    if len(self._jobs) == 0:
+                        self._thread=None
+                        return
+                    now=time.monotonic()
+                    due=[tracked for tracked in self._jobs.values() if tracked.future.cancelled() or tracked._nextPoll <= now
+                         or (tracked._deadline is not None and tracked._deadline <= now)]
+                    nextPoll=min(
+                        [tracked._nextPoll for tracked in self._jobs.values()]
+                        +[tracked._deadline for tracked in self._jobs.values() if tracked._deadline is not None]
+                    )
+                if len(due) > 0:
+                    try:
+                        self._poll(due)
+                    except Exception as e:
+                        logger.exception("Polling "+str(len(due))+" background job(s) failed")
+                        for tracked in due:
+                            self._finish(tracked, exception=e)
+                    continue
+                self._wakeup.wait(max(0, nextPoll-time.monotonic()))
+                self._wakeup.clear()
+        except BaseException as e:
+            logger.exception("The job tracker stopped")
+            with self._lock:
+                remaining=list(self._jobs.values())
+                self._thread=None
+            for tracked in remaining:
+                self._finish(tracked, exception=RuntimeError("The job tracker stopped: "+(str(e) or type(e).__name__)))
+            raise
+
+    def _poll(self, due):
+        now=time.monotonic()
+        toRead=[]
+        for tracked in due:
+            if tracked.future.cancelled():
+                self._finish(tracked)
+            elif tracked._deadline is not None and tracked._deadline <= now:
+                self._finish(tracked, exception=TimeoutError(
+                    str(tracked.domainType)+" "+str(tracked.jobID)+" did not finish within "+str(round(tracked._deadline-tracked._started, 1))+"s"
+                ))
+            else:
+                toRead.append(tracked)
+
+        activations=[tracked for tracked in toRead if tracked.domainType == "activation_run"]
+        if len(activations) > 1 and self._runningCollection:
+            try:
+                self._requests+=1
+                running=cmk_RESTAPI.BackgroundJob.ListRunningActivations(cmkAccess=self._cmkAccess)
+            except Exception as e:
+                logger.warning("Reading the running activations failed: "+str(e))
+                running=None
+            if running is None:
+                self._runningCollection=False
+            else:
+                runningJobs={job.id: job for job in running}
+                for tracked in activations:
+                    if tracked.jobID in runningJobs:
+                        self._update(tracked, runningJobs[tracked.jobID])
+                toRead=[tracked for tracked in toRead if tracked.domainType != "activation_run" or tracked.jobID not in runningJobs]
+
+        self._requests+=len(toRead)
+        outcomes=self._cmkAccess.adaptiveLimiter.map(
+            lambda tracked: cmk_RESTAPI.BackgroundJob.ShowBackgroundJob(jobID=tracked.jobID, cmkAccess=self._cmkAccess, domainType=tracked.domainType),
+            toRead
+        )
+        for tracked, job, exception in outcomes:
+            if exception is not None:
+                self._retry(tracked, exception)
+            elif job is None:
+                self._finish(tracked, exception=RuntimeError(str(tracked.domainType)+" "+str(tracked.jobID)+" not found"))
+            else:
+                try:
+                    self._update(tracked, job)
+                except Exception as e:
+                    logger.exception("Evaluating "+str(tracked.domainType)+" "+str(tracked.jobID)+" failed")
+                    self._finish(tracked, exception=e)
+
+    def _update(self, tracked, job):
+        tracked._polls+=1
+        tracked._failures=0
+        tracked._lastStatus=job
+        if not job.active:
+            self._finish(tracked, result=job)
+            return
+        self._reschedule(tracked)
+
+    def _retry(self, tracked, exception):
+        tracked._failures+=1
+        if tracked._failures > self._retries:
+            self._finish(tracked, exception=exception)
+            return
+        logger.warning("Reading "+str(tracked.domainType)+" "+str(tracked.jobID)+" failed ("+str(tracked._failures)+"/"+str(self._retries)+"), retrying: "+str(exception))
+        self._reschedule(tracked)
+
+    def _reschedule(self, tracked):
+        tracked._interval=min(tracked._interval*self._backoff, self._maxInterval)
+        tracked._nextPoll=time.monotonic()+tracked._interval
+
+    def _finish(self, tracked, result=None, exception=None):
+        with self._lock:
+            self._jobs.pop(tracked.key, None)
+        try:
+            if exception is not None:
+                tracked.future.set_exception(exception)
+            else:
+                tracked.future.set_result(result)
+        except InvalidStateError:
+            # Cancelled by the caller meanwhile
+            pass
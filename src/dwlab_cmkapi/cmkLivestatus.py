@@ -0,0 +1,786 @@
+import os
+import socket
+import ssl
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait
+from dwlab_cmkapi import cmk_RESTAPI
+
+import logging
+logger=logging.getLogger(__name__)
+
+class LivestatusError(RuntimeError):
+    def __init__(self, message, statusCode=0):
+        super().__init__(message)
+        self.statusCode=statusCode
+
+class cmkLivestatusQuery:
+    # Builder for LQL queries, e.g.
+    #   cmkLivestatusQuery("services").columns("host_name", "description").filter("state", "=", 2)
+    # Filters also accept a cmk_RESTAPI.StatusQuery expression.
+    STATS_FUNCTIONS=["sum", "min", "max", "avg", "std", "suminv", "avginv"]
+
+    def __init__(self, table=""):
+        if not isinstance(table, str) or table == "":
+            raise ValueError("table must be a non-empty string")
+        self._table=self._checkValue(table)
+        self._columns=[]
+        self._lines=[]
+        self._statsFunctions=[]
+        self._limit=None
+
+    @property
+    def table(self):
+        return self._table
+
+    @property
+    def columnNames(self):
+        return list(self._columns)
+
+    @property
+    def statsCount(self):
+        return len(self._statsFunctions)
+
+    @property
+    def statsFunctions(self):
+        # Aggregation of each stats column: count, sum, min, max, avg, ...
+        return list(self._statsFunctions)
+
+    @staticmethod
+    def _checkValue(value):
+        # A line break would end the header line early and let the value
+        # add headers or, with an empty line, a second request.
+        value=str(value)
+        if "\n" in value or "\r" in value:
+            raise ValueError("Line breaks are not allowed in Livestatus queries: "+repr(value))
+        return value
+
+    def columns(self, *columns):
+        self._columns.extend(self._checkValue(column) for column in columns)
+        return self
+
+    def filter(self, column, op=None, value=None):
+        # filter("state", "=", 2), filter("state = 2") or filter(StatusQuery)
+        if isinstance(column, cmk_RESTAPI.StatusQuery):
+            self._lines.extend(self._expressionLines("Filter", column.to_dict()))
+        elif op is None:
+            self._lines.append("Filter: "+self._checkValue(column))
+        else:
+            self._lines.append("Filter: "+self._checkValue(column)+" "+self._checkValue(op)+" "+self._checkValue(value))
+        return self
+
+    def And(self, count):
+        self._lines.append("And: "+str(int(count)))
+        return self
+
+    def Or(self, count):
+        self._lines.append("Or: "+str(int(count)))
+        return self
+
+    def negate(self):
+        self._lines.append("Negate:")
+        return self
+
+    def stats(self, column, op=None, value=None):
+        # stats("state", "=", 2) and stats("state = 2") count matching rows,
+        # stats("sum latency") aggregates. The selected columns become the
+        # group-by columns.
+        if op is None:
+            self._lines.append("Stats: "+self._checkValue(column))
+            tokens=str(column).split()
+            if len(tokens) == 2 and tokens[0] in self.STATS_FUNCTIONS:
+                self._statsFunctions.append(tokens[0])
+            else:
+                self._statsFunctions.append("count")
+        else:
+            self._lines.append("Stats: "+self._checkValue(column)+" "+self._checkValue(op)+" "+self._checkValue(value))
+            self._statsFunctions.append("count")
+        return self
+
+    def statsAnd(self, count):
+        self._lines.append("StatsAnd: "+str(int(count)))
+        self._combineStats(int(count))
+        return self
+
+    def statsOr(self, count):
+        self._lines.append("StatsOr: "+str(int(count)))
+        self._combineStats(int(count))
+        return self
+
+    def _combineStats(self, count):
+        del self._statsFunctions[len(self._statsFunctions)-count:]
+        self._statsFunctions.append("count")
+
+    def limit(self, count):
+        self._limit=int(count)
+        return self
+
+    @classmethod
+    def _expressionLines(cls, header, expression):
+        op=expression["op"]
+        if op in ["and", "or"]:
+            lines=[]
+            for subExpression in expression["expr"]:
+                lines.extend(cls._expressionLines(header, subExpression))
+            lines.append(("And: " if op == "and" else "Or: ")+str(len(expression["expr"])))
+            return lines
+        if op == "not":
+            return cls._expressionLines(header, expression["expr"])+["Negate:"]
+        return [header+": "+cls._checkValue(expression["left"])+" "+cls._checkValue(op)+" "+cls._checkValue(expression["right"])]
+
+    def to_lql(self, keepAlive=False):
+        lines=["GET "+self._table]
+        if len(self._columns) > 0:
+            lines.append("Columns: "+" ".join(self._columns))
+        lines.extend(self._lines)
+        if self._limit is not None:
+            lines.append("Limit: "+str(self._limit))
+        lines.append("OutputFormat: json")
+        lines.append("ResponseHeader: fixed16")
+        if keepAlive:
+            lines.append("KeepAlive: on")
+        return "\n".join(lines)+"\n\n"
+
+class cmkLivestatusConnection:
+    # One Livestatus connection configured like the status connection of a
+    # SiteConnection. Queries use the fixed16 response header so the
+    # response length is known up front and the body is read in one piece;
+    # with keepAlive the socket stays open between queries.
+    HEADER_LENGTH=16
+
+    def __init__(self,
+                 socketType="tcp",
+                 host="",
+                 port=6557,
+                 path="",
+                 encrypted=False,
+                 verify=False,
+                 caFile=None,
+                 connectTimeout=5,
+                 queryTimeout=None,
+                 keepAlive=False,
+                 codec=None
+                 ):
+        if socketType not in ["tcp", "tcp6", "unix", "local"]:
+            raise ValueError("socketType "+str(socketType)+" is not supported")
+        if socketType in ["tcp", "tcp6"] and host == "":
+            raise ValueError("host is empty")
+        if socketType in ["unix", "local"] and path == "":
+            raise ValueError("path is empty")
+        self._socketType=socketType
+        self._host=host
+        self._port=int(port)
+        self._path=path
+        self._encrypted=encrypted
+        self._verify=verify
+        self._caFile=caFile
+        self._connectTimeout=connectTimeout
+        self._queryTimeout=queryTimeout
+        self._keepAlive=keepAlive
+        self._codec=codec if codec is not None else cmk_RESTAPI.JSONCodec()
+        self._socket=None
+        self._lock=threading.Lock()
+        self._lastUsed=0.0
+
+    @classmethod
+    def fromSiteConnection(cls, site_connection=None, viaProxy=False, proxyHost="", **kwargs):
+        # Uses status_connection.connection; with viaProxy the TCP port the
+        # Livestatus proxy daemon on proxyHost (usually the central site)
+        # offers for this site, as configured in proxy.tcp.
+        if not isinstance(site_connection, cmk_RESTAPI.SiteConnection):
+            raise TypeError("site_connection must be an instance of SiteConnection")
+        status_connection=site_connection.extensions.status_connection
+        kwargs.setdefault("connectTimeout", status_connection.connect_timeout or 5)
+        kwargs.setdefault("keepAlive", status_connection.persistent_connection)
+        if viaProxy:
+            if proxyHost == "":
+                raise ValueError("proxyHost is empty")
+            return cls(
+                socketType="tcp",
+                host=proxyHost,
+                port=status_connection.proxy.tcp.port,
+                encrypted=status_connection.proxy.tcp.tls,
+                verify=status_connection.connection.verify,
+                **kwargs
+            )
+        connection=status_connection.connection
+        socketType=connection.socket_type
+        if socketType in ["unix", "local"]:
+            kwargs.setdefault("path", cls.socketPath(connection))
+            return cls(socketType=socketType, verify=connection.verify, **kwargs)
+        return cls(
+            socketType=socketType,
+            host=connection.host,
+            port=connection.port,
+            encrypted=connection.encrypted,
+            verify=connection.verify,
+            **kwargs
+        )
+
+    @staticmethod
+    def socketPath(connection):
+        # Socket path of a unix or local status connection, "" if unknown.
+        # The local socket is the one of the site this process runs in,
+        # found through OMD_ROOT.
+        if connection.socket_type == "unix":
+            return connection.path
+        if connection.socket_type == "local" and os.environ.get("OMD_ROOT", "") != "":
+            return os.path.join(os.environ["OMD_ROOT"], "tmp", "run", "live")
+        return ""
+
+    @property
+    def arguments(self):
+        # Constructor arguments, e.g. to open further connections alike.
+        return {
+            "socketType": self._socketType,
+            "host": self._host,
+            "port": self._port,
+            "path": self._path,
+            "encrypted": self._encrypted,
+            "verify": self._verify,
+            "caFile": self._caFile,
+            "connectTimeout": self._connectTimeout,
+            "queryTimeout": self._queryTimeout,
+            "keepAlive": self._keepAlive,
+            "codec": self._codec
+        }
+
+    @property
+    def address(self):
+        if self._socketType in ["unix", "local"]:
+            return self._path
+        return str(self._host)+":"+str(self._port)
+
+    @property
+    def keepAlive(self):
+        return self._keepAlive
+
+    @property
+    def connected(self):
+        return self._socket is not None
+
+    @property
+    def lastUsed(self):
+        return self._lastUsed
+
+    def connect(self):
+        if self._socket is not None:
+            return
+        if self._socketType in ["unix", "local"]:
+            sock=socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self._connectTimeout)
+            sock.connect(self._path)
+        else:
+            sock=socket.create_connection((self._host, self._port), timeout=self._connectTimeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if self._encrypted:
+                context=ssl.create_default_context(cafile=self._caFile)
+                if not self._verify:
+                    context.check_hostname=False
+                    context.verify_mode=ssl.CERT_NONE
+                sock=context.wrap_socket(sock, server_hostname=self._host)
+        sock.settimeout(self._queryTimeout)
+        self._socket=sock
+        logger.debug("Connected to Livestatus at "+self.address)
+
+    def close(self):
+        if self._socket is not None:
+            try:
+                self._socket.close()
+            finally:
+                self._socket=None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def _receive(self, length):
+        buffer=bytearray(length)
+        view=memoryview(buffer)
+        received=0
+        while received < length:
+            count=self._socket.recv_into(view[received:], length-received)
+            if count == 0:
+                raise LivestatusError("Livestatus at "+self.address+" closed the connection")
+            received+=count
+        return buffer
+
+    def execute(self, lql, timeout=None):
+        # Sends one LQL request and returns the decoded JSON body. timeout
+        # overrides the query timeout for this request.
+        with self._lock:
+            self.connect()
+            try:
+                self._socket.settimeout(timeout if timeout is not None else self._queryTimeout)
+                self._socket.sendall(lql.encode("utf-8"))
+                header=bytes(self._receive(self.HEADER_LENGTH))
+                try:
+                    statusCode=int(header[0:3])
+                    length=int(header[4:15])
+                except ValueError:
+                    raise LivestatusError("Invalid Livestatus response header "+repr(header))
+                body=self._receive(length)
+            except Exception:
+                self.close()
+                raise
+            self._lastUsed=time.monotonic()
+            if not self._keepAlive:
+                self.close()
+        if statusCode != 200:
+            raise LivestatusError("Livestatus at "+self.address+" responded "+str(statusCode)+": "+bytes(body).decode("utf-8", "replace").strip(), statusCode)
+        return self._codec.decode(bytes(body))
+
+    def query(self, query=None, timeout=None):
+        # Returns the rows as dicts keyed by column name. Stats queries
+        # name their aggregates stats_1, stats_2, ...
+        if not isinstance(query, cmkLivestatusQuery):
+            raise TypeError("query must be an instance of cmkLivestatusQuery")
+        rows=self.execute(query.to_lql(keepAlive=self._keepAlive), timeout=timeout)
+        columnNames=query.columnNames
+        if len(columnNames) == 0 and query.statsCount == 0:
+            if len(rows) == 0:
+                return []
+            columnNames, rows=rows[0], rows[1:]
+        columnNames=columnNames+["stats_"+str(index+1) for index in range(query.statsCount)]
+        return [dict(zip(columnNames, row)) for row in rows]
+
+    def command(self, command=""):
+        # External command, e.g. "SCHEDULE_FORCED_HOST_CHECK;myhost;1700000000".
+        # Livestatus sends no response to commands.
+        if command == "":
+            raise ValueError("command is empty")
+        command=cmkLivestatusQuery._checkValue(command)
+        with self._lock:
+            self.connect()
+            try:
+                request="COMMAND ["+str(int(time.time()))+"] "+command+"\n"
+                if self._keepAlive:
+                    request+="KeepAlive: on\n"
+                self._socket.sendall((request+"\n").encode("utf-8"))
+            except Exception:
+                self.close()
+                raise
+            if not self._keepAlive:
+                self.close()
+
+class cmkLivestatusPool:
+    # Livestatus connections of one site, pooled the way the Livestatus
+    # proxy settings of its SiteConnection describe:
+    #   channels         maximum number of concurrent connections
+    #   channel_timeout  seconds to wait for a free channel
+    #   query_timeout    seconds a single query may take
+    #   connect_retry    seconds to wait after a failed connect before the
+    #                    site is tried again
+    #   heartbeat        idle connections are checked every interval and
+    #                    dropped if the check takes longer than timeout
+    # Connections stay open between queries when persistent_connection is
+    # set, otherwise each query opens its own connection.
+    # Settings of 0 fall back to the defaults of the Livestatus proxy.
+    DEFAULTS={
+        "channels": 5,
+        "channelTimeout": 3.0,
+        "queryTimeout": 120.0,
+        "connectRetry": 4.0,
+        "heartbeatInterval": 5.0,
+        "heartbeatTimeout": 2.0
+    }
+    HEARTBEAT_QUERY="GET status\nColumns: program_start\nOutputFormat: json\nResponseHeader: fixed16\nKeepAlive: on\n\n"
+
+    # One pool per site, shared by all callers
+    _pools={}
+    _poolsLock=threading.Lock()
+
+    def __init__(self,
+                 connectionArguments=None,
+                 persistent=True,
+                 channels=0,
+                 channelTimeout=0,
+                 queryTimeout=0,
+                 connectRetry=0,
+                 heartbeatInterval=0,
+                 heartbeatTimeout=0
+                 ):
+        if connectionArguments is None:
+            raise ValueError("connectionArguments is empty")
+        self._connectionArguments=dict(connectionArguments)
+        self._connectionArguments["keepAlive"]=persistent
+        self._persistent=persistent
+        self._channels=int(channels or self.DEFAULTS["channels"])
+        self._channelTimeout=float(channelTimeout or self.DEFAULTS["channelTimeout"])
+        self._queryTimeout=float(queryTimeout or self.DEFAULTS["queryTimeout"])
+        self._connectRetry=float(connectRetry or self.DEFAULTS["connectRetry"])
+        self._heartbeatInterval=float(heartbeatInterval or self.DEFAULTS["heartbeatInterval"])
+        self._heartbeatTimeout=float(heartbeatTimeout or self.DEFAULTS["heartbeatTimeout"])
+        self._connectionArguments["queryTimeout"]=self._queryTimeout
+
+        self._channelSlots=threading.BoundedSemaphore(self._channels)
+        self._idle=deque()
+        self._lock=threading.Lock()
+        self._connectFailedAt=None
+        self._closed=False
+        self._metrics={"queries": 0, "connects": 0, "reconnects": 0, "connectFailures": 0, "channelTimeouts": 0, "heartbeatFailures": 0}
+        self._heartbeatStop=threading.Event()
+        self._heartbeatThread=None
+        if self._persistent:
+            self._heartbeatThread=threading.Thread(target=self._heartbeatLoop, name="livestatus-heartbeat", daemon=True)
+            self._heartbeatThread.start()
+
+    @classmethod
+    def fromSiteConnection(cls, site_connection=None, viaProxy=False, proxyHost="", **connectionArguments):
+        if not isinstance(site_connection, cmk_RESTAPI.SiteConnection):
+            raise TypeError("site_connection must be an instance of SiteConnection")
+        status_connection=site_connection.extensions.status_connection
+        params=status_connection.proxy.params
+        template=cmkLivestatusConnection.fromSiteConnection(site_connection, viaProxy=viaProxy, proxyHost=proxyHost, **connectionArguments)
+        return cls(
+            connectionArguments=template.arguments,
+            persistent=status_connection.persistent_connection,
+            channels=params.channels,
+            channelTimeout=params.channel_timeout,
+            queryTimeout=params.query_timeout,
+            connectRetry=params.connect_retry,
+            heartbeatInterval=params.heartbeat.interval,
+            heartbeatTimeout=params.heartbeat.timeout
+        )
+
+    @classmethod
+    def forSite(cls, siteKey="", site_connection=None, **kwargs):
+        # Returns the shared pool of a site, creating it on first use.
+        # siteKey identifies the site across callers, e.g. the site id.
+        if siteKey == "":
+            raise ValueError("siteKey is empty")
+        with cls._poolsLock:
+            pool=cls._pools.get(siteKey)
+            if pool is None or pool.closed:
+                pool=cls.fromSiteConnection(site_connection, **kwargs)
+                cls._pools[siteKey]=pool
+            return pool
+
+    @classmethod
+    def closeAll(cls):
+        with cls._poolsLock:
+            pools=list(cls._pools.values())
+            cls._pools={}
+        for pool in pools:
+            pool.close()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    @property
+    def channels(self):
+        return self._channels
+
+    def metrics(self):
+        with self._lock:
+            metrics=dict(self._metrics)
+            metrics["idle"]=len(self._idle)
+        return metrics
+
+    def _newConnection(self):
+        with self._lock:
+            failedAt=self._connectFailedAt
+        if failedAt is not None and time.monotonic()-failedAt < self._connectRetry:
+            raise LivestatusError("Livestatus at "+str(self._connectionArguments.get("host") or self._connectionArguments.get("path"))+" is unreachable, next attempt in "+str(round(self._connectRetry-(time.monotonic()-failedAt), 1))+"s")
+        connection=cmkLivestatusConnection(**self._connectionArguments)
+        try:
+            connection.connect()
+        except OSError:
+            with self._lock:
+                self._connectFailedAt=time.monotonic()
+                self._metrics["connectFailures"]+=1
+            raise
+        with self._lock:
+            self._connectFailedAt=None
+            self._metrics["connects"]+=1
+        return connection
+
+    @contextmanager
+    def connection(self):
+        # Borrows a connection for one or more queries; the channel is held
+        # until the block is left.
+        if self._closed:
+            raise LivestatusError("The Livestatus pool is closed")
+        if not self._channelSlots.acquire(timeout=self._channelTimeout):
+            with self._lock:
+                self._metrics["channelTimeouts"]+=1
+            raise LivestatusError("No free Livestatus channel within "+str(self._channelTimeout)+"s")
+        connection=None
+        try:
+            with self._lock:
+                if len(self._idle) > 0:
+                    connection=self._idle.pop()
+            if connection is None:
+                connection=self._newConnection()
+            yield connection
+        finally:
+            if connection is not None:
+                if self._persistent and connection.connected and not self._closed:
+                    with self._lock:
+                        self._idle.append(connection)
+                else:
+                    connection.close()
+            self._channelSlots.release()
+
+    def _withConnection(self, action):
+        # The site may have closed an idle KeepAlive connection in the
+        # meantime; a reused connection failing this way is reconnected and
+        # the request sent once more.
+        with self.connection() as connection:
+            reused=connection.lastUsed > 0
+            try:
+                result=action(connection)
+            except (BrokenPipeError, ConnectionResetError, LivestatusError) as e:
+                if not reused or (isinstance(e, LivestatusError) and e.statusCode != 0):
+                    raise
+                logger.debug("Idle Livestatus connection to "+connection.address+" was closed, reconnecting: "+str(e))
+                with self._lock:
+                    self._metrics["reconnects"]+=1
+                result=action(connection)
+        with self._lock:
+            self._metrics["queries"]+=1
+        return result
+
+    def query(self, query=None, timeout=None):
+        return self._withConnection(lambda connection: connection.query(query, timeout=timeout))
+
+    def execute(self, lql):
+        return self._withConnection(lambda connection: connection.execute(lql))
+
+    def _heartbeatLoop(self):
+        while not self._heartbeatStop.wait(self._heartbeatInterval):
+            self.heartbeat()
+
+    def heartbeat(self):
+        # Checks idle connections unused for a heartbeat interval. Busy
+        # connections are not touched, their queries act as heartbeat.
+        # Each check holds a channel like a query, so callers can't open
+        # further connections meanwhile; with all channels busy the check
+        # waits for the next interval.
+        now=time.monotonic()
+        while self._channelSlots.acquire(blocking=False):
+            try:
+                with self._lock:
+                    due=[connection for connection in self._idle if now-connection.lastUsed >= self._heartbeatInterval]
+                    if len(due) == 0:
+                        return
+                    connection=due[0]
+                    self._idle.remove(connection)
+                try:
+                    connection.execute(self.HEARTBEAT_QUERY, timeout=self._heartbeatTimeout)
+                except (OSError, LivestatusError) as e:
+                    logger.info("Livestatus heartbeat failed, dropping connection: "+str(e))
+                    connection.close()
+                    with self._lock:
+                        self._metrics["heartbeatFailures"]+=1
+                    continue
+                with self._lock:
+                    if self._closed:
+                        connection.close()
+                    else:
+                        self._idle.appendleft(connection)
+            finally:
+                self._channelSlots.release()
+
+    def close(self):
+        self._closed=True
+        self._heartbeatStop.set()
+        with self._lock:
+            idle=list(self._idle)
+            self._idle.clear()
+        for connection in idle:
+            connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+class cmkMultisiteResult:
+    def __init__(self,
+                 rows=None,
+                 errors=None,
+                 durations=None
+                 ):
+        self._rows=rows if rows is not None else []
+        self._errors=errors if errors is not None else {}
+        self._durations=durations if durations is not None else {}
+
+    @property
+    def rows(self):
+        return self._rows
+
+    @property
+    def errors(self):
+        # Exceptions of failed or timed out sites keyed by site id
+        return self._errors
+
+    @property
+    def durations(self):
+        return self._durations
+
+    @property
+    def sites(self):
+        return sorted(siteID for siteID in self._durations if siteID not in self._errors)
+
+    @property
+    def partial(self):
+        return len(self._errors) > 0
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    def __len__(self):
+        return len(self._rows)
+
+class cmkLivestatusMultisite:
+    # Sends one query to many sites at once. Rows are tagged with the id
+    # of their site in the "site" column. Sites that fail or do not answer
+    # within siteTimeout are reported in the result's errors instead of
+    # failing the whole query.
+    # Stats functions whose per-site results merge exactly
+    MERGEABLE_STATS=["count", "sum", "suminv", "min", "max"]
+
+    def __init__(self,
+                 pools=None,
+                 siteTimeout=10,
+                 maxWorkers=16
+                 ):
+        self._pools=dict(pools) if pools is not None else {}
+        self._siteTimeout=siteTimeout
+        self._executor=ThreadPoolExecutor(max_workers=maxWorkers, thread_name_prefix="livestatus-multisite")
+
+    @classmethod
+    def fromSiteConnections(cls, siteConnections=None, sites=None, viaProxy=False, proxyHost="", **kwargs):
+        # siteConnections is a SiteAllConnections or a list of SiteConnection;
+        # sites restricts the engine to the given site ids. Connections that
+        # are disabled in the status GUI are skipped.
+        if isinstance(siteConnections, cmk_RESTAPI.SiteAllConnections):
+            siteConnections=siteConnections.value
+        if siteConnections is None:
+            raise ValueError("siteConnections is empty")
+        pools={}
+        for site_connection in siteConnections:
+            if sites is not None and site_connection.id not in sites:
+                continue
+            if site_connection.extensions.status_connection.disable_in_status_gui:
+                logger.info("Skipping site "+str(site_connection.id)+", it is disabled in the status GUI")
+                continue
+            pools[site_connection.id]=cmkLivestatusPool.forSite(
+                siteKey=site_connection.id, site_connection=site_connection, viaProxy=viaProxy, proxyHost=proxyHost
+            )
+        return cls(pools=pools, **kwargs)
+
+    @property
+    def siteIDs(self):
+        return sorted(self._pools.keys())
+
+    def addSite(self, siteID="", pool=None):
+        if not isinstance(pool, cmkLivestatusPool):
+            raise TypeError("pool must be an instance of cmkLivestatusPool")
+        self._pools[siteID]=pool
+
+    def removeSite(self, siteID=""):
+        self._pools.pop(siteID, None)
+
+    def query(self, query=None, sites=None, siteTimeout=None, aggregate=True):
+        # With aggregate, Stats results of all sites are merged into one row
+        # per group, see mergeStats. Queries with avg, avginv or std can't be
+        # merged exactly and are returned as per-site rows.
+        if not isinstance(query, cmkLivestatusQuery):
+            raise TypeError("query must be an instance of cmkLivestatusQuery")
+        siteIDs=list(sites) if sites is not None else self.siteIDs
+        siteTimeout=siteTimeout if siteTimeout is not None else self._siteTimeout
+
+        def querySite(siteID):
+            # The socket timeout ends the worker soon after the site is
+            # given up on, so slow sites do not tie up the executor.
+            started=time.monotonic()
+            rows=self._pools[siteID].query(query, timeout=siteTimeout)
+            return rows, time.monotonic()-started
+
+        started=time.monotonic()
+        futures={}
+        errors={}
+        for siteID in siteIDs:
+            if siteID not in self._pools:
+                errors[siteID]=LivestatusError("Site "+str(siteID)+" is not known")
+                continue
+            futures[self._executor.submit(querySite, siteID)]=siteID
+        done, notDone=wait(futures.keys(), timeout=siteTimeout)
+
+        rows=[]
+        durations={}
+        for future in notDone:
+            siteID=futures[future]
+            future.cancel()
+            errors[siteID]=TimeoutError("Site "+str(siteID)+" did not answer within "+str(siteTimeout)+"s")
+            durations[siteID]=time.monotonic()-started
+        for future in done:
+            siteID=futures[future]
+            try:
+                siteRows, durations[siteID]=future.result()
+            except Exception as e:
+                errors[siteID]=e
+                durations[siteID]=time.monotonic()-started
+                continue
+            for row in siteRows:
+                row["site"]=siteID
+            rows.extend(siteRows)
+        for siteID in errors:
+            logger.warning("Livestatus query failed on site "+str(siteID)+": "+str(errors[siteID]))
+
+        if aggregate and query.statsCount > 0:
+            unmergeable=sorted(set(query.statsFunctions)-set(self.MERGEABLE_STATS))
+            if len(unmergeable) > 0:
+                logger.info("Returning per-site rows, "+", ".join(unmergeable)+" can't be merged across sites")
+            else:
+                rows=self.mergeStats(query, rows)
+        return cmkMultisiteResult(rows=rows, errors=errors, durations=durations)
+
+    @classmethod
+    def mergeStats(cls, query, rows):
+        # Merges per-site Stats rows into one row per group. site holds the
+        # contributing site ids joined by commas, sites them as a list.
+        # Averages and standard deviations would need each site's row
+        # count, which the rows don't carry, so they are refused.
+        unmergeable=sorted(set(query.statsFunctions)-set(cls.MERGEABLE_STATS))
+        if len(unmergeable) > 0:
+            raise ValueError("Stats "+", ".join(unmergeable)+" can't be merged across sites")
+        groupColumns=query.columnNames
+        statsColumns=["stats_"+str(index+1) for index in range(query.statsCount)]
+        functions=query.statsFunctions
+        groups={}
+        for row in rows:
+            key=tuple(row.get(column) for column in groupColumns)
+            groups.setdefault(key, []).append(row)
+        merged=[]
+        for key, groupRows in groups.items():
+            mergedRow=dict(zip(groupColumns, key))
+            mergedRow["sites"]=sorted(row["site"] for row in groupRows)
+            mergedRow["site"]=",".join(mergedRow["sites"])
+            for column, function in zip(statsColumns, functions):
+                values=[row[column] for row in groupRows if row.get(column) is not None]
+                if function in ["count", "sum", "suminv"]:
+                    mergedRow[column]=sum(values)
+                elif function == "min":
+                    mergedRow[column]=min(values) if len(values) > 0 else None
+                else:
+                    mergedRow[column]=max(values) if len(values) > 0 else None
+            merged.append(mergedRow)
+        return merged
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
@@ -0,0 +1,200 @@
+import sys
+import time
+import asyncio
+import threading
+import contextlib
+from datetime import datetime
+from dwlab_cmkapi import cmk_RESTAPI
+
+import logging
+logger=logging.getLogger(__name__)
+
+class cmkPendingChangeEvent:
+    ADDED="added"
+    REMOVED="removed"
+
+    def __init__(self,
+                 kind="",
+                 change=None,
+                 job=None,
+                 time=None
+                 ):
+        self._kind=kind
+        self._change=change
+        self._job=job
+        self._time=time
+
+    @property
+    def kind(self):
+        return self._kind
+
+    @property
+    def change(self):
+        return self._change
+
+    @property
+    def job(self):
+        # Name of the job the change is attributed to, None if unknown
+        return self._job
+
+    @property
+    def time(self):
+        # When the watcher noticed the change
+        return self._time
+
+    def to_dict(self):
+        return {
+            "kind": self._kind,
+            "change": self._change.to_dict() if self._change is not None else None,
+            "job": self._job,
+            "time": self._time
+        }
+
+class cmkPendingChangesWatcher:
+    # Follows the pending changes of a site and reports only the changes
+    # that appeared or disappeared since the previous poll. An unchanged
+    # list costs one header-only request (AllActivations.fetchETag); the
+    # list itself is only downloaded when its ETag moved.
+    #
+    # Added changes are attributed to a job: either by the attribute
+    # callable (change -> job name) or by the job() windows, matching the
+    # change's time, or the poll interval it showed up in when its time
+    # can't be parsed, against the windows that were open then.
+    def __init__(self,
+                 cmkAccess=None,
+                 interval=5,
+                 onEvent=None,
+                 attribute=None,
+                 emitInitial=False,
+                 jobRetention=3600
+                 ):
+        function_name = sys._getframe().f_code.co_name
+        class_name=self.__class__.__name__
+        function_name=class_name+"."+function_name
+        logger.debug("Entering function "+str(function_name))
+
+        if not isinstance(cmkAccess, cmk_RESTAPI.RestAPIcredentials):
+            raise TypeError("cmkAccess must be an instance of RestAPIcredentials")
+        self._cmkAccess=cmkAccess
+        self._interval=interval
+        self._onEvent=onEvent
+        self._attribute=attribute
+        self._emitInitial=emitInitial
+        self._jobRetention=jobRetention
+        self._etag=None
+        self._known=None
+        self._lastPoll=None
+        self._jobs=[]
+        self._jobsLock=threading.Lock()
+        self._stopped=threading.Event()
+
+    @property
+    def changes(self):
+        # Pending changes as of the last poll, keyed by change id
+        return dict(self._known) if self._known is not None else {}
+
+    @contextlib.contextmanager
+    def job(self, name):
+        # Marks the block as the work of job name for attribution.
+        window=[name, time.time(), None]
+        with self._jobsLock:
+            self._jobs.append(window)
+        try:
+            yield
+        finally:
+            window[2]=time.time()
+
+    def _jobAt(self, start, end):
+        # The most recently started job whose window overlaps [start, end].
+        with self._jobsLock:
+            self._jobs=[window for window in self._jobs if window[2] is None or window[2] > time.time()-self._jobRetention]
+            candidates=[window for window in self._jobs if window[1] <= end and (window[2] is None or window[2] >= start)]
+        if len(candidates) == 0:
+            return None
+        return max(candidates, key=lambda window: window[1])[0]
+
+    @staticmethod
+    def _changeTime(change):
+        try:
+            return datetime.fromisoformat(str(change.time).replace("Z", "+00:00")).timestamp()
+        except ValueError:
+            return None
+
+    def _jobOf(self, change, now):
+        if self._attribute is not None:
+            return self._attribute(change)
+        changeTime=self._changeTime(change)
+        if changeTime is not None:
+            return self._jobAt(changeTime, changeTime)
+        return self._jobAt(self._lastPoll if self._lastPoll is not None else now, now)
+
+    def poll(self):
+        # One poll cycle; returns the events, which are also passed to onEvent.
+        # Sites that send no ETag have their list read in full every time.
+        function_name = sys._getframe().f_code.co_name
+        logger.debug("Entering function "+str(function_name))
+
+        now=time.time()
+        if self._etag is not None:
+            etag=cmk_RESTAPI.AllActivations.fetchETag(cmkAccess=self._cmkAccess)
+            if etag == self._etag:
+                self._lastPoll=now
+                return []
+
+        activations=cmk_RESTAPI.AllActivations(cmkAccess=self._cmkAccess)
+        current={change.id: change for change in activations.value}
+        events=[]
+        if self._known is not None or self._emitInitial:
+            known=self._known if self._known is not None else {}
+            for changeID, change in current.items():
+                if changeID not in known:
+                    events.append(cmkPendingChangeEvent(kind=cmkPendingChangeEvent.ADDED, change=change, job=self._jobOf(change, now), time=now))
+            for changeID, change in known.items():
+                if changeID not in current:
+                    events.append(cmkPendingChangeEvent(kind=cmkPendingChangeEvent.REMOVED, change=change, time=now))
+        self._known=current
+        self._etag=activations.ETag
+        self._lastPoll=now
+
+        for event in events:
+            if self._onEvent is not None:
+                try:
+                    self._onEvent(event)
+                except Exception as e:
+                    logger.error("onEvent failed: "+str(e))
+        logger.debug("Leaving function "+str(function_name))
+        return events
+
+    def stop(self):
+        self._stopped.set()
+
+    def watch(self, maxPolls=None):
+        # Yields events as they are found until stop() or maxPolls polls.
+        self._stopped.clear()
+        polls=0
+        while not self._stopped.is_set():
+            for event in self.poll():
+                yield event
+            polls+=1
+            if maxPolls is not None and polls >= maxPolls:
+                break
+            self._stopped.wait(self._interval)
+
+    def __iter__(self):
+        return self.watch()
+
+    async def stream(self, maxPolls=None):
+        # The async counterpart of watch(); polls run in a worker thread.
+        loop=asyncio.get_running_loop()
+        self._stopped.clear()
+        polls=0
+        while not self._stopped.is_set():
+            for event in await loop.run_in_executor(None, self.poll):
+                yield event
+            polls+=1
+            if maxPolls is not None and polls >= maxPolls:
+                break
+            await asyncio.sleep(self._interval)
+
+    def __aiter__(self):
+        return self.stream()
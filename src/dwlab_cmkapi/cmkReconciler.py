@@ -0,0 +1,328 @@
+import sys
+from concurrent.futures import wait
+from dwlab_cmkapi import cmk_RESTAPI
+from dwlab_cmkapi import cmkFolderTree
+from dwlab_cmkapi import cmkJobTracker
+
+import logging
+logger=logging.getLogger(__name__)
+
+class cmkDesiredState:
+    def __init__(self):
+        self._hosts={}
+        self._siteConnections={}
+        self._statusHosts={}
+        self._removedHosts=set()
+        self._removedSiteConnections=set()
+
+    @property
+    def hosts(self):
+        return self._hosts
+
+    @property
+    def siteConnections(self):
+        return self._siteConnections
+
+    @property
+    def statusHosts(self):
+        return self._statusHosts
+
+    @property
+    def removedHosts(self):
+        return self._removedHosts
+
+    @property
+    def removedSiteConnections(self):
+        return self._removedSiteConnections
+
+    def addHost(self, hostName="", folder="/", attributes=None):
+        if not isinstance(hostName, str) or hostName == "":
+            raise ValueError("hostName must be a non-empty string")
+        self._hosts[hostName]={
+            "folder": folder,
+            "attributes": dict(attributes) if attributes is not None else {}
+        }
+        self._removedHosts.discard(hostName)
+
+    def removeHost(self, hostName=""):
+        if not isinstance(hostName, str) or hostName == "":
+            raise ValueError("hostName must be a non-empty string")
+        self._hosts.pop(hostName, None)
+        self._removedHosts.add(hostName)
+
+    def addSiteConnection(self, siteID="", ovpnNetwork="", ovpnNetworkDomain=""):
+        if not isinstance(siteID, str) or siteID == "":
+            raise ValueError("siteID must be a non-empty string")
+        self._siteConnections[siteID]={
+            "ovpnNetwork": ovpnNetwork,
+            "ovpnNetworkDomain": ovpnNetworkDomain
+        }
+        self._removedSiteConnections.discard(siteID)
+
+    def removeSiteConnection(self, siteID=""):
+        if not isinstance(siteID, str) or siteID == "":
+            raise ValueError("siteID must be a non-empty string")
+        self._siteConnections.pop(siteID, None)
+        self._statusHosts.pop(siteID, None)
+        self._removedSiteConnections.add(siteID)
+
+    def setStatusHost(self, siteID="", hostName="", statusSite=""):
+        # statusSite is the site monitoring hostName, usually the central site.
+        if not isinstance(siteID, str) or siteID == "":
+            raise ValueError("siteID must be a non-empty string")
+        self._statusHosts[siteID]={
+            "host": hostName,
+            "site": statusSite
+        }
+
+class cmkReconcilePlan:
+    def __init__(self):
+        self._hostsToCreate=[]
+        self._hostsToUpdate=[]
+        self._hostsToMove=[]
+        self._hostsToDelete=[]
+        self._siteConnectionsToCreate={}
+        self._siteConnectionsToDelete={}
+        self._statusHostsToSet={}
+
+    @property
+    def hostsToCreate(self):
+        return self._hostsToCreate
+
+    @property
+    def hostsToUpdate(self):
+        return self._hostsToUpdate
+
+    @property
+    def hostsToMove(self):
+        return self._hostsToMove
+
+    @property
+    def hostsToDelete(self):
+        return self._hostsToDelete
+
+    @property
+    def siteConnectionsToCreate(self):
+        return self._siteConnectionsToCreate
+
+    @property
+    def siteConnectionsToDelete(self):
+        return self._siteConnectionsToDelete
+
+    @property
+    def statusHostsToSet(self):
+        return self._statusHostsToSet
+
+    @property
+    def isEmpty(self):
+        return (len(self._hostsToCreate)==0 and len(self._hostsToUpdate)==0 and len(self._hostsToMove)==0
+                and len(self._hostsToDelete)==0 and len(self._siteConnectionsToCreate)==0
+                and len(self._siteConnectionsToDelete)==0 and len(self._statusHostsToSet)==0)
+
+    def to_dict(self):
+        return {
+            "hostsToCreate": [hostSpec["host_name"] for hostSpec in self._hostsToCreate],
+            "hostsToUpdate": [update["host_name"] for update in self._hostsToUpdate],
+            "hostsToMove": [move["host_name"] for move in self._hostsToMove],
+            "hostsToDelete": list(self._hostsToDelete),
+            "siteConnectionsToCreate": sorted(self._siteConnectionsToCreate.keys()),
+            "siteConnectionsToDelete": sorted(self._siteConnectionsToDelete.keys()),
+            "statusHostsToSet": sorted(self._statusHostsToSet.keys())
+        }
+
+class cmkReconciler:
+    # Brings hosts and site connections of a central site to a declared
+    # state. The current state is read with one host collection and one site
+    # connection collection call; writes are batched and followed by a
+    # single activation, and nothing is written when nothing differs. New
+    # hosts are discovered after that activation and their services go
+    # live with a second one, as catalogSite does for a single host; that
+    # activation waits for the discovery jobs, up to discoveryTimeout.
+    # Hosts and connections are only deleted when explicitly removed from
+    # the desired state, never because they are merely not declared.
+    def __init__(self,
+                 cmkAccess=None,
+                 activationCoordinator=None,
+                 discoveryTimeout=900,
+                 pollInterval=2
+                 ):
+        function_name = sys._getframe().f_code.co_name
+        class_name=self.__class__.__name__
+        function_name=class_name+"."+function_name
+        logger.debug("Entering function "+str(function_name))
+
+        if not isinstance(cmkAccess, cmk_RESTAPI.RestAPIcredentials):
+            raise TypeError("cmkAccess must be an instance of RestAPIcredentials")
+        self._cmkAccess=cmkAccess
+        # A cmkActivationCoordinator shares the activation with other workers
+        self._activationCoordinator=activationCoordinator
+        self._discoveryTimeout=discoveryTimeout
+        self._pollInterval=pollInterval
+
+    @property
+    def cmkAccess(self):
+        return self._cmkAccess
+
+    def readCurrentState(self, readSiteConnections=True):
+        host_configs={host_config.id: host_config for host_config in cmk_RESTAPI.HostConfig.ListHosts(cmkAccess=self._cmkAccess)}
+        siteConnections={}
+        if readSiteConnections:
+            allSiteConnections=cmk_RESTAPI.SiteAllConnections(cmkAccess=self._cmkAccess)
+            siteConnections={site_connection.id: site_connection for site_connection in allSiteConnections.value}
+        return host_configs, siteConnections
+
+    def plan(self, desiredState=None):
+        function_name = sys._getframe().f_code.co_name
+        logger.debug("Entering function "+str(function_name))
+
+        if not isinstance(desiredState, cmkDesiredState):
+            raise TypeError("desiredState must be an instance of cmkDesiredState")
+        host_configs, siteConnections=self.readCurrentState(
+            readSiteConnections=(len(desiredState.siteConnections) > 0 or len(desiredState.statusHosts) > 0
+                                 or len(desiredState.removedSiteConnections) > 0)
+        )
+
+        plan=cmkReconcilePlan()
+        for hostName, desiredHost in desiredState.hosts.items():
+            host_config=host_configs.get(hostName)
+            if host_config is None:
+                plan.hostsToCreate.append({
+                    "host_name": hostName,
+                    "folder": desiredHost["folder"],
+                    "attributes": desiredHost["attributes"]
+                })
+                continue
+            changedAttributes={
+                key: value for key, value in desiredHost["attributes"].items()
+                if host_config.extensions.attributes.get(key) != value
+            }
+            if len(changedAttributes) > 0:
+                plan.hostsToUpdate.append({"host_name": hostName, "update_attributes": changedAttributes})
+            if cmkFolderTree.cmkFolderTree.normalizePath(host_config.extensions.folder) != cmkFolderTree.cmkFolderTree.normalizePath(desiredHost["folder"]):
+                plan.hostsToMove.append({"host_name": hostName, "target_folder": desiredHost["folder"]})
+
+        for hostName in sorted(desiredState.removedHosts):
+            if hostName in host_configs:
+                plan.hostsToDelete.append(hostName)
+
+        for siteID in sorted(desiredState.removedSiteConnections):
+            if siteID in siteConnections:
+                plan.siteConnectionsToDelete[siteID]=siteConnections[siteID]
+
+        for siteID, desiredConnection in desiredState.siteConnections.items():
+            if siteID not in siteConnections:
+                plan.siteConnectionsToCreate[siteID]=dict(desiredConnection)
+                plan.siteConnectionsToCreate[siteID]["statusHost"]=desiredState.statusHosts.get(siteID)
+
+        for siteID, desiredStatusHost in desiredState.statusHosts.items():
+            if siteID in siteConnections:
+                status_host=siteConnections[siteID].extensions.status_connection.status_host
+                if (status_host.status_host_set=="enabled" and status_host.host==desiredStatusHost["host"]
+                        and status_host.site==desiredStatusHost["site"]):
+                    continue
+                plan.statusHostsToSet[siteID]=(siteConnections[siteID], desiredStatusHost)
+            elif siteID not in plan.siteConnectionsToCreate:
+                logger.warning("Status host for "+str(siteID)+" ignored: the site connection neither exists nor is declared")
+
+        logger.info("Reconcile plan: "+str(plan.to_dict()))
+        logger.debug("Leaving function "+str(function_name))
+        return plan
+
+    def apply(self, plan=None, activate=True, discoverNewHosts=False):
+        function_name = sys._getframe().f_code.co_name
+        logger.debug("Entering function "+str(function_name))
+
+        if not isinstance(plan, cmkReconcilePlan):
+            raise TypeError("plan must be an instance of cmkReconcilePlan")
+        if plan.isEmpty:
+            logger.info("Nothing to reconcile")
+            return None
+
+        created={}
+        if len(plan.hostsToCreate) > 0:
+            created=cmk_RESTAPI.HostConfig.CreateHosts(newHosts=plan.hostsToCreate, cmkAccess=self._cmkAccess)
+        if len(plan.hostsToUpdate) > 0:
+            cmk_RESTAPI.HostConfig.BulkUpdateHosts(updates=plan.hostsToUpdate, cmkAccess=self._cmkAccess)
+        if len(plan.hostsToMove) > 0:
+            cmk_RESTAPI.HostConfig.MoveHosts(moves=plan.hostsToMove, cmkAccess=self._cmkAccess)
+        if len(plan.hostsToDelete) > 0:
+            cmk_RESTAPI.HostConfig.BulkDeleteHosts(hostNames=plan.hostsToDelete, cmkAccess=self._cmkAccess)
+
+        outcomes=self._cmkAccess.adaptiveLimiter.map(
+            lambda siteID: plan.siteConnectionsToDelete[siteID].deleteSiteConnection(cmkAccess=self._cmkAccess),
+            list(plan.siteConnectionsToDelete.keys())
+        )
+        cmk_RESTAPI.BulkOperationError.check("deleteSiteConnection", outcomes)
+
+        def createSiteConnection(siteID):
+            desiredConnection=plan.siteConnectionsToCreate[siteID]
+            new_siteConnection=cmk_RESTAPI.SiteConnection()
+            # A declared status host goes into the creating request directly
+            # instead of a second update of the new connection.
+            if desiredConnection["statusHost"] is not None:
+                status_host=new_siteConnection.extensions.status_connection.status_host
+                status_host.status_host_set="enabled"
+                status_host.host=desiredConnection["statusHost"]["host"]
+                status_host.site=desiredConnection["statusHost"]["site"]
+            new_siteConnection.createSiteConnection(
+                cmkAccess=self._cmkAccess,
+                newSite=siteID,
+                ovpnNetwork=desiredConnection["ovpnNetwork"],
+                ovpnNetworkDomain=desiredConnection["ovpnNetworkDomain"]
+            )
+            return new_siteConnection
+        outcomes=self._cmkAccess.adaptiveLimiter.map(createSiteConnection, list(plan.siteConnectionsToCreate.keys()))
+        cmk_RESTAPI.BulkOperationError.check("createSiteConnection", outcomes)
+
+        def setStatusHost(siteID):
+            existingSiteConnection, desiredStatusHost=plan.statusHostsToSet[siteID]
+            status_host=existingSiteConnection.extensions.status_connection.status_host
+            status_host.status_host_set="enabled"
+            status_host.host=desiredStatusHost["host"]
+            status_host.site=desiredStatusHost["site"]
+            existingSiteConnection.updateSiteConnection(cmkAccess=self._cmkAccess)
+            return existingSiteConnection
+        outcomes=self._cmkAccess.adaptiveLimiter.map(setStatusHost, list(plan.statusHostsToSet.keys()))
+        cmk_RESTAPI.BulkOperationError.check("updateSiteConnection", outcomes)
+
+        activationResponse=None
+        if activate:
+            activationResponse=self._activate()
+
+        if discoverNewHosts and len(created) > 0:
+            # Hosts are discovered once they are active, as in catalogSite
+            discoveries=cmk_RESTAPI.HostConfig.executeDiscoveries(hostConfigs=list(created.values()), cmkAccess=self._cmkAccess)
+            if activate and any(discovery is not None for discovery in discoveries.values()):
+                # Discoveries only start background jobs; activating before
+                # they finished would leave the discovered services pending.
+                self._waitForDiscoveries(discoveries)
+                activationResponse=self._activate()
+
+        logger.debug("Leaving function "+str(function_name))
+        return activationResponse
+
+    def _waitForDiscoveries(self, discoveries):
+        # Waits for the discovery jobs through a cmkJobTracker. Hosts of one
+        # bulk discovery share its job; single discoveries are addressed by
+        # host name.
+        tracker=cmkJobTracker.cmkJobTracker(cmkAccess=self._cmkAccess, interval=self._pollInterval, timeout=self._discoveryTimeout)
+        futures=tracker.trackDiscoveries({hostName: discovery for hostName, discovery in discoveries.items() if discovery is not None})
+        wait(set(futures.values()))
+        for hostName, future in sorted(futures.items()):
+            exception=future.exception()
+            if exception is not None:
+                logger.warning("Discovery of "+str(hostName)+" did not finish: "+str(exception))
+            elif future.result().failed:
+                logger.warning("Discovery of "+str(hostName)+" failed")
+
+    def _activate(self):
+        if self._activationCoordinator is not None:
+            return self._activationCoordinator.activate(cmkAccess=self._cmkAccess)
+        activation=cmk_RESTAPI.AllActivations(cmkAccess=self._cmkAccess, loadChanges=False)
+        return activation.activatePendingChanges(cmkAccess=self._cmkAccess)
+
+    def reconcile(self, desiredState=None, activate=True, discoverNewHosts=False, dryRun=False):
+        plan=self.plan(desiredState)
+        if not dryRun:
+            self.apply(plan=plan, activate=activate, discoverNewHosts=discoverNewHosts)
+        return plan
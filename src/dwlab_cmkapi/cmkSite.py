@@ -1,6 +1,9 @@
 from pathlib import Path
 import sys
+from concurrent.futures import Future, ThreadPoolExecutor
 from dwlab_cmkapi import cmk_RESTAPI
+from dwlab_cmkapi import cmkReconciler
+from dwlab_cmkapi import cmkActivation
 
 import logging
 from dwlab_basicpy import dwlabLogger
@@ -14,7 +17,8 @@ class cmkCentralSite:
                  centralDomain="",
                  ovpnNetwork=None,
                  ovpnNetworkDomain=None,
-                 cmkAccess=None
+                 cmkAccess=None,
+                 activationCoordinator=None
                  ):
         function_name = sys._getframe().f_code.co_name
         class_name=self.__class__.__name__
@@ -52,6 +56,9 @@ class cmkCentralSite:
         else:
             self._ovpnNetworkDomain=ovpnNetworkDomain
             logger.debug("ovpnNetworkDomain is: "+str(ovpnNetworkDomain))
+        if activationCoordinator is not None and not isinstance(activationCoordinator, cmkActivation.cmkActivationCoordinator):
+            raise TypeError("activationCoordinator must be an instance of cmkActivationCoordinator")
+        self._activationCoordinator=activationCoordinator
         
 
     @property
@@ -68,13 +75,13 @@ class cmkCentralSite:
     
     @property
     def version(self):
-        return self._version
+        return self._cmkAccess.version
     @property
     def apiVersion(self):
-        return self._version.apiVersion
+        return self._cmkAccess.version.apiVersion
     @property
     def checkmkVersion(self):
-        return self._version.checkmkVersion
+        return self._cmkAccess.version.checkmkVersion
     @property
     def ovpnNetwork(self):
         return self._ovpnNetwork
@@ -85,9 +92,27 @@ class cmkCentralSite:
     def cmkAccess(self):
         return self._cmkAccess
 
+    @property
+    def activationCoordinator(self):
+        return self._activationCoordinator
+
+    def activatePendingChanges(self):
+        # Goes through the activation coordinator when one is configured, so
+        # concurrent workers share one activation of the central site.
+        if self._activationCoordinator is not None:
+            return self._activationCoordinator.activate(cmkAccess=self._cmkAccess)
+        activation=cmk_RESTAPI.AllActivations(cmkAccess=self._cmkAccess, loadChanges=False)
+        return activation.activatePendingChanges(cmkAccess=self._cmkAccess)
 
 
     def catalogSite(self, instanceName=None):
+        # Runs the host path and the site connection path concurrently. They
+        # meet before anything is written to the site connections: a
+        # connection is only created or given its status_host once the host
+        # exists, so a failed host leaves no connection behind. A new host is
+        # activated and discovered once both paths have written their
+        # changes, so the activation never picks up a half-written site
+        # connection.
         function_name = sys._getframe().f_code.co_name
         class_name=self.__class__.__name__
         function_name=class_name+"."+function_name
@@ -99,21 +124,47 @@ class cmkCentralSite:
             raise ValueError("instanceName cannot be empty")
 
         new_host=str(instanceName)+"."+str(self._ovpnNetwork)+"."+str(self._ovpnNetworkDomain)
-        
+
+        # Resolved with the host config as soon as the host exists
+        hostReady=Future()
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            hostStage=executor.submit(self._catalogHost, new_host, hostReady)
+            connectionStage=executor.submit(self._catalogSiteConnection, instanceName, new_host, hostReady)
+            hostException=hostStage.exception()
+            connectionException=connectionStage.exception()
+        if hostException is not None:
+            raise hostException
+        if connectionException is not None:
+            raise connectionException
+
+        host_config=hostStage.result()
+        if host_config is not None:
+            self._activateHost(new_host, host_config)
+
+        logger.info("New site "+instanceName+" was created.")
+
+        logger.debug("Leaving function "+str(function_name))
+        return 
+
+    def _catalogHost(self, new_host, hostReady):
+        # Returns the host config if the host was created, None if it existed.
         try:
-            logger.debug("Getting host config for "+new_host)
-            host_config=cmk_RESTAPI.HostConfig.ShowHost(
-                requestedHost=new_host,
-                cmkAccess=self._cmkAccess
-            )
-        except Exception as e:
-            logger.error("cmk_RESTAPI.HostConfig.ShowHost failed for some reason.")
-            logger.error("The following exception occured:")
-            logger.error(str(e.args[0]))
-            raise e
+            try:
+                logger.debug("Getting host config for "+new_host)
+                host_config=cmk_RESTAPI.HostConfig.ShowHost(
+                    requestedHost=new_host,
+                    cmkAccess=self._cmkAccess
+                )
+            except Exception as e:
+                logger.error("cmk_RESTAPI.HostConfig.ShowHost failed for some reason.")
+                logger.error("The following exception occured:")
+                logger.error(str(e.args[0]))
+                raise e
 
+            if host_config is not None:
+                hostReady.set_result(host_config)
+                return None
 
-        if host_config==None:
             try:
                 logger.debug("Host config for "+new_host+" not found.")
                 logger.debug("Creating new host "+new_host)
@@ -127,51 +178,51 @@ class cmkCentralSite:
                 logger.error("The following exception occured:")
                 logger.error(str(e.args[0]))
                 raise RuntimeError("New site "+new_host+" was not created.")
-        
-            try:
-                logger.debug("Activating host "+new_host)
-                logger.debug("self._cmkAccess is: "+str(self._cmkAccess))
-                activation=cmk_RESTAPI.AllActivations(cmkAccess=self._cmkAccess)
-                try:
-                    logger.debug("Now holding all pending changes and trying to activate these changes.")
-                    activationResponse=activation.activatePendingChanges(cmkAccess=self._cmkAccess)
-                except Exception as e:
-                    logger.error("The host "+new_host+" has not been activated successfully.")
-                    logger.error("The following exception occured:")
-                    logger.error(str(e.args[0]))
-                    raise RuntimeError("The host "+new_host+" has not been activated successfully.")
-            except Exception as e:
-                logger.error("cmk_RESTAPI.AllActivations failed for some reason.")
-                logger.error("The following exception occured:")
-                logger.error(str(e.args[0]))
-                activationResponse=""
-                
-            
-            if isinstance (activationResponse,str) and activationResponse in ["Done", "Started"]:
-                logger.debug("Host "+new_host+" has been activated. Now trying to discover it to make sure it is available.")
-                try:
-                    serviceDiscovery=host_config.executeDiscovery(cmkAccess=self._cmkAccess)
-                except Exception as e:
-                    logger.error("The host "+new_host+" has not been discovered successfully.")
-                    logger.error("The following exception occured:")
-                    logger.error(str(e.args[0]))
+        except Exception as e:
+            hostReady.set_exception(e)
+            raise
+        hostReady.set_result(host_config)
+        return host_config
 
-                try:
-                    activation=cmk_RESTAPI.AllActivations(cmkAccess=self._cmkAccess)
-                    activationResponse=activation.activatePendingChanges(cmkAccess=self._cmkAccess)
-                except Exception as e:
-                    logger.error("The host "+new_host+" has not been activated successfully.")
-                    logger.error("The following exception occured:")
-                    logger.error(str(e.args[0]))
-                logger.info("The host "+new_host+" has been activated successfully.")
+    def _activateHost(self, new_host, host_config):
+        logger.debug("Activating host "+new_host)
+        try:
+            logger.debug("Now holding all pending changes and trying to activate these changes.")
+            activationResponse=self.activatePendingChanges()
+        except Exception:
+            logger.exception("The host "+new_host+" has not been activated successfully.")
+            activationResponse=""
+
+        if not (isinstance(activationResponse,str) and activationResponse in ["Done", "Started"]):
+            logger.warning("The host "+new_host+" was not activated ("+str(activationResponse)+"), skipping its service discovery.")
+            return
 
+        logger.debug("Host "+new_host+" has been activated. Now trying to discover it to make sure it is available.")
+        try:
+            host_config.executeDiscovery(cmkAccess=self._cmkAccess)
+        except Exception:
+            logger.exception("The host "+new_host+" has not been discovered successfully.")
+
+        try:
+            activationResponse=self.activatePendingChanges()
+        except Exception:
+            logger.exception("The discovered services of "+new_host+" have not been activated.")
+            return
+        if isinstance(activationResponse,str) and activationResponse in ["Done", "Started"]:
+            logger.info("The host "+new_host+" has been activated successfully.")
+        else:
+            logger.warning("The discovered services of "+new_host+" were not activated ("+str(activationResponse)+").")
+
+    def _catalogSiteConnection(self, instanceName, new_host, hostReady):
         try:
             allSiteConnections=cmk_RESTAPI.SiteAllConnections(cmkAccess=self._cmkAccess)
+            created=False
 
             if instanceName not in allSiteConnections.getConnectedSiteIDs():
                 logger.info("New site "+instanceName+" is not cataloged yet.")
 
-                # This is a new site
+                # This is a new site; its status_host must exist first
+                hostReady.result()
                 try:
                     logger.info("Creating new site connection for "+instanceName)
                     new_siteConnection=cmk_RESTAPI.SiteConnection()
@@ -182,6 +233,7 @@ class cmkCentralSite:
                         ovpnNetwork=self._ovpnNetwork,
                         ovpnNetworkDomain=self._ovpnNetworkDomain
                     )
+                    created=True
                 except Exception as e:
                     logger.error("cmk_RESTAPI.SiteConnection.createSiteConnection failed for some reason.")
                     logger.error("The following exception occured:")
@@ -190,22 +242,20 @@ class cmkCentralSite:
 
             # This is an existing site
             logger.debug("The site "+instanceName+" should exist now.")
-            allSiteConnections=cmk_RESTAPI.SiteAllConnections(cmkAccess=self._cmkAccess)
             # Is the status_host defined?
             logger.debug("Checking if the status_host is defined.")
             try:
-                existingSiteConnection=allSiteConnections.getConnectedSite(instanceName)
+                if created:
+                    existingSiteConnection=cmk_RESTAPI.SiteConnection.ShowSiteConnection(siteID=instanceName, cmkAccess=self._cmkAccess)
+                else:
+                    existingSiteConnection=allSiteConnections.getConnectedSite(instanceName)
                 if existingSiteConnection.extensions.status_connection.status_host.status_host_set=="enabled":
                     logger.info("New site "+instanceName+" is already cataloged.")
                     logger.info("The status_host is already defined.")
                 else:
                     logger.info("New site "+instanceName+" is already cataloged.")
                     logger.info("The status_host is not defined.")
-                    # check for the existing host
-                    statusHost=cmk_RESTAPI.HostConfig.ShowHost(
-                        requestedHost=new_host,
-                        cmkAccess=self._cmkAccess
-                    )
+                    statusHost=hostReady.result()
                     if statusHost is not None:
                         logger.info("New host "+new_host+" is available.")
                         logger.info("Adding new host as status_host "+self._cmkSiteName+" for the status_connection.")
@@ -215,18 +265,68 @@ class cmkCentralSite:
                         existingSiteConnection.updateSiteConnection(
                             cmkAccess=self._cmkAccess
                         )
-            except:
-                logger.error("The site "+instanceName+" can't be found.")
-                raise RuntimeError("The site "+instanceName+" can't be found.")
+            except Exception as e:
+                logger.error("The status_host of site "+instanceName+" could not be set: "+str(e))
+                raise
         except Exception as e:
             logger.error("The following exception occured:")
-            logger.error(str(e.args[0]))
-            raise e
+            logger.error(str(e))
+            raise
 
-        logger.info("New site "+instanceName+" was created.")
+    def desiredStateForSites(self, instanceNames=None):
+        # The declarative equivalent of catalogSite for many instances.
+        if instanceNames is None:
+            raise ValueError("instanceNames is empty")
+        desiredState=cmkReconciler.cmkDesiredState()
+        for instanceName in instanceNames:
+            if not isinstance(instanceName, str) or instanceName == "":
+                raise ValueError("instanceName must be a non-empty string")
+            new_host=str(instanceName)+"."+str(self._ovpnNetwork)+"."+str(self._ovpnNetworkDomain)
+            desiredState.addHost(hostName=new_host, folder="/")
+            desiredState.addSiteConnection(
+                siteID=instanceName,
+                ovpnNetwork=self._ovpnNetwork,
+                ovpnNetworkDomain=self._ovpnNetworkDomain
+            )
+            desiredState.setStatusHost(siteID=instanceName, hostName=new_host, statusSite=self._cmkSiteName)
+        return desiredState
+
+    def catalogSites(self, instanceNames=None, dryRun=False):
+        function_name = sys._getframe().f_code.co_name
+        class_name=self.__class__.__name__
+        function_name=class_name+"."+function_name
+        logger.debug("Entering function "+str(function_name))
+
+        reconciler=cmkReconciler.cmkReconciler(cmkAccess=self._cmkAccess, activationCoordinator=self._activationCoordinator)
+        plan=reconciler.reconcile(
+            desiredState=self.desiredStateForSites(instanceNames),
+            discoverNewHosts=True,
+            dryRun=dryRun
+        )
 
         logger.debug("Leaving function "+str(function_name))
-        return 
+        return plan
+
+    def offboardSites(self, instanceNames=None, dryRun=False):
+        # Removes the hosts and site connections catalogSite(s) created for
+        # the instances: a bulk delete, the connection deletes and one
+        # activation.
+        function_name = sys._getframe().f_code.co_name
+        class_name=self.__class__.__name__
+        function_name=class_name+"."+function_name
+        logger.debug("Entering function "+str(function_name))
 
+        if instanceNames is None:
+            raise ValueError("instanceNames is empty")
+        desiredState=cmkReconciler.cmkDesiredState()
+        for instanceName in instanceNames:
+            if not isinstance(instanceName, str) or instanceName == "":
+                raise ValueError("instanceName must be a non-empty string")
+            desiredState.removeHost(hostName=str(instanceName)+"."+str(self._ovpnNetwork)+"."+str(self._ovpnNetworkDomain))
+            desiredState.removeSiteConnection(siteID=instanceName)
 
+        reconciler=cmkReconciler.cmkReconciler(cmkAccess=self._cmkAccess, activationCoordinator=self._activationCoordinator)
+        plan=reconciler.reconcile(desiredState=desiredState, dryRun=dryRun)
 
+        logger.debug("Leaving function "+str(function_name))
+        return plan
@@ -0,0 +1,408 @@
+import sys
+import time
+import hashlib
+import sqlite3
+import threading
+from pathlib import Path
+from dwlab_cmkapi import cmk_RESTAPI
+
+import logging
+logger=logging.getLogger(__name__)
+
+class cmkSnapshotStore:
+    # Local SQLite copy of host, folder and site connection configuration.
+    # Every row keeps the decoded object as JSON together with its ETag (if
+    # the API returned one), the fetch timestamp and a content hash, so
+    # refreshes only rewrite rows whose content actually changed.
+    #
+    # Collection calls return no per-object ETags, so objects loaded through
+    # them are stored with a NULL etag. Readers get "" for those, which
+    # HostConfig.updateHost and SiteConnection.updateSiteConnection treat as
+    # "read the object before writing it". Folders never carry an ETag.
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )""",
+        """CREATE TABLE IF NOT EXISTS hosts (
+            name TEXT PRIMARY KEY,
+            folder TEXT,
+            site TEXT,
+            etag TEXT,
+            fetched REAL,
+            hash TEXT,
+            data TEXT
+        )""",
+        "CREATE INDEX IF NOT EXISTS hosts_folder ON hosts (folder)",
+        "CREATE INDEX IF NOT EXISTS hosts_site ON hosts (site)",
+        """CREATE TABLE IF NOT EXISTS host_attributes (
+            name TEXT,
+            key TEXT,
+            value TEXT,
+            PRIMARY KEY (name, key)
+        )""",
+        "CREATE INDEX IF NOT EXISTS host_attributes_key_value ON host_attributes (key, value)",
+        """CREATE TABLE IF NOT EXISTS folders (
+            path TEXT PRIMARY KEY,
+            id TEXT,
+            title TEXT,
+            etag TEXT,
+            fetched REAL,
+            hash TEXT,
+            data TEXT
+        )""",
+        """CREATE TABLE IF NOT EXISTS site_connections (
+            site_id TEXT PRIMARY KEY,
+            alias TEXT,
+            status_host TEXT,
+            etag TEXT,
+            fetched REAL,
+            hash TEXT,
+            data TEXT
+        )""",
+        "CREATE INDEX IF NOT EXISTS site_connections_status_host ON site_connections (status_host)"
+    ]
+
+    def __init__(self,
+                 path=None,
+                 codec=None
+                 ):
+        function_name = sys._getframe().f_code.co_name
+        class_name=self.__class__.__name__
+        function_name=class_name+"."+function_name
+        logger.debug("Entering function "+str(function_name))
+
+        if path is None:
+            raise ValueError("path is empty")
+        if codec is not None and not isinstance(codec, cmk_RESTAPI.JSONCodec):
+            raise TypeError("codec must be an instance of JSONCodec")
+        self._path=Path(path)
+        # Rows and hashes are only comparable when written by the same backend
+        self._codec=codec if codec is not None else cmk_RESTAPI.JSONCodec()
+        self._lock=threading.RLock()
+        self._db=sqlite3.connect(str(self._path), check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            for statement in self.SCHEMA:
+                self._db.execute(statement)
+
+    @property
+    def path(self):
+        return self._path
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def _encode(self, dataDict):
+        data=self._codec.encode(dataDict, sortKeys=True)
+        return data.decode("utf-8"), hashlib.sha256(data).hexdigest()
+
+    def _encodeValue(self, value):
+        return value if isinstance(value, str) else self._codec.encode(value, sortKeys=True).decode("utf-8")
+
+    def _decode(self, data):
+        return self._codec.decode(data)
+
+    @staticmethod
+    def _etag(etag):
+        # "" means the object came without an ETag; it is stored as NULL.
+        return etag if etag not in [None, ""] else None
+
+    @staticmethod
+    def _hostSite(host_config):
+        site=host_config.extensions.attributes.get("site")
+        if site is None:
+            site=host_config.extensions.effective_attributes.get("site", "")
+        return site
+
+    def _setMeta(self, key, value):
+        self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def getMeta(self, key, default=None):
+        with self._lock:
+            row=self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def storedVersion(self):
+        # Version the stored site connections were written for, or None
+        # when no site connections were saved yet.
+        value=self.getMeta("version")
+        if value is not None:
+            return cmk_RESTAPI.Version(**self._decode(value))
+        checkmkVersion=self.getMeta("checkmk_version")
+        if checkmkVersion is None:
+            return None
+        return cmk_RESTAPI.Version(site="", group="", rest_api={}, versions={"checkmk": checkmkVersion}, edition="", demo=False)
+
+    def lastRefresh(self, kind):
+        value=self.getMeta("last_refresh_"+str(kind))
+        return None if value is None else float(value)
+
+    ##########################################################################
+    # Hosts
+    ##########################################################################
+    def saveHosts(self, hostConfigs, fetched=None):
+        # Upserts the given hosts and returns the names whose stored content
+        # changed (including new hosts).
+        fetched=time.time() if fetched is None else fetched
+        changed=[]
+        with self._lock, self._db:
+            for host_config in hostConfigs:
+                data, contentHash=self._encode(host_config.to_dict())
+                row=self._db.execute("SELECT hash FROM hosts WHERE name = ?", (host_config.id,)).fetchone()
+                if row is not None and row[0]==contentHash:
+                    # Unchanged content keeps its ETag unless a fresh one is known
+                    self._db.execute("UPDATE hosts SET fetched = ?, etag = COALESCE(?, etag) WHERE name = ?", (fetched, self._etag(host_config.etag), host_config.id))
+                    continue
+                self._db.execute(
+                    "INSERT OR REPLACE INTO hosts (name, folder, site, etag, fetched, hash, data) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (host_config.id, host_config.extensions.folder, self._hostSite(host_config), self._etag(host_config.etag), fetched, contentHash, data)
+                )
+                self._db.execute("DELETE FROM host_attributes WHERE name = ?", (host_config.id,))
+                self._db.executemany(
+                    "INSERT INTO host_attributes (name, key, value) VALUES (?, ?, ?)",
+                    [(host_config.id, key, self._encodeValue(value))
+                     for key, value in host_config.extensions.attributes.items()]
+                )
+                changed.append(host_config.id)
+        return changed
+
+    def removeHosts(self, hostNames):
+        with self._lock, self._db:
+            for hostName in hostNames:
+                self._db.execute("DELETE FROM hosts WHERE name = ?", (hostName,))
+                self._db.execute("DELETE FROM host_attributes WHERE name = ?", (hostName,))
+
+    def _hostFromRow(self, row):
+        host_config=cmk_RESTAPI.HostConfig.from_dict(dataDict=self._decode(row[1]))
+        host_config.etag=row[0] if row[0] is not None else ""
+        return host_config
+
+    def getHost(self, hostName):
+        with self._lock:
+            row=self._db.execute("SELECT etag, data FROM hosts WHERE name = ?", (hostName,)).fetchone()
+        return None if row is None else self._hostFromRow(row)
+
+    def queryHosts(self, name=None, folder=None, recursive=False, attribute=None, value=None, site=None):
+        # name accepts SQLite GLOB patterns ("web*"); folder is matched
+        # literally, so folder names containing "*", "?" or "[" are fine.
+        # attribute/value match explicitly set host attributes.
+        conditions=[]
+        parameters=[]
+        if name is not None:
+            conditions.append("hosts.name GLOB ?")
+            parameters.append(name)
+        if folder is not None:
+            if recursive:
+                # Prefix comparison instead of GLOB, which would treat
+                # wildcards in the folder name as patterns
+                prefix=folder.rstrip("/")+"/"
+                conditions.append("(hosts.folder = ? OR substr(hosts.folder, 1, ?) = ?)")
+                parameters.extend([folder, len(prefix), prefix])
+            else:
+                conditions.append("hosts.folder = ?")
+                parameters.append(folder)
+        if site is not None:
+            conditions.append("hosts.site = ?")
+            parameters.append(site)
+        if attribute is not None:
+            if value is None:
+                conditions.append("hosts.name IN (SELECT name FROM host_attributes WHERE key = ?)")
+                parameters.append(attribute)
+            else:
+                conditions.append("hosts.name IN (SELECT name FROM host_attributes WHERE key = ? AND value = ?)")
+                parameters.extend([attribute, self._encodeValue(value)])
+        statement="SELECT etag, data FROM hosts"
+        if len(conditions) > 0:
+            statement+=" WHERE "+" AND ".join(conditions)
+        statement+=" ORDER BY name"
+        with self._lock:
+            rows=self._db.execute(statement, parameters).fetchall()
+        return [self._hostFromRow(row) for row in rows]
+
+    def hostNames(self):
+        with self._lock:
+            return [row[0] for row in self._db.execute("SELECT name FROM hosts ORDER BY name")]
+
+    ##########################################################################
+    # Folders
+    ##########################################################################
+    def saveFolders(self, folderConfigs, fetched=None):
+        fetched=time.time() if fetched is None else fetched
+        changed=[]
+        with self._lock, self._db:
+            for folder_config in folderConfigs:
+                path=folder_config.extensions.path
+                data, contentHash=self._encode(folder_config.to_dict())
+                row=self._db.execute("SELECT hash FROM folders WHERE path = ?", (path,)).fetchone()
+                if row is not None and row[0]==contentHash:
+                    self._db.execute("UPDATE folders SET fetched = ? WHERE path = ?", (fetched, path))
+                    continue
+                self._db.execute(
+                    "INSERT OR REPLACE INTO folders (path, id, title, etag, fetched, hash, data) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (path, folder_config.id, folder_config.title, None, fetched, contentHash, data)
+                )
+                changed.append(path)
+        return changed
+
+    def removeFolders(self, paths):
+        with self._lock, self._db:
+            for path in paths:
+                self._db.execute("DELETE FROM folders WHERE path = ?", (path,))
+
+    def getFolder(self, path):
+        with self._lock:
+            row=self._db.execute("SELECT data FROM folders WHERE path = ?", (path,)).fetchone()
+        return None if row is None else cmk_RESTAPI.FolderConfig.from_dict(dataDict=self._decode(row[0]))
+
+    def queryFolders(self, path=None, title=None):
+        conditions=[]
+        parameters=[]
+        if path is not None:
+            conditions.append("path GLOB ?")
+            parameters.append(path)
+        if title is not None:
+            conditions.append("title GLOB ?")
+            parameters.append(title)
+        statement="SELECT data FROM folders"
+        if len(conditions) > 0:
+            statement+=" WHERE "+" AND ".join(conditions)
+        statement+=" ORDER BY path"
+        with self._lock:
+            rows=self._db.execute(statement, parameters).fetchall()
+        return [cmk_RESTAPI.FolderConfig.from_dict(dataDict=self._decode(row[0])) for row in rows]
+
+    def folderPaths(self):
+        with self._lock:
+            return [row[0] for row in self._db.execute("SELECT path FROM folders ORDER BY path")]
+
+    ##########################################################################
+    # Site connections
+    ##########################################################################
+    def saveSiteConnections(self, siteConnections, version=None, fetched=None):
+        # Site connections are stored in the payload dialect of `version`
+        # (or of each connection's own version when none is given), which is
+        # remembered so later readers know what they are looking at.
+        fetched=time.time() if fetched is None else fetched
+        changed=[]
+        with self._lock, self._db:
+            for site_connection in siteConnections:
+                connectionVersion=cmk_RESTAPI.Version.resolve(version if version is not None else site_connection.version)
+                self._setMeta("checkmk_version", connectionVersion.checkmk_version)
+                self._setMeta("version", self._encodeValue(connectionVersion.to_dict()))
+                data, contentHash=self._encode(site_connection.to_dict(version=connectionVersion))
+                row=self._db.execute("SELECT hash FROM site_connections WHERE site_id = ?", (site_connection.id,)).fetchone()
+                if row is not None and row[0]==contentHash:
+                    self._db.execute("UPDATE site_connections SET fetched = ?, etag = COALESCE(?, etag) WHERE site_id = ?", (fetched, self._etag(site_connection.etag), site_connection.id))
+                    continue
+                status_host=site_connection.extensions.status_connection.status_host
+                self._db.execute(
+                    "INSERT OR REPLACE INTO site_connections (site_id, alias, status_host, etag, fetched, hash, data) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (site_connection.id, site_connection.extensions.basic_settings.alias,
+                     status_host.host if status_host.status_host_set!="disabled" else "",
+                     self._etag(site_connection.etag), fetched, contentHash, data)
+                )
+                changed.append(site_connection.id)
+        return changed
+
+    def removeSiteConnections(self, siteIDs):
+        with self._lock, self._db:
+            for siteID in siteIDs:
+                self._db.execute("DELETE FROM site_connections WHERE site_id = ?", (siteID,))
+
+    def _siteConnectionFromRow(self, row):
+        site_connection=cmk_RESTAPI.SiteConnection.from_dict(dataDict=self._decode(row[1]))
+        site_connection.etag=row[0] if row[0] is not None else ""
+        version=self.storedVersion()
+        if version is not None:
+            site_connection.version=version
+        return site_connection
+
+    def getSiteConnection(self, siteID):
+        with self._lock:
+            row=self._db.execute("SELECT etag, data FROM site_connections WHERE site_id = ?", (siteID,)).fetchone()
+        return None if row is None else self._siteConnectionFromRow(row)
+
+    def querySiteConnections(self, siteID=None, statusHost=None):
+        conditions=[]
+        parameters=[]
+        if siteID is not None:
+            conditions.append("site_id GLOB ?")
+            parameters.append(siteID)
+        if statusHost is not None:
+            conditions.append("status_host = ?")
+            parameters.append(statusHost)
+        statement="SELECT etag, data FROM site_connections"
+        if len(conditions) > 0:
+            statement+=" WHERE "+" AND ".join(conditions)
+        statement+=" ORDER BY site_id"
+        with self._lock:
+            rows=self._db.execute(statement, parameters).fetchall()
+        return [self._siteConnectionFromRow(row) for row in rows]
+
+    def siteIDs(self):
+        with self._lock:
+            return [row[0] for row in self._db.execute("SELECT site_id FROM site_connections ORDER BY site_id")]
+
+    ##########################################################################
+    # Refresh from the API
+    ##########################################################################
+    def _finishRefresh(self, kind, fetched, changed, known, current, remove):
+        removed=sorted(set(known)-set(current))
+        if len(removed) > 0:
+            remove(removed)
+        with self._lock, self._db:
+            self._setMeta("last_refresh_"+kind, fetched)
+        summary={
+            "added": sorted(set(changed)-set(known)),
+            "updated": sorted(set(changed)&set(known)),
+            "removed": removed
+        }
+        logger.info("Refreshed "+kind+": "+", ".join(key+"="+str(len(value)) for key, value in summary.items()))
+        return summary
+
+    def refreshHosts(self, cmkAccess=None):
+        fetched=time.time()
+        known=self.hostNames()
+        host_configs=cmk_RESTAPI.HostConfig.ListHosts(cmkAccess=cmkAccess)
+        changed=self.saveHosts(host_configs, fetched=fetched)
+        return self._finishRefresh("hosts", fetched, changed, known, [host_config.id for host_config in host_configs], self.removeHosts)
+
+    def refreshHost(self, hostName, cmkAccess=None):
+        # Re-reads a single host; hosts that no longer exist are dropped.
+        host_config=cmk_RESTAPI.HostConfig.ShowHost(requestedHost=hostName, cmkAccess=cmkAccess)
+        if host_config is None:
+            self.removeHosts([hostName])
+            return None
+        self.saveHosts([host_config])
+        return host_config
+
+    def refreshFolders(self, cmkAccess=None):
+        fetched=time.time()
+        known=self.folderPaths()
+        folder_configs=cmk_RESTAPI.FolderConfig.ListFolders(cmkAccess=cmkAccess)
+        changed=self.saveFolders(folder_configs, fetched=fetched)
+        return self._finishRefresh("folders", fetched, changed, known, [folder_config.extensions.path for folder_config in folder_configs], self.removeFolders)
+
+    def refreshSiteConnections(self, cmkAccess=None):
+        fetched=time.time()
+        known=self.siteIDs()
+        allSiteConnections=cmk_RESTAPI.SiteAllConnections(cmkAccess=cmkAccess)
+        changed=self.saveSiteConnections(allSiteConnections.value, version=cmkAccess.version, fetched=fetched)
+        return self._finishRefresh("site_connections", fetched, changed, known, allSiteConnections.getConnectedSiteIDs(), self.removeSiteConnections)
+
+    def refresh(self, cmkAccess=None):
+        if not isinstance(cmkAccess, cmk_RESTAPI.RestAPIcredentials):
+            raise TypeError("cmkAccess must be an instance of RestAPIcredentials")
+        return {
+            "hosts": self.refreshHosts(cmkAccess=cmkAccess),
+            "folders": self.refreshFolders(cmkAccess=cmkAccess),
+            "site_connections": self.refreshSiteConnections(cmkAccess=cmkAccess)
+        }
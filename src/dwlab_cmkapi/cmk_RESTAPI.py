@@ -2,6 +2,16 @@ import requests
 import pprint
 import inspect
 import json
+import threading
+import time
+import os
+import math
+import gzip
+import copy
+import hashlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from dwlab_basicpy import dwlabSettings
 from dwlab_basicpy import dwlabRuntimeEnvironment
 from pathlib import Path
@@ -9,13 +19,10 @@ from pathlib import Path
 import logging
 logger=logging.getLogger(__name__)
 
-VERSION=None
-def set_version(version):
-    if not isinstance(version,Version):
-        raise TypeError("version must be an instance of Version")
-    else:
-        global VERSION
-        VERSION=version
+try:
+    import orjson
+except ImportError:
+    orjson=None
 
 class Version:
     def __init__(self, site, group, rest_api, versions, edition, demo):
@@ -25,26 +32,20 @@ class Version:
         self.checkmk_version = versions.get("checkmk", "")
         self.edition = edition
         self.demo = demo
-        set_version(self)
 
     @classmethod
     def getVersion(cls, cmkAccess):
         if not isinstance(cmkAccess, RestAPIcredentials):
             raise TypeError("cmkAccess must be an instance of RestAPIcredentials")
-        apiUrl=cmkAccess.get_apiUrl(apiVersion="1.0.0")
         requestUrl="/version"
-        session = requests.session()
-        session.headers['Authorization'] = cmkAccess.credentials
         try:
-            resp = session.get(f"{apiUrl}{requestUrl}")
+            resp = cmkAccess.apiRequest("GET", requestUrl, apiVersion="1.0.0")
             if resp.status_code == 200:
-                json_data = resp.json()
+                json_data = cmkAccess.decodeResponse(resp)
             else:
                 raise RuntimeError(f"Failed to retrieve version information. Status code: {resp.status_code}")
         except requests.RequestException as e:
             raise RuntimeError(f"Error while accessing the API: {str(e)}")
-        finally:
-            session.close()
 
 
         return cls(
@@ -82,20 +83,609 @@ class Version:
     @checkmkVersion.setter
     def checkmkVersion(self, value):
         self.checkmk_version = value
-    
+
+    @property
+    def majorMinor(self):
+        # "2.3.0p12" -> (2, 3); unparsable versions compare lowest.
+        parts=str(self.checkmk_version).split(".")
+        try:
+            return (int(parts[0]), int(parts[1]))
+        except (ValueError, IndexError):
+            return (0, 0)
+
+    @classmethod
+    def resolve(cls, version=None):
+        # Version dependent payloads need the version of their own site,
+        # i.e. cmkAccess.version or the version of the object read from it.
+        if not isinstance(version, Version):
+            raise ValueError("A Version instance is required to build version dependent payloads")
+        return version
+
+class JSONCodec:
+    # Encodes request bodies to bytes and decodes raw response bytes. Uses
+    # orjson when it is installed and the standard library otherwise.
+    BACKENDS = ["orjson", "json"]
+
+    def __init__(self, backend=None):
+        if backend is None:
+            backend="orjson" if orjson is not None else "json"
+        if backend not in self.BACKENDS:
+            raise ValueError("Unknown JSON backend: "+str(backend))
+        if backend=="orjson" and orjson is None:
+            raise ValueError("The orjson backend is not installed")
+        self._backend=backend
+
+    @property
+    def backend(self):
+        return self._backend
+
+    def encode(self, obj, sortKeys=False):
+        if self._backend=="orjson":
+            return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS if sortKeys else 0)
+        return json.dumps(obj, sort_keys=sortKeys, separators=(",", ":")).encode("utf-8")
+
+    def decode(self, data):
+        if self._backend=="orjson":
+            return orjson.loads(data)
+        return json.loads(data)
+
+class APICapabilities:
+    # Feature flags of one site's REST API. Derived from the Checkmk version
+    # and optionally refined by probing the served OpenAPI spec. Computed
+    # once per site and version via forSite().
+    _cache = {}
+    _cacheLock = threading.Lock()
+
+    BULK_CREATE_HOSTS_URL = "/domain-types/host_config/actions/bulk-create/invoke"
+    BULK_UPDATE_HOSTS_URL = "/domain-types/host_config/actions/bulk-update/invoke"
+    BULK_DELETE_HOSTS_URL = "/domain-types/host_config/actions/bulk-delete/invoke"
+    BULK_DISCOVERY_URL = "/domain-types/discovery_run/actions/bulk-discovery-start/invoke"
+    ACTIVATION_STATUS_URL = "/objects/activation_run/{activation_id}"
+    SITE_CONNECTIONS_URL = "/domain-types/site_connection/collections/all"
+
+    def __init__(self,
+                 checkmkVersion="",
+                 payloadDialect="2.3",
+                 siteConnections=False,
+                 bulkCreateHosts=False,
+                 bulkUpdateHosts=False,
+                 bulkDeleteHosts=False,
+                 bulkDiscovery=False,
+                 activationStatus=False,
+                 probed=False
+        ):
+        self._checkmkVersion = checkmkVersion
+        self._payloadDialect = payloadDialect
+        self._siteConnections = siteConnections
+        self._bulkCreateHosts = bulkCreateHosts
+        self._bulkUpdateHosts = bulkUpdateHosts
+        self._bulkDeleteHosts = bulkDeleteHosts
+        self._bulkDiscovery = bulkDiscovery
+        self._activationStatus = activationStatus
+        self._probed = probed
+
+    @property
+    def checkmkVersion(self):
+        return self._checkmkVersion
+
+    @property
+    def payloadDialect(self):
+        return self._payloadDialect
+
+    @property
+    def siteConnections(self):
+        return self._siteConnections
+
+    @property
+    def bulkCreateHosts(self):
+        return self._bulkCreateHosts
+
+    @property
+    def bulkUpdateHosts(self):
+        return self._bulkUpdateHosts
+
+    @property
+    def bulkDeleteHosts(self):
+        return self._bulkDeleteHosts
+
+    @property
+    def bulkDiscovery(self):
+        return self._bulkDiscovery
+
+    @property
+    def activationStatus(self):
+        return self._activationStatus
+
+    @property
+    def probed(self):
+        return self._probed
+
+    @staticmethod
+    def dialectFor(version):
+        return "2.2" if version.majorMinor<=(2,2) else "2.3"
+
+    @classmethod
+    def fromVersion(cls, version):
+        if not isinstance(version, Version):
+            raise TypeError("version must be an instance of Version")
+        majorMinor=version.majorMinor
+        return cls(
+            checkmkVersion=version.checkmk_version,
+            payloadDialect=cls.dialectFor(version),
+            siteConnections=majorMinor>=(2,2),
+            bulkCreateHosts=majorMinor>=(2,0),
+            bulkUpdateHosts=majorMinor>=(2,0),
+            bulkDeleteHosts=majorMinor>=(2,0),
+            bulkDiscovery=majorMinor>=(2,2),
+            activationStatus=majorMinor>=(2,0)
+        )
+
+    @classmethod
+    def probe(cls, cmkAccess, capabilities=None):
+        # Refines version derived flags with the paths found in the served
+        # OpenAPI spec. Sites that do not serve the spec keep the version
+        # derived flags, but still count as probed so forSite() does not
+        # retry on every call.
+        if capabilities is None:
+            capabilities=cls.fromVersion(cmkAccess.version)
+        capabilities._probed=True
+        try:
+            resp=cmkAccess.apiRequest("GET", "/openapi-doc.json")
+        except requests.RequestException as e:
+            logger.warning("Probing the API spec failed: "+str(e))
+            return capabilities
+        if resp.status_code != 200:
+            logger.warning("Probing the API spec failed with status code "+str(resp.status_code))
+            return capabilities
+        try:
+            paths=cmkAccess.decodeResponse(resp).get("paths", {})
+        except ValueError:
+            logger.warning("The API spec is not valid JSON")
+            return capabilities
+        return cls(
+            checkmkVersion=capabilities.checkmkVersion,
+            payloadDialect=capabilities.payloadDialect,
+            siteConnections=cls.SITE_CONNECTIONS_URL in paths,
+            bulkCreateHosts=cls.BULK_CREATE_HOSTS_URL in paths,
+            bulkUpdateHosts=cls.BULK_UPDATE_HOSTS_URL in paths,
+            bulkDeleteHosts=cls.BULK_DELETE_HOSTS_URL in paths,
+            bulkDiscovery=cls.BULK_DISCOVERY_URL in paths,
+            activationStatus=cls.ACTIVATION_STATUS_URL in paths,
+            probed=True
+        )
+
+    @classmethod
+    def forSite(cls, cmkAccess, probe=False):
+        if not isinstance(cmkAccess, RestAPIcredentials):
+            raise TypeError("cmkAccess must be an instance of RestAPIcredentials")
+        cacheKey=(cmkAccess.siteKey, cmkAccess.version.checkmk_version)
+        with cls._cacheLock:
+            capabilities=cls._cache.get(cacheKey)
+        if capabilities is not None and (capabilities.probed or not probe):
+            return capabilities
+        if probe:
+            capabilities=cls.probe(cmkAccess)
+        else:
+            capabilities=cls.fromVersion(cmkAccess.version)
+        with cls._cacheLock:
+            cls._cache[cacheKey]=capabilities
+        return capabilities
+
+    def to_dict(self):
+        return {
+            "checkmkVersion": self._checkmkVersion,
+            "payloadDialect": self._payloadDialect,
+            "siteConnections": self._siteConnections,
+            "bulkCreateHosts": self._bulkCreateHosts,
+            "bulkUpdateHosts": self._bulkUpdateHosts,
+            "bulkDeleteHosts": self._bulkDeleteHosts,
+            "bulkDiscovery": self._bulkDiscovery,
+            "activationStatus": self._activationStatus,
+            "probed": self._probed
+        }
+
+class TokenBucket:
+    # Classic token bucket: `rate` tokens are refilled per second up to
+    # `burst`; acquire() blocks until a token is available.
+    def __init__(self,
+                 rate=10.0,
+                 burst=20
+        ):
+        if rate <= 0: raise ValueError("rate must be greater than 0")
+        if burst < 1: raise ValueError("burst must be at least 1")
+        self._rate = float(rate)
+        self._burst = float(burst)
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self):
+        return self._rate
+
+    @property
+    def burst(self):
+        return self._burst
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                waitTime = (1.0 - self._tokens) / self._rate
+            time.sleep(waitTime)
+
+class RequestBudget:
+    # A token bucket combined with a cap on the number of requests in flight.
+    def __init__(self,
+                 rate=10.0,
+                 burst=20,
+                 maxInFlight=8
+        ):
+        if maxInFlight < 1: raise ValueError("maxInFlight must be at least 1")
+        self._bucket = TokenBucket(rate=rate, burst=burst)
+        self._maxInFlight = maxInFlight
+        self._inFlight = 0
+        self._semaphore = threading.BoundedSemaphore(maxInFlight)
+        self._lock = threading.Lock()
+
+    @property
+    def bucket(self):
+        return self._bucket
+
+    @property
+    def maxInFlight(self):
+        return self._maxInFlight
+
+    @property
+    def inFlight(self):
+        return self._inFlight
+
+    @contextmanager
+    def slot(self):
+        self._semaphore.acquire()
+        try:
+            self._bucket.acquire()
+            with self._lock:
+                self._inFlight += 1
+            try:
+                yield
+            finally:
+                with self._lock:
+                    self._inFlight -= 1
+        finally:
+            self._semaphore.release()
+
+class RequestThrottle:
+    # Separate budgets for cheap read calls, ordinary writes (host and
+    # folder edits) and the expensive calls that start background work on
+    # the site (activations, service discovery).
+    CATEGORIES = ["read", "write", "expensive"]
+    EXPENSIVE_URLS = [
+        "/domain-types/activation_run/actions/activate-changes/invoke",
+        "/domain-types/service_discovery_run/actions/start/invoke",
+        APICapabilities.BULK_DISCOVERY_URL
+    ]
+
+    def __init__(self,
+                 readRate=10.0,
+                 readBurst=20,
+                 readMaxInFlight=8,
+                 writeRate=10.0,
+                 writeBurst=20,
+                 writeMaxInFlight=16,
+                 expensiveRate=1.0,
+                 expensiveBurst=2,
+                 expensiveMaxInFlight=2
+        ):
+        self._budgets = {
+            "read": RequestBudget(rate=readRate, burst=readBurst, maxInFlight=readMaxInFlight),
+            "write": RequestBudget(rate=writeRate, burst=writeBurst, maxInFlight=writeMaxInFlight),
+            "expensive": RequestBudget(rate=expensiveRate, burst=expensiveBurst, maxInFlight=expensiveMaxInFlight)
+        }
+        self._lock = threading.Lock()
+
+    @property
+    def lock(self):
+        return self._lock
+
+    @classmethod
+    def categoryOf(cls, method, requestUrl):
+        if method.upper() in ["GET", "HEAD"]:
+            return "read"
+        if requestUrl.split("?")[0] in cls.EXPENSIVE_URLS:
+            return "expensive"
+        return "write"
+
+    def budget(self, category="read"):
+        if category not in self._budgets:
+            raise ValueError("Unknown request category: "+str(category))
+        return self._budgets[category]
+
+    def slot(self, category="read"):
+        return self.budget(category).slot()
+
+    def to_dict(self):
+        return {
+            category: {
+                "rate": budget.bucket.rate,
+                "burst": budget.bucket.burst,
+                "maxInFlight": budget.maxInFlight,
+                "inFlight": budget.inFlight
+            }
+            for category, budget in self._budgets.items()
+        }
+
+class AdaptiveLimiter:
+    # AIMD concurrency limit for bulk operations. The limit grows by one
+    # after every window of requests whose p95 latency stays within
+    # `latencyTolerance` of the baseline, and is multiplied by
+    # `backoffFactor` when the p95 rises, the site answers with 429/503,
+    # times out or refuses the connection.
+    BACKOFF_STATUS_CODES = [429, 503]
+
+    def __init__(self,
+                 initialLimit=4,
+                 minLimit=1,
+                 maxLimit=32,
+                 windowSize=20,
+                 latencyTolerance=1.5,
+                 backoffFactor=0.5
+        ):
+        if not 1 <= minLimit <= initialLimit <= maxLimit:
+            raise ValueError("Limits must satisfy 1 <= minLimit <= initialLimit <= maxLimit")
+        if not 0 < backoffFactor < 1:
+            raise ValueError("backoffFactor must be between 0 and 1")
+        self._limit = initialLimit
+        self._minLimit = minLimit
+        self._maxLimit = maxLimit
+        self._windowSize = windowSize
+        self._latencyTolerance = latencyTolerance
+        self._backoffFactor = backoffFactor
+        self._inFlight = 0
+        self._window = deque(maxlen=windowSize)
+        self._samplesSinceChange = 0
+        self._samplesSinceDecrease = 0
+        self._baseline = None
+        self._p95 = None
+        self._increases = 0
+        self._decreases = 0
+        self._errors = 0
+        self._condition = threading.Condition()
+
+    @property
+    def limit(self):
+        return self._limit
+
+    @property
+    def inFlight(self):
+        return self._inFlight
+
+    @property
+    def p95(self):
+        return self._p95
+
+    @contextmanager
+    def slot(self):
+        with self._condition:
+            while self._inFlight >= self._limit:
+                self._condition.wait()
+            self._inFlight += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._inFlight -= 1
+                self._condition.notify_all()
+
+    def record(self, latency, statusCode=None, timedOut=False, failed=False):
+        with self._condition:
+            self._samplesSinceChange += 1
+            self._samplesSinceDecrease += 1
+            if timedOut or failed or statusCode in self.BACKOFF_STATUS_CODES:
+                self._errors += 1
+                # One decrease per in-flight generation, otherwise a burst
+                # of failures from the same wave collapses the limit.
+                if self._samplesSinceDecrease >= self._limit:
+                    if timedOut:
+                        reason="timeout"
+                    elif failed:
+                        reason="connection error"
+                    else:
+                        reason="status "+str(statusCode)
+                    self._decrease(reason)
+                return
+
+            self._window.append(latency)
+            if len(self._window) < self._windowSize or self._samplesSinceChange < self._windowSize:
+                return
+            ordered = sorted(self._window)
+            self._p95 = ordered[max(0, math.ceil(0.95*len(ordered))-1)]
+            if self._baseline is None:
+                self._baseline = self._p95
+            if self._p95 <= self._baseline*self._latencyTolerance:
+                self._baseline = 0.9*self._baseline + 0.1*self._p95
+                self._increase()
+            else:
+                self._decrease("p95 "+format(self._p95, ".3f")+"s")
+
+    def _increase(self):
+        self._samplesSinceChange = 0
+        if self._limit < self._maxLimit:
+            self._limit += 1
+            self._increases += 1
+            logger.debug("Adaptive concurrency limit raised to "+str(self._limit))
+            self._condition.notify_all()
+
+    def _decrease(self, reason):
+        self._samplesSinceChange = 0
+        self._samplesSinceDecrease = 0
+        newLimit = max(self._minLimit, int(self._limit*self._backoffFactor))
+        if newLimit < self._limit:
+            self._limit = newLimit
+            self._decreases += 1
+            logger.info("Adaptive concurrency limit lowered to "+str(self._limit)+" ("+reason+")")
+
+    def metrics(self):
+        with self._condition:
+            return {
+                "limit": self._limit,
+                "minLimit": self._minLimit,
+                "maxLimit": self._maxLimit,
+                "inFlight": self._inFlight,
+                "p95": self._p95,
+                "baseline": self._baseline,
+                "increases": self._increases,
+                "decreases": self._decreases,
+                "errors": self._errors
+            }
+
+    def map(self, function, items):
+        # Runs function(item) for every item with at most `limit` calls in
+        # flight and returns a list of (item, result, exception) tuples in
+        # the order of `items`.
+        items = list(items)
+        def run(item):
+            with self.slot():
+                try:
+                    return (item, function(item), None)
+                except Exception as e:
+                    return (item, None, e)
+        if len(items) == 0:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self._maxLimit, len(items))) as executor:
+            return list(executor.map(run, items))
+
+class BulkOperationError(RuntimeError):
+    def __init__(self, message, results=None, errors=None):
+        super().__init__(message)
+        self.results = results if results is not None else {}
+        self.errors = errors if errors is not None else {}
+
+    @classmethod
+    def check(cls, operation, outcomes):
+        # Turns AdaptiveLimiter.map() outcomes into a result dict keyed by
+        # item, raising with the partial results if any call failed.
+        results = {}
+        errors = {}
+        for item, result, exception in outcomes:
+            if exception is None:
+                results[item] = result
+            else:
+                logger.error(operation+" failed for "+str(item)+": "+str(exception))
+                errors[item] = exception
+        if len(errors) > 0:
+            raise cls(operation+" failed for "+str(len(errors))+" of "+str(len(outcomes))+" items", results, errors)
+        return results
+
+class ConcurrentModificationError(RuntimeError):
+    # A conditional write kept failing with 412 because the object was
+    # changed by someone else on every attempt.
+    pass
+
+class BandwidthStats:
+    # Bytes on the wire vs. decoded bytes per endpoint. Object ids are
+    # folded into "{id}" so all hosts/sites share one endpoint entry.
+    def __init__(self):
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def endpoint(method, requestUrl):
+        parts=requestUrl.split("?")[0].split("/")
+        if len(parts) > 3 and parts[1]=="objects":
+            parts[3]="{id}"
+        return method.upper()+" "+"/".join(parts)
+
+    def record(self, method, requestUrl, requestBytes=0, requestBytesUncompressed=0, responseBytes=0, responseBytesUncompressed=0):
+        endpoint=self.endpoint(method, requestUrl)
+        with self._lock:
+            stats=self._endpoints.setdefault(endpoint, {
+                "requests": 0,
+                "requestBytes": 0,
+                "requestBytesUncompressed": 0,
+                "responseBytes": 0,
+                "responseBytesUncompressed": 0
+            })
+            stats["requests"]+=1
+            stats["requestBytes"]+=requestBytes
+            stats["requestBytesUncompressed"]+=requestBytesUncompressed
+            stats["responseBytes"]+=responseBytes
+            stats["responseBytesUncompressed"]+=responseBytesUncompressed
+
+    def reset(self):
+        with self._lock:
+            self._endpoints = {}
+
+    def totals(self):
+        totals={
+            "requests": 0,
+            "requestBytes": 0,
+            "requestBytesUncompressed": 0,
+            "responseBytes": 0,
+            "responseBytesUncompressed": 0
+        }
+        with self._lock:
+            for stats in self._endpoints.values():
+                for key in totals:
+                    totals[key]+=stats[key]
+        return totals
+
+    def to_dict(self):
+        with self._lock:
+            return {endpoint: dict(stats) for endpoint, stats in self._endpoints.items()}
+
 class RestAPIcredentials:
+    # Throttles are shared by every RestAPIcredentials instance pointing at
+    # the same site, so separately constructed credentials objects used by
+    # different threads still draw from one budget.
+    _throttles = {}
+    _adaptiveLimiters = {}
+    _throttlesLock = threading.Lock()
+
     def __init__(self, 
                  cmkHostname="", 
                  cmkDomain="",
                  cmkSiteName="", 
                  credentials=None,
                  username=None,
-                 password=None
+                 password=None,
+                 throttle=None,
+                 codec=None,
+                 compressRequests=False,
+                 compressThreshold=8192,
+                 timeout=(10, 120)
                  ):
         self._cmkHostname=cmkHostname 
         self._cmkDomain=cmkDomain
         self._cmkSiteName=cmkSiteName
         self._credentials = credentials
+        self._sessions = threading.local()
+        self._versionLock = threading.Lock()
+        if throttle is not None and not isinstance(throttle, RequestThrottle):
+            raise TypeError("throttle must be an instance of RequestThrottle")
+        self._throttle = throttle if throttle is not None else self.siteThrottle(self.siteKey)
+        self._adaptiveLimiter = self.siteAdaptiveLimiter(self.siteKey)
+        if codec is not None and not isinstance(codec, JSONCodec):
+            raise TypeError("codec must be an instance of JSONCodec")
+        self._codec = codec if codec is not None else JSONCodec()
+        # Request bodies are only gzipped on request: Checkmk's Apache must
+        # be configured (mod_deflate input filter) to accept them.
+        self._compressRequests = compressRequests
+        self._compressThreshold = compressThreshold
+        # (connect, read) timeout for every request that doesn't pass its own,
+        # so a stalled site fails and the AdaptiveLimiter can back off.
+        self._timeout = timeout
+        self._bandwidth = BandwidthStats()
+        # Counts the writes sent through this object, see AllActivations.cachedETag
+        self._writeGeneration = 0
         if isinstance(username,str):
             self._username=username
         if isinstance(password,str):
@@ -151,11 +741,93 @@ class RestAPIcredentials:
 
     @property
     def version(self):
-        return self._version
+        with self._versionLock:
+            return self._version
     @version.setter
     def version(self, value):
-        self._version = value
-        set_version(self._version)
+        if not isinstance(value, Version):
+            raise TypeError("version must be an instance of Version")
+        with self._versionLock:
+            self._version = value
+
+    @property
+    def throttle(self):
+        return self._throttle
+    @throttle.setter
+    def throttle(self, value):
+        if not isinstance(value, RequestThrottle):
+            raise TypeError("throttle must be an instance of RequestThrottle")
+        self._throttle = value
+
+    @property
+    def codec(self):
+        return self._codec
+    @codec.setter
+    def codec(self, value):
+        if not isinstance(value, JSONCodec):
+            raise TypeError("codec must be an instance of JSONCodec")
+        self._codec = value
+
+    @property
+    def compressRequests(self):
+        return self._compressRequests
+    @compressRequests.setter
+    def compressRequests(self, value):
+        self._compressRequests = value
+
+    @property
+    def compressThreshold(self):
+        return self._compressThreshold
+    @compressThreshold.setter
+    def compressThreshold(self, value):
+        self._compressThreshold = value
+
+    @property
+    def timeout(self):
+        return self._timeout
+    @timeout.setter
+    def timeout(self, value):
+        self._timeout = value
+
+    @property
+    def bandwidth(self):
+        return self._bandwidth
+
+    @property
+    def capabilities(self):
+        return APICapabilities.forSite(self)
+
+    @property
+    def adaptiveLimiter(self):
+        return self._adaptiveLimiter
+    @adaptiveLimiter.setter
+    def adaptiveLimiter(self, value):
+        if not isinstance(value, AdaptiveLimiter):
+            raise TypeError("adaptiveLimiter must be an instance of AdaptiveLimiter")
+        self._adaptiveLimiter = value
+
+    @property
+    def writeGeneration(self):
+        with self._throttle.lock:
+            return self._writeGeneration
+
+    @property
+    def siteKey(self):
+        return str(self._cmkHostname)+"."+str(self._cmkDomain)+"/"+str(self._cmkSiteName)
+
+    @classmethod
+    def siteThrottle(cls, siteKey):
+        with cls._throttlesLock:
+            if siteKey not in cls._throttles:
+                cls._throttles[siteKey] = RequestThrottle()
+            return cls._throttles[siteKey]
+
+    @classmethod
+    def siteAdaptiveLimiter(cls, siteKey):
+        with cls._throttlesLock:
+            if siteKey not in cls._adaptiveLimiters:
+                cls._adaptiveLimiters[siteKey] = AdaptiveLimiter()
+            return cls._adaptiveLimiters[siteKey]
 
     def get_apiUrl(self,apiVersion=""):
         if apiVersion=="":
@@ -163,6 +835,88 @@ class RestAPIcredentials:
         apiUrl="https://"+str(self._cmkHostname)+"."+str(self._cmkDomain)+"/"+str(self._cmkSiteName)+"/check_mk/api/"+apiVersion
         return apiUrl
 
+    def _session(self):
+        # requests sessions are not safe to share between threads, so every
+        # thread keeps its own keep-alive session per credentials object.
+        session = getattr(self._sessions, "session", None)
+        if session is None:
+            session = requests.session()
+            self._sessions.session = session
+        return session
+
+    def apiRequest(self, method, requestUrl, apiVersion="", category=None, headers=None, jsonBody=None, data=None, **kwargs):
+        # `jsonBody` is encoded exactly once through the codec; `data` is
+        # sent as is and must already be encoded JSON bytes.
+        if category is None:
+            category = RequestThrottle.categoryOf(method, requestUrl)
+
+        apiUrl=self.get_apiUrl(apiVersion=apiVersion)
+        requestHeaders={
+            "Authorization": f"{self._credentials}",
+            "Accept": "application/json",
+            "Accept-Encoding": "gzip, deflate"
+        }
+        if jsonBody is not None:
+            data=self._codec.encode(jsonBody)
+        requestBytesUncompressed=0
+        if data is not None:
+            requestHeaders["Content-Type"]="application/json"
+            requestBytesUncompressed=len(data)
+            if self._compressRequests and len(data) >= self._compressThreshold:
+                data=gzip.compress(data, compresslevel=6)
+                requestHeaders["Content-Encoding"]="gzip"
+        if headers is not None:
+            requestHeaders.update(headers)
+
+        kwargs.setdefault("timeout", self._timeout)
+        session=self._session()
+        with self._throttle.slot(category):
+            started=time.monotonic()
+            try:
+                resp = session.request(method, apiUrl+requestUrl, headers=requestHeaders, data=data, **kwargs)
+            except requests.Timeout:
+                self._adaptiveLimiter.record(time.monotonic()-started, timedOut=True)
+                raise
+            except requests.ConnectionError:
+                self._adaptiveLimiter.record(time.monotonic()-started, failed=True)
+                raise
+            self._adaptiveLimiter.record(time.monotonic()-started, statusCode=resp.status_code)
+        if category != "read" and 200 <= resp.status_code < 300:
+            # Only writes that took effect can have changed the site
+            with self._throttle.lock:
+                self._writeGeneration += 1
+
+        if kwargs.get("stream", False):
+            # The body is left unread; only the request is accounted for.
+            self._bandwidth.record(
+                method, requestUrl,
+                requestBytes=len(data) if data is not None else 0,
+                requestBytesUncompressed=requestBytesUncompressed,
+                responseBytes=0,
+                responseBytesUncompressed=0
+            )
+            return resp
+
+        responseBytesUncompressed=len(resp.content)
+        # urllib3 counts the bytes read from the socket, i.e. before the
+        # Content-Encoding is undone.
+        try:
+            responseBytes=int(resp.raw.tell())
+        except (AttributeError, TypeError, ValueError):
+            responseBytes=0
+        if responseBytes==0:
+            responseBytes=int(resp.headers.get("Content-Length", responseBytesUncompressed) or 0)
+        self._bandwidth.record(
+            method, requestUrl,
+            requestBytes=len(data) if data is not None else 0,
+            requestBytesUncompressed=requestBytesUncompressed,
+            responseBytes=responseBytes,
+            responseBytesUncompressed=responseBytesUncompressed
+        )
+        return resp
+
+    def decodeResponse(self, resp):
+        return self._codec.decode(resp.content)
     
     @classmethod 
     def fromFile(cls,configFile=None):
@@ -263,6 +1017,17 @@ class Link:
             "type": self._type
         }
 
+    @classmethod
+    def from_dict(cls, dataDict=None):
+        if dataDict is None:
+            raise ValueError("dataDict is None")
+        return cls(domainType=dataDict.get('domainType',''),
+                   href=dataDict.get('href',''),
+                   method=dataDict.get('method',''),
+                   rel=dataDict.get('rel',''),
+                   type=dataDict.get('type','')
+        )
+
 class Hosts:
     def __init__(self, 
                  links=None, 
@@ -609,6 +1374,105 @@ class FolderConfig:
         "extensions": self._extensions.to_dict()
     }
 
+    @classmethod
+    def from_dict(cls, dataDict=None):
+        if dataDict is None:
+            raise ValueError("dataDict is None")
+        membersDict=dataDict.get('members', {})
+        hostsDict=membersDict.get('hosts', {})
+        moveDict=membersDict.get('move', {})
+        extensionsDict=dataDict.get('extensions', {})
+        return cls(
+            links=[Link.from_dict(linkDataDict) for linkDataDict in dataDict.get('links', [])],
+            domainType=dataDict.get('domainType', ""),
+            id=dataDict.get('id', ""),
+            title=dataDict.get('title', ""),
+            members=FolderConfigMembers(
+                hosts=Hosts(
+                    links=[Link.from_dict(linkDataDict) for linkDataDict in hostsDict.get('links', [])],
+                    id=hostsDict.get('id', ""),
+                    disabledReason=hostsDict.get('disabledReason', ""),
+                    invalidReason=hostsDict.get('invalidReason', ""),
+                    x_ro_invalidReason=hostsDict.get('x-ro-invalidReason', ""),
+                    memberType=hostsDict.get('memberType', ""),
+                    value=[Link.from_dict(linkDataDict) for linkDataDict in hostsDict.get('value', [])],
+                    name=hostsDict.get('name', ""),
+                    title=hostsDict.get('title', "")
+                ),
+                move=Move(
+                    links=[Link.from_dict(linkDataDict) for linkDataDict in moveDict.get('links', [])],
+                    id=moveDict.get('id', ""),
+                    disabledReason=moveDict.get('disabledReason', ""),
+                    invalidReason=moveDict.get('invalidReason', ""),
+                    x_ro_invalidReason=moveDict.get('x-ro-invalidReason', ""),
+                    memberType=moveDict.get('memberType', ""),
+                    parameters=moveDict.get('parameters', {}),
+                    name=moveDict.get('name', ""),
+                    title=moveDict.get('title', "")
+                )
+            ),
+            extensions=FolderExtensions(
+                path=extensionsDict.get('path', "/"),
+                attributes=extensionsDict.get('attributes', {})
+            )
+        )
+
+    @classmethod
+    def ListFolders(cls, parent="~", recursive=True, showHosts=False, cmkAccess=None):
+        function_name = inspect.currentframe().f_code.co_name
+        logger.debug("Entering function "+str(function_name))
+
+        if not isinstance(cmkAccess,RestAPIcredentials): raise ValueError("cmkAccess are not of type RESTAPIcredentials")
+
+        requestUrl="/domain-types/folder_config/collections/all"
+        params={
+            "parent": parent,
+            "recursive": "true" if recursive else "false",
+            "show_hosts": "true" if showHosts else "false"
+        }
+
+        resp = cmkAccess.apiRequest("GET", requestUrl, params=params)
+        if resp.status_code == 200:
+            response_data=cmkAccess.decodeResponse(resp)
+            logger.debug("API request status_code : "+str(resp.status_code))
+        else:
+            logger.error(pprint.pformat(cmkAccess.decodeResponse(resp)))
+            raise RuntimeError(pprint.pformat(cmkAccess.decodeResponse(resp)))
+
+        folder_configs=[]
+        for dataDict in response_data.get('value', []):
+            folder_configs.append(cls.from_dict(dataDict=dataDict))
+
+        logger.debug("Leaving function "+str(function_name))
+        return folder_configs
+
+    @classmethod
+    def ShowFolder(cls, folder="~", showHosts=False, cmkAccess=None):
+        # folder is a folder id such as "~" or "~a~b".
+        function_name = inspect.currentframe().f_code.co_name
+        logger.debug("Entering function "+str(function_name))
+
+        if not isinstance(cmkAccess,RestAPIcredentials): raise ValueError("cmkAccess are not of type RESTAPIcredentials")
+
+        folder_config=None
+        requestUrl="/objects/folder_config/"+folder
+        resp = cmkAccess.apiRequest("GET", requestUrl, params={"show_hosts": "true" if showHosts else "false"})
+        if resp.status_code == 200:
+            folder_config=cls.from_dict(dataDict=cmkAccess.decodeResponse(resp))
+        elif resp.status_code == 404:
+            logger.warning("Folder "+str(folder)+" not found")
+        else:
+            logger.error(pprint.pformat(cmkAccess.decodeResponse(resp)))
+            raise RuntimeError(pprint.pformat(cmkAccess.decodeResponse(resp)))
+
+        logger.debug("Leaving function "+str(function_name))
+        return folder_config
+
+    @property
+    def hostNames(self):
+        # Names of the hosts listed as members when read with showHosts.
+        return [link.href.rstrip("/").rsplit("/", 1)[-1] for link in self._members.hosts.value]
+
 class Members:
     def __init__(self, 
                  folder_config=None
@@ -635,7 +1499,8 @@ class HostConfig:
                  id="", 
                  links=None, 
                  members=None, 
-                 title=""
+                 title="",
+                 etag=""
         ):
         
         self._domainType = domainType
@@ -644,6 +1509,7 @@ class HostConfig:
         self._links = links if links is not None else []
         self._members = members if members is not None else []
         self._title = title
+        self._etag = etag
 
     @property
     def domainType(self):
@@ -693,9 +1559,17 @@ class HostConfig:
     def title(self, value):
         self._title = value
 
+    @property
+    def etag(self):
+        return self._etag
+
+    @etag.setter
+    def etag(self, value):
+        self._etag = value
+
     def to_dict(self):
         resultDict=dict()
-        resultDict["domainType="] = self._domainType
+        resultDict["domainType"] = self._domainType
         resultDict["extensions"] = self._extensions.to_dict()
         resultDict["id"] =self._id
         resultDict["links"] = [link.to_dict() for link in self._links]
@@ -718,15 +1592,16 @@ class HostConfig:
                       type=linkDataDict.get('type','')
             )
             linkArray.append(link)
+        extensionsDict=dataDict.get('extensions', {})
         hostconfig=cls(
             domainType=dataDict.get('domainType', ""),
             extensions=HostExtensions(
-                folder=dataDict['extensions'].get('folder', {}),
-                attributes=dataDict['extensions'].get('attributes', {}),
-                effective_attributes=dataDict['extensions'].get('effective_attributes', {}),
-                is_cluster=dataDict['extensions'].get('is_cluster', {}),
-                is_offline=dataDict['extensions'].get('is_offline', {}),
-                cluster_nodes=dataDict['extensions'].get('cluster_nodes', {})
+                folder=extensionsDict.get('folder', {}),
+                attributes=extensionsDict.get('attributes', {}),
+                effective_attributes=extensionsDict.get('effective_attributes', {}),
+                is_cluster=extensionsDict.get('is_cluster', {}),
+                is_offline=extensionsDict.get('is_offline', {}),
+                cluster_nodes=extensionsDict.get('cluster_nodes', {})
             ),
             id=dataDict.get('id', ""),
             links=linkArray,
@@ -746,31 +1621,27 @@ class HostConfig:
         if cmkAccess == None: raise ValueError("cmkAccess is empty")
         
         host_config=None
-        apiUrl=cmkAccess.get_apiUrl()
         requestUrl="/objects/host_config/"+requestedHost
 
-        session = requests.session()
-        session.headers['Authorization'] = f"{cmkAccess.credentials}"
-        session.headers['Accept'] = 'application/json'
-
-        resp = session.get(apiUrl+requestUrl)
+        resp = cmkAccess.apiRequest("GET", requestUrl)
         if resp.status_code == 200:
-            response_data=resp.json()
+            response_data=cmkAccess.decodeResponse(resp)
             logger.debug("API request status_code : "+str(resp.status_code))
             logger.debug(str(response_data))
             try:
                 host_config=cls.from_dict(dataDict=response_data)
+                host_config.etag=resp.headers.get("ETag", "")
             except Exception as e:
                 logger.error("Error: "+str(e))
-                raise RuntimeError(print(resp.json()))
+                raise RuntimeError(pprint.pformat(cmkAccess.decodeResponse(resp)))
 
         elif resp.status_code == 404:
             logger.warning("API request status_code : "+str(resp.status_code))
             logger.warning("Host "+str(requestedHost)+" not found")
             host_config=None
         else:
-            logger.error(pprint.pformat(resp.json()))
-            raise RuntimeError(pprint.pformat(resp.json()))    
+            logger.error(pprint.pformat(cmkAccess.decodeResponse(resp)))
+            raise RuntimeError(pprint.pformat(cmkAccess.decodeResponse(resp)))    
 
 
         logger.debug("Leaving function "+str(function_name))
@@ -783,7 +1654,8 @@ class HostConfig:
             folder="/",
             newHost="",
             ipAddress="",
-            cmkAccess=None
+            cmkAccess=None,
+            attributes=None
         ):
         function_name = inspect.currentframe().f_code.co_name
         logger.debug("Entering function "+str(function_name))
@@ -795,21 +1667,16 @@ class HostConfig:
         host_config=None
         
         
-        apiUrl=cmkAccess.get_apiUrl()
         requestUrl="/domain-types/host_config/collections/all"
 
-        session = requests.session()
-        session.headers['Authorization'] = cmkAccess.credentials
-        session.headers['Accept'] = 'application/json'
-
         payLoad=dict()
         payLoad["host_name"] = newHost
         payLoad["folder"] = folder
-        payLoad["attributes"] = dict()
+        payLoad["attributes"] = dict(attributes) if attributes is not None else dict()
         if ipAddress != "":
             payLoad["attributes"]["ipaddress"] = ipAddress
 
-        resp = session.post(apiUrl+requestUrl,json=payLoad)
+        resp = cmkAccess.apiRequest("POST", requestUrl, jsonBody=payLoad)
         if resp.status_code == 200:
             try:
                 host_config=cls.ShowHost(requestedHost=newHost,cmkAccess=cmkAccess)
@@ -821,12 +1688,386 @@ class HostConfig:
             logger.warning("API request status_code : "+str(resp.status_code))
             raise RuntimeWarning(resp.status_code)
         else:
-            raise RuntimeError(print(resp.json()))
+            raise RuntimeError(pprint.pformat(cmkAccess.decodeResponse(resp)))
 
         logger.debug("Leaving function "+str(function_name))
         return host_config
 
+    @classmethod
+    def ListHosts(cls, cmkAccess=None):
+        function_name = inspect.currentframe().f_code.co_name
+        logger.debug("Entering function "+str(function_name))
+
+        if not isinstance(cmkAccess,RestAPIcredentials): raise ValueError("cmkAccess are not of type RESTAPIcredentials")
+
+        requestUrl="/domain-types/host_config/collections/all"
+
+        resp = cmkAccess.apiRequest("GET", requestUrl)
+        if resp.status_code == 200:
+            response_data=cmkAccess.decodeResponse(resp)
+            logger.debug("API request status_code : "+str(resp.status_code))
+        else:
+            logger.error(pprint.pformat(cmkAccess.decodeResponse(resp)))
+            raise RuntimeError(pprint.pformat(cmkAccess.decodeResponse(resp)))
+
+        host_configs=[]
+        for dataDict in response_data.get('value', []):
+            host_configs.append(cls.from_dict(dataDict=dataDict))
+
+        logger.debug("Leaving function "+str(function_name))
+        return host_configs
+
+    @classmethod
+    def ShowHosts(cls, requestedHosts=None, cmkAccess=None):
+        function_name = inspect.currentframe().f_code.co_name
+        logger.debug("Entering function "+str(function_name))
+
+        if not isinstance(cmkAccess,RestAPIcredentials): raise ValueError("cmkAccess are not of type RESTAPIcredentials")
+        if requestedHosts is None: raise ValueError("requestedHosts is empty")
+
+        outcomes=cmkAccess.adaptiveLimiter.map(
+            lambda requestedHost: cls.ShowHost(requestedHost=requestedHost, cmkAccess=cmkAccess),
+            requestedHosts
+        )
+        host_configs=BulkOperationError.check(function_name, outcomes)
+
+        logger.debug("Leaving function "+str(function_name))
+        return host_configs
+
+    @classmethod
+    def CreateHosts(cls, newHosts=None, folder="/", cmkAccess=None, chunkSize=500):
+        # newHosts is a list of host names or of dicts with the keys
+        # host_name, folder, ipaddress and attributes. Uses the bulk-create endpoint
+        # where the site supports it; chunks the bulk endpoint rejects are
+        # retried host by host so errors can be attributed.
+        function_name = inspect.currentframe().f_code.co_name
+        logger.debug("Entering function "+str(function_name))
+
+        if not isinstance(cmkAccess,RestAPIcredentials): raise ValueError("cmkAccess are not of type RESTAPIcredentials")
+        if newHosts is None: raise ValueError("newHosts is empty")
+
+        hostSpecs={}
+        for newHost in newHosts:
+            if isinstance(newHost, str):
+                newHost={"host_name": newHost}
+            hostSpecs[newHost["host_name"]]=newHost
+
+        host_configs={}
+        remainingHosts=list(hostSpecs.keys())
+        if cmkAccess.capabilities.bulkCreateHosts:
+            remainingHosts=[]
+            hostNames=list(hostSpecs.keys())
+            for start in range(0, len(hostNames), chunkSize):
+                chunk=hostNames[start:start+chunkSize]
+                created=cls._bulkCreateChunk([hostSpecs[hostName] for hostName in chunk], folder, cmkAccess)
+                if created is None:
+                    remainingHosts.extend(chunk)
+                else:
+                    host_configs.update(created)
+
+        outcomes=cmkAccess.adaptiveLimiter.map(
+            lambda hostName: cls.CreateHost(
+                folder=hostSpecs[hostName].get("folder", folder),
+                newHost=hostName,
+                ipAddress=hostSpecs[hostName].get("ipaddress", ""),
+                cmkAccess=cmkAccess,
+                attributes=hostSpecs[hostName].get("attributes")
+            ),
+            remainingHosts
+        )
+        try:
+            host_configs.update(BulkOperationError.check(function_name, outcomes))
+        except BulkOperationError as e:
+            e.results.update(host_configs)
+            raise e
+
+        logger.debug("Leaving function "+str(function_name))
+        return host_configs
+
+    @classmethod
+    def _bulkCreateChunk(cls, hostSpecs, folder, cmkAccess):
+        entries=[]
+        for hostSpec in hostSpecs:
+            attributes=dict(hostSpec.get("attributes", {}))
+            if hostSpec.get("ipaddress", "") != "":
+                attributes["ipaddress"]=hostSpec["ipaddress"]
+            entries.append({
+                "host_name": hostSpec["host_name"],
+                "folder": hostSpec.get("folder", folder),
+                "attributes": attributes
+            })
+
+        resp = cmkAccess.apiRequest("POST", APICapabilities.BULK_CREATE_HOSTS_URL, jsonBody={"entries": entries})
+        if resp.status_code != 200:
+            logger.warning("Bulk create of "+str(len(entries))+" hosts failed with status code "+str(resp.status_code)+", falling back to single creates")
+            return None
+
+        host_configs={}
+        for dataDict in cmkAccess.decodeResponse(resp).get('value', []):
+            host_config=cls.from_dict(dataDict=dataDict)
+            host_configs[host_config.id]=host_config
+        return host_configs
+
+    @classmethod
+    def BulkUpdateHosts(cls, updates=None, cmkAccess=None, chunkSize=500):
+        # updates is a list of dicts with host_name and one of attributes
+        # (replace all), update_attributes (merge) or remove_attributes.
+        # Returns the updated hosts keyed by name. Sites without the bulk
+        # endpoint get conditional single updates instead.
+        function_name = inspect.currentframe().f_code.co_name
+        logger.debug("Entering function "+str(function_name))
+
+        if not isinstance(cmkAccess,RestAPIcredentials): raise ValueError("cmkAccess are not of type RESTAPIcredentials")
+        if updates is None: raise ValueError("updates is empty")
+        if not cmkAccess.capabilities.bulkUpdateHosts:
+            return cls.UpdateHosts(updates=updates, cmkAccess=cmkAccess)
+
+        host_configs={}
+        for start in range(0, len(updates), chunkSize):
+            chunk=updates[start:start+chunkSize]
+            resp = cmkAccess.apiRequest("POST", APICapabilities.BULK_UPDATE_HOSTS_URL, jsonBody={"entries": chunk})
+            if resp.status_code == 200:
+                for dataDict in cmkAccess.decodeResponse(resp).get('value', []):
+                    host_config=cls.from_dict(dataDict=dataDict)
+                    host_configs[host_config.id]=host_config
+            else:
+                logger.error(pprint.pformat(cmkAccess.decodeResponse(resp)))
+                raise BulkOperationError(
+                    function_name+" failed with status code "+str(resp.status_code)+" for "+str(len(chunk))+" hosts",
+                    results=host_configs,
+                    errors={entry["host_name"]: RuntimeError(resp.status_code) for entry in chunk}
+                )
+
+        logger.debug("Leaving function "+str(function_name))
+        return host_configs
+
+    def reload(self, cmkAccess=None):
+        # Re-reads the host, replacing its attributes and ETag.
+        host_config=self.ShowHost(requestedHost=self._id, cmkAccess=cmkAccess)
+        if host_config is None:
+            raise RuntimeError("Host "+str(self._id)+" not found")
+        self._extensions=host_config.extensions
+        self._etag=host_config.etag
+        return self
+
+    def updateHost(self, cmkAccess=None, attributes=None, update_attributes=None, remove_attributes=None, retries=3):
+        # Conditional update carrying the ETag of the last read. A host read
+        # without ETag (e.g. from ListHosts) is read first; on 412 the host is
+        # read again and the same change applied on top of the new state.
+        function_name = inspect.currentframe().f_code.co_name
+        logger.debug("Entering function "+str(function_name))
+
+        if not isinstance(cmkAccess,RestAPIcredentials): raise ValueError("cmkAccess are not of type RESTAPIcredentials")
+        payLoad=dict()
+        if attributes is not None: payLoad["attributes"]=attributes
+        if update_attributes is not None: payLoad["update_attributes"]=update_attributes
+        if remove_attributes is not None: payLoad["remove_attributes"]=remove_attributes
+        if len(payLoad) != 1: raise ValueError("Exactly one of attributes, update_attributes and remove_attributes is required")
+
+        requestUrl="/objects/host_config/"+self._id
+        for attempt in range(retries+1):
+            if self._etag == "":
+                self.reload(cmkAccess=cmkAccess)
+            resp = cmkAccess.apiRequest("PUT", requestUrl, headers={"If-Match": self._etag}, jsonBody=payLoad)
+            if resp.status_code == 200:
+                self._extensions=self.from_dict(dataDict=cmkAccess.decodeResponse(resp)).extensions
+                self._etag=resp.headers.get("ETag", "")
+                logger.debug("Leaving function "+str(function_name))
+                return self
+            elif resp.status_code == 412:
+                logger.info("Host "+str(self._id)+" was changed concurrently, re-applying the update")
+                self._etag=""
+            else:
+                logger.error(pprint.pformat(cmkAccess.decodeResponse(resp)))
+                raise RuntimeError(pprint.pformat(cmkAccess.decodeResponse(resp)))
+
+        raise ConcurrentModificationError("Host "+str(self._id)+" changed on each of "+str(retries+1)+" update attempts")
+
+    def updateAttributes(self, attributes=None, cmkAccess=None):
+        # Merges attributes into the host's attributes.
+        if attributes is None: raise ValueError("attributes is empty")
+        return self.updateHost(cmkAccess=cmkAccess, update_attributes=attributes)
+
+    def removeAttributes(self, attributeNames=None, cmkAccess=None):
+        if attributeNames is None: raise ValueError("attributeNames is empty")
+        return self.updateHost(cmkAccess=cmkAccess, remove_attributes=list(attributeNames))
+
+    def moveHost(self, targetFolder="", cmkAccess=None, retries=3):
+        # Invokes the host's move action. targetFolder is a folder path
+        # ("/a/b") or id ("~a~b").
+        function_name = inspect.currentframe().f_code.co_name
+        logger.debug("Entering function "+str(function_name))
+
+        if not isinstance(cmkAccess,RestAPIcredentials): raise ValueError("cmkAccess are not of type RESTAPIcredentials")
+        if targetFolder == "": raise ValueError("targetFolder is empty")
+
+        move=Move(
+            id="move",
+            memberType="action",
+            name="move",
+            title="Move the host to another folder",
+            parameters={"target_folder": targetFolder.replace("/", "~") if targetFolder.startswith("/") else targetFolder}
+        )
+        requestUrl="/objects/host_config/"+self._id+"/actions/"+move.name+"/invoke"
+        for attempt in range(retries+1):
+            if self._etag == "":
+                self.reload(cmkAccess=cmkAccess)
+            resp = cmkAccess.apiRequest("POST", requestUrl, headers={"If-Match": self._etag}, jsonBody=move.parameters)
+            if resp.status_code == 200:
+                self._extensions=self.from_dict(dataDict=cmkAccess.decodeResponse(resp)).extensions
+                self._etag=resp.headers.get("ETag", "")
+                logger.debug("Leaving function "+str(function_name))
+                return self
+            elif resp.status_code == 412:
+                logger.info("Host "+str(self._id)+" was changed concurrently, re-applying the move")
+                self._etag=""
+            else:
+                logger.error(pprint.pformat(cmkAccess.decodeResponse(resp)))
+                raise RuntimeError(pprint.pformat(cmkAccess.decodeResponse(resp)))
+
+        raise ConcurrentModificationError("Host "+str(self._id)+" changed on each of "+str(retries+1)+" move attempts")
+
+    def deleteHost(self, cmkAccess=None, retries=3):
+        # Returns False when the host did not exist. The delete is conditional
+        # when the host was read with an ETag.
+        function_name = inspect.currentframe().f_code.co_name
+        logger.debug("Entering function "+str(function_name))
+
+        if not isinstance(cmkAccess,RestAPIcredentials): raise ValueError("cmkAccess are not of type RESTAPIcredentials")
+
+        requestUrl="/objects/host_config/"+self._id
+        for attempt in range(retries+1):
+            headers={"If-Match": self._etag} if self._etag != "" else None
+            resp = cmkAccess.apiRequest("DELETE", requestUrl, headers=headers)
+            if resp.status_code == 204:
+                logger.debug("Leaving function "+str(function_name))
+                return True
+            elif resp.status_code == 404:
+                logger.warning("Host "+str(self._id)+" not found")
+                return False
+            elif resp.status_code == 412:
+                logger.info("Host "+str(self._id)+" was changed concurrently, re-reading it")
+                self.reload(cmkAccess=cmkAccess)
+            else:
+                logger.error(pprint.pformat(cmkAccess.decodeResponse(resp)))
+                raise RuntimeError(pprint.pformat(cmkAccess.decodeResponse(resp)))
+
+        raise ConcurrentModificationError("Host "+str(self._id)+" changed on each of "+str(retries+1)+" delete attempts")
 
+    @classmethod
+    def UpdateHosts(cls, updates=None, cmkAccess=None, hostConfigs=None, retries=3):
+        # Conditional counterpart of BulkUpdateHosts: updates is a list of
+        # dicts with host_name and one of attributes, update_attributes or
+        # remove_attributes. Hosts are written in parallel, each with its own
+        # ETag, so only hosts changed concurrently are re-read and retried.
+        # hostConfigs may provide already read hosts keyed by name.
+        function_name = inspect.currentframe().f_code.co_name
+        logger.debug("Entering function "+str(function_name))
+
+        if not isinstance(cmkAccess,RestAPIcredentials): raise ValueError("cmkAccess are not of type RESTAPIcredentials")
+        if updates is None: raise ValueError("updates is empty")
+        hostConfigs=hostConfigs if hostConfigs is not None else {}
+
+        updatesByHost={update["host_name"]: update for update in updates}
+        def updateOne(hostName):
+            host_config=hostConfigs.get(hostName)
+            if host_config is None:
+                host_config=cls(id=hostName)
+            update=updatesByHost[hostName]
+            return host_config.updateHost(
+                cmkAccess=cmkAccess,
+                attributes=update.get("attributes"),
+                update_attributes=update.get("update_attributes"),
+                remove_attributes=update.get("remove_attributes"),
+                retries=retries
+            )
+        outcomes=cmkAccess.adaptiveLimiter.map(updateOne, list(updatesByHost.keys()))
+        host_configs=BulkOperationError.check(function_name, outcomes)
+
+        logger.debug("Leaving function "+str(function_name))
+        return host_configs
+
+    @classmethod
+    def MoveHosts(cls, moves=None, cmkAccess=None, hostConfigs=None):
+        # moves is a list of dicts with host_name and target_folder. The API
+        # has no bulk move, so hosts are moved in parallel.
+        function_name = inspect.currentframe().f_code.co_name
+        logger.debug("Entering function "+str(function_name))
+
+        if not isinstance(cmkAccess,RestAPIcredentials): raise ValueError("cmkAccess are not of type RESTAPIcredentials")
+        if moves is None: raise ValueError("moves is empty")
+        hostConfigs=hostConfigs if hostConfigs is not None else {}
+
+        targetFolders={move["host_name"]: move["target_folder"] for move in moves}
+        outcomes=cmkAccess.adaptiveLimiter.map(
+            lambda hostName: hostConfigs.get(hostName, cls(id=hostName)).moveHost(targetFolder=targetFolders[hostName], cmkAccess=cmkAccess),
+            list(targetFolders.keys())
+        )
+        host_configs=BulkOperationError.check(function_name, outcomes)
+
+        logger.debug("Leaving function "+str(function_name))
+        return host_configs
+
+    @classmethod
+    def BulkDeleteHosts(cls, hostNames=None, cmkAccess=None, chunkSize=500):
+        # Deletes hosts with one request per chunk, or one by one in parallel
+        # where the site lacks the bulk endpoint. Returns the deleted names.
+        function_name = inspect.currentframe().f_code.co_name
+        logger.debug("Entering function "+str(function_name))
+
+        if not isinstance(cmkAccess,RestAPIcredentials): raise ValueError("cmkAccess are not of type RESTAPIcredentials")
+        if hostNames is None: raise ValueError("hostNames is empty")
+        hostNames=list(hostNames)
+
+        if not cmkAccess.capabilities.bulkDeleteHosts:
+            outcomes=cmkAccess.adaptiveLimiter.map(lambda hostName: cls(id=hostName).deleteHost(cmkAccess=cmkAccess), hostNames)
+            deleted=BulkOperationError.check(function_name, outcomes)
+            logger.debug("Leaving function "+str(function_name))
+            return [hostName for hostName in hostNames if deleted[hostName]]
+
+        deleted=[]
+        for start in range(0, len(hostNames), chunkSize):
+            chunk=hostNames[start:start+chunkSize]
+            resp = cmkAccess.apiRequest("POST", APICapabilities.BULK_DELETE_HOSTS_URL, jsonBody={"entries": chunk})
+            if resp.status_code in [200, 204]:
+                deleted.extend(chunk)
+            else:
+                logger.error(pprint.pformat(cmkAccess.decodeResponse(resp)))
+                raise BulkOperationError(
+                    function_name+" failed with status code "+str(resp.status_code)+" for "+str(len(chunk))+" hosts",
+                    results={hostName: True for hostName in deleted},
+                    errors={hostName: RuntimeError(resp.status_code) for hostName in chunk}
+                )
+
+        logger.debug("Leaving function "+str(function_name))
+        return deleted
+
+    @classmethod
+    def executeDiscoveries(cls, hostConfigs=None, mode="fix_all", cmkAccess=None):
+        # Values of the returned dict are ServiceDiscovery objects for hosts
+        # discovered one by one, or the BackgroundJob of the bulk discovery
+        # covering the host when the site supports bulk discovery.
+        function_name = inspect.currentframe().f_code.co_name
+        logger.debug("Entering function "+str(function_name))
+
+        if not isinstance(cmkAccess,RestAPIcredentials): raise ValueError("cmkAccess are not of type RESTAPIcredentials")
+        if hostConfigs is None: raise ValueError("hostConfigs is empty")
+
+        hostConfigs={host_config.id: host_config for host_config in hostConfigs}
+        if cmkAccess.capabilities.bulkDiscovery and mode in ServiceDiscovery.BULK_MODE_OPTIONS and len(hostConfigs) > 0:
+            backgroundJob=ServiceDiscovery.startBulkDiscovery(list(hostConfigs.keys()), mode=mode, cmkAccess=cmkAccess)
+            if backgroundJob is not None:
+                logger.debug("Leaving function "+str(function_name))
+                return {hostName: backgroundJob for hostName in hostConfigs}
+
+        outcomes=cmkAccess.adaptiveLimiter.map(
+            lambda hostName: hostConfigs[hostName].executeDiscovery(mode=mode, cmkAccess=cmkAccess),
+            hostConfigs.keys()
+        )
+        serviceDiscoveries=BulkOperationError.check(function_name, outcomes)
+
+        logger.debug("Leaving function "+str(function_name))
+        return serviceDiscoveries
     
     def executeDiscovery(self,mode="fix_all", cmkAccess=None):
         function_name = inspect.currentframe().f_code.co_name
@@ -838,20 +2079,15 @@ class HostConfig:
 
 
 
-        apiUrl=cmkAccess.get_apiUrl()
         requestUrl="/domain-types/service_discovery_run/actions/start/invoke"
 
-        session = requests.session()
-        session.headers['Authorization'] = cmkAccess.credentials
-        session.headers['Accept'] = 'application/json'
-
         payLoad=dict()
         payLoad["host_name"] = self._id
         payLoad["mode"] = mode
 
-        resp = session.post(apiUrl+requestUrl,json=payLoad)
+        resp = cmkAccess.apiRequest("POST", requestUrl, jsonBody=payLoad)
         if resp.status_code == 200:
-            responseData=resp.json()
+            responseData=cmkAccess.decodeResponse(resp)
             serviceDiscovery=ServiceDiscovery.map_dataDict_to_serviceDiscovery(responseData)
             logger.info(function_name+" responded:")
             logger.info("Service discovery name : "+serviceDiscovery.id)
@@ -862,7 +2098,7 @@ class HostConfig:
             logger.warning("API request status_code : "+str(resp.status_code))
             raise RuntimeWarning(resp.status_code)
         elif resp.status_code == 400:
-            problemDetails=resp.json()
+            problemDetails=cmkAccess.decodeResponse(resp)
             logger.warning(function_name+" responded:")
             logger.warning("Bad request     : Parameter or validation error.")
             logger.warning("API status code : "+str(resp.status_code))
@@ -870,7 +2106,7 @@ class HostConfig:
             logger.warning("Response details: "+str(problemDetails.get('details',"")))
             serviceDiscovery=None
         elif resp.status_code == 403:
-            problemDetails=resp.json()
+            problemDetails=cmkAccess.decodeResponse(resp)
             logger.warning(function_name+" responded:")
             logger.warning("Forbidden       : Configuration via setup is disabled.")
             logger.warning("API status code : "+str(resp.status_code))
@@ -878,7 +2114,7 @@ class HostConfig:
             logger.warning("Response details: "+str(problemDetails.get('details',"")))
             serviceDiscovery=None
         elif resp.status_code == 406:
-            problemDetails=resp.json()
+            problemDetails=cmkAccess.decodeResponse(resp)
             logger.warning(function_name+" responded:")
             logger.warning("Not acceptable  : The requests headers can not be satisfied.")
             logger.warning("API status code : "+str(resp.status_code))
@@ -886,7 +2122,7 @@ class HostConfig:
             logger.warning("Response details: "+str(problemDetails.get('details',"")))
             serviceDiscovery=None
         elif resp.status_code == 409:
-            problemDetails=resp.json()
+            problemDetails=cmkAccess.decodeResponse(resp)
             logger.warning(function_name+" responded:")
             logger.warning("Conflict        : A service discovery background job is currently running.")
             logger.warning("API status code : "+str(resp.status_code))
@@ -894,7 +2130,7 @@ class HostConfig:
             logger.warning("Response details: "+str(problemDetails.get('details',"")))
             serviceDiscovery=None
         elif resp.status_code == 415:
-            problemDetails=resp.json()
+            problemDetails=cmkAccess.decodeResponse(resp)
             logger.warning(function_name+" responded:")
             logger.warning("Unsup. MediaType: The supported content-type is not supported.")
             logger.warning("API status code : "+str(resp.status_code))
@@ -902,7 +2138,7 @@ class HostConfig:
             logger.warning("Response details: "+str(problemDetails.get('details',"")))
             serviceDiscovery=None
         else:
-            raise RuntimeError(print(resp.json()))
+            raise RuntimeError(pprint.pformat(cmkAccess.decodeResponse(resp)))
 
 
 
@@ -985,7 +2221,135 @@ class HostExtensions:
 
         return resultDict
 
+class StatusQuery:
+    # Query expression of the monitoring status collections. Expressions
+    # combine with & | ~, e.g.
+    #   StatusQuery.compare("state", "=", 2) & ~StatusQuery.compare("acknowledged", "=", 1)
+    OPERATORS=["=", "!=", "<", ">", "<=", ">=", "~", "~~", "!~", "!~~"]
+
+    def __init__(self, op="", left="", right=None, expr=None):
+        self._op = op
+        self._left = left
+        self._right = right
+        self._expr = expr
+
+    @classmethod
+    def compare(cls, column="", op="=", value=""):
+        if column == "": raise ValueError("column is empty")
+        if op not in cls.OPERATORS: raise ValueError("The operator "+str(op)+" is not supported")
+        return cls(op=op, left=column, right=str(value))
+
+    @classmethod
+    def equals(cls, column="", value=""):
+        return cls.compare(column, "=", value)
+
+    @classmethod
+    def matches(cls, column="", pattern=""):
+        # Case insensitive regular expression match.
+        return cls.compare(column, "~~", pattern)
+
+    @classmethod
+    def all(cls, *queries):
+        return cls(op="and", expr=list(queries))
+
+    @classmethod
+    def any(cls, *queries):
+        return cls(op="or", expr=list(queries))
+
+    def __and__(self, other):
+        # Nested and/or expressions are flattened into one level.
+        if not isinstance(other, StatusQuery): return NotImplemented
+        left=self._expr if self._op == "and" else [self]
+        right=other._expr if other._op == "and" else [other]
+        return StatusQuery(op="and", expr=left+right)
+
+    def __or__(self, other):
+        if not isinstance(other, StatusQuery): return NotImplemented
+        left=self._expr if self._op == "or" else [self]
+        right=other._expr if other._op == "or" else [other]
+        return StatusQuery(op="or", expr=left+right)
+
+    def __invert__(self):
+        return StatusQuery(op="not", expr=self)
+
+    def to_dict(self):
+        if self._op in ["and", "or"]:
+            return {"op": self._op, "expr": [query.to_dict() for query in self._expr]}
+        if self._op == "not":
+            return {"op": self._op, "expr": self._expr.to_dict()}
+        return {"op": self._op, "left": self._left, "right": self._right}
+
+class StatusCollection:
+    # Monitoring status rows read through the REST API's Livestatus-backed
+    # collections. The query expression and the column selection are
+    # evaluated on the site, so only matching rows and the requested fields
+    # are transferred.
+    DOMAIN_TYPE=""
+    DEFAULT_COLUMNS=[]
+    # Longer queries are sent as POST body instead of URL parameters.
+    MAX_QUERY_LENGTH=2000
+
+    @classmethod
+    def Query(cls, query=None, columns=None, sites=None, cmkAccess=None, **params):
+        # Returns a list of one dict of the requested columns per row. The
+        # response is read and decoded as a whole; keep results small with
+        # query and columns.
+        function_name = inspect.currentframe().f_code.co_name
+        logger.debug("Entering function "+str(cls.__name__)+"."+str(function_name))
+
+        if not isinstance(cmkAccess,RestAPIcredentials): raise ValueError("cmkAccess are not of type RESTAPIcredentials")
+        if query is not None and not isinstance(query, (StatusQuery, dict)): raise TypeError("query must be a StatusQuery or a dict")
+
+        requestUrl="/domain-types/"+cls.DOMAIN_TYPE+"/collections/all"
+        payLoad=dict(params)
+        payLoad["columns"]=list(columns) if columns is not None else list(cls.DEFAULT_COLUMNS)
+        if sites is not None:
+            payLoad["sites"]=list(sites)
+        if query is not None:
+            payLoad["query"]=query.to_dict() if isinstance(query, StatusQuery) else query
+
+        encodedQuery=cmkAccess.codec.encode(payLoad.get("query", {})).decode("utf-8")
+        if len(encodedQuery) > cls.MAX_QUERY_LENGTH:
+            resp = cmkAccess.apiRequest("POST", requestUrl, category="read", jsonBody=payLoad)
+        else:
+            if "query" in payLoad:
+                payLoad["query"]=encodedQuery
+            resp = cmkAccess.apiRequest("GET", requestUrl, params=payLoad)
+        if resp.status_code == 200:
+            response_data=cmkAccess.decodeResponse(resp)
+            logger.debug("API request status_code : "+str(resp.status_code))
+        else:
+            logger.error(pprint.pformat(cmkAccess.decodeResponse(resp)))
+            raise RuntimeError(pprint.pformat(cmkAccess.decodeResponse(resp)))
+
+        logger.debug("Leaving function "+str(cls.__name__)+"."+str(function_name))
+        return [dataDict.get('extensions', {}) for dataDict in response_data.get('value', [])]
+
+class HostStatus(StatusCollection):
+    DOMAIN_TYPE="host"
+    DEFAULT_COLUMNS=["name", "state"]
+
+class ServiceStatus(StatusCollection):
+    DOMAIN_TYPE="service"
+    DEFAULT_COLUMNS=["host_name", "description", "state"]
+
+    @classmethod
+    def Query(cls, query=None, columns=None, sites=None, hostName=None, cmkAccess=None):
+        params={}
+        if hostName is not None:
+            params["host_name"]=hostName
+        return super().Query(query=query, columns=columns, sites=sites, cmkAccess=cmkAccess, **params)
+
 class ServiceDiscovery:
+    # Bulk discovery takes a mode up to 2.2 and discrete options from 2.3 on.
+    BULK_MODE_OPTIONS = {
+        "new": {"monitor_undecided_services": True, "remove_vanished_services": False, "update_service_labels": False, "update_host_labels": True},
+        "remove": {"monitor_undecided_services": False, "remove_vanished_services": True, "update_service_labels": False, "update_host_labels": False},
+        "fix_all": {"monitor_undecided_services": True, "remove_vanished_services": True, "update_service_labels": True, "update_host_labels": True},
+        "refresh": {"monitor_undecided_services": True, "remove_vanished_services": True, "update_service_labels": True, "update_host_labels": True},
+        "only_host_labels": {"monitor_undecided_services": False, "remove_vanished_services": False, "update_service_labels": False, "update_host_labels": True}
+    }
+
     def __init__(self, 
                  domainType="service_discovery_config", 
                  extensions=None, 
@@ -1041,53 +2405,211 @@ class ServiceDiscovery:
         self._members = value
 
     @property
-    def title(self):
-        return self._title
-
-    @title.setter
-    def title(self, value):
-        self._title = value
+    def title(self):
+        return self._title
+
+    @title.setter
+    def title(self, value):
+        self._title = value
+
+    def to_dict(self):
+        resultDict=dict()
+        resultDict["domainType="] = self._domainType
+        resultDict["extensions"] = self._extensions.to_dict()
+        resultDict["id"] =self._id
+        resultDict["links"] = [link.to_dict() for link in self._links]
+        resultDict["members"] = self._members
+        resultDict["title"] = self._title
+
+        return resultDict
+
+    def map_dataDict_to_serviceDiscovery(dataDict):
+        function_name = inspect.currentframe().f_code.co_name
+        logger.debug("Entering function "+str(function_name))
+        
+        linkArray=[]
+        for linkDataDict in dataDict.get('links', []):
+            link=Link(domainType=linkDataDict.get('domainType',''),
+                      href=linkDataDict.get('href',''),
+                      method=linkDataDict.get('method',''),
+                      rel=linkDataDict.get('rel',''),
+                      type=linkDataDict.get('type',''))
+            linkArray.append(link)
+
+        serviceDiscovery=ServiceDiscovery(
+            domainType=dataDict.get('domainType', ""),
+            id=dataDict.get('id', ""),
+            links=linkArray,
+            title=dataDict.get('title', ""),
+            members=dataDict.get('members', {}),
+            extensions=ServiceDiscoveryExtensions(
+                check_table=dataDict['extensions'].get('check_table', {}),
+                host_labels=dataDict['extensions'].get('host_labels', {}),
+                vanished_labels=dataDict['extensions'].get('vanished_labels', {}),
+                changed_labels=dataDict['extensions'].get('changed_labels', {})
+            )
+        )
+
+        logger.debug("Leaving function "+str(function_name))
+        return serviceDiscovery
+
+    @staticmethod
+    def startBulkDiscovery(hostNames, mode="fix_all", cmkAccess=None, bulkSize=10, doFullScan=True, ignoreErrors=True):
+        function_name = inspect.currentframe().f_code.co_name
+        logger.debug("Entering function "+str(function_name))
+
+        if not isinstance(cmkAccess,RestAPIcredentials): raise ValueError("cmkAccess is not of type RESTAPIcredentials")
+        if mode not in ServiceDiscovery.BULK_MODE_OPTIONS: raise ValueError("The given mode value is not supported for bulk discovery")
+
+        payLoad=dict()
+        payLoad["hostnames"]=hostNames
+        if cmkAccess.capabilities.payloadDialect=="2.2":
+            payLoad["mode"]=mode
+        else:
+            payLoad["options"]=ServiceDiscovery.BULK_MODE_OPTIONS[mode]
+        payLoad["do_full_scan"]=doFullScan
+        payLoad["bulk_size"]=bulkSize
+        payLoad["ignore_errors"]=ignoreErrors
+
+        resp = cmkAccess.apiRequest("POST", APICapabilities.BULK_DISCOVERY_URL, jsonBody=payLoad)
+        if resp.status_code == 200:
+            backgroundJob=BackgroundJob.from_dict(cmkAccess.decodeResponse(resp))
+            logger.info("Bulk discovery of "+str(len(hostNames))+" hosts started as job "+str(backgroundJob.id))
+        else:
+            logger.warning("Bulk discovery failed with status code "+str(resp.status_code)+", falling back to single discoveries")
+            backgroundJob=None
+
+        logger.debug("Leaving function "+str(function_name))
+        return backgroundJob
+
+class BackgroundJob:
+    # Status endpoints of the kinds of background job, keyed by domainType.
+    # Service discovery runs are addressed by host name.
+    STATUS_URLS = {
+        "background_job": "/objects/background_job/{job_id}",
+        "discovery_run": "/objects/discovery_run/{job_id}",
+        "service_discovery_run": "/objects/service_discovery_run/{job_id}",
+        "activation_run": "/objects/activation_run/{job_id}"
+    }
+    RUNNING_ACTIVATIONS_URL = "/domain-types/activation_run/collections/running"
+    FAILED_STATES = ["exception", "stopped"]
+
+    def __init__(self,
+                 domainType="background_job",
+                 id="",
+                 title="",
+                 links=None,
+                 extensions=None
+        ):
+        self._domainType = domainType
+        self._id = id
+        self._title = title
+        self._links = links if links is not None else []
+        self._extensions = extensions if extensions is not None else {}
+
+    @property
+    def domainType(self):
+        return self._domainType
+
+    @property
+    def id(self):
+        return self._id
+
+    @property
+    def title(self):
+        return self._title
+
+    @property
+    def links(self):
+        return self._links
+
+    @property
+    def extensions(self):
+        return self._extensions
+
+    @property
+    def active(self):
+        # Activation runs report is_running instead of active
+        return self._extensions.get("active", self._extensions.get("is_running", False))
 
-    def to_dict(self):
-        resultDict=dict()
-        resultDict["domainType="] = self._domainType
-        resultDict["extensions"] = self._extensions.to_dict()
-        resultDict["id"] =self._id
-        resultDict["links"] = [link.to_dict() for link in self._links]
-        resultDict["members"] = self._members
-        resultDict["title"] = self._title
+    @property
+    def state(self):
+        return self._extensions.get("status", {}).get("state", self._extensions.get("state", ""))
 
-        return resultDict
+    @property
+    def failed(self):
+        if self.state in self.FAILED_STATES:
+            return True
+        statusPerSite=self._extensions.get("status_per_site", [])
+        return any(status.get("state", "success") not in ["success", ""] for status in statusPerSite)
 
-    def map_dataDict_to_serviceDiscovery(dataDict):
+    @classmethod
+    def ShowBackgroundJob(cls, jobID="", cmkAccess=None, domainType="background_job"):
+        # Returns None if the job is unknown to the site.
         function_name = inspect.currentframe().f_code.co_name
         logger.debug("Entering function "+str(function_name))
-        
+
+        if not isinstance(cmkAccess, RestAPIcredentials): raise ValueError("cmkAccess is not of type RestAPIcredentials")
+        if domainType not in cls.STATUS_URLS: raise ValueError("Unsupported job type "+str(domainType))
+
+        resp = cmkAccess.apiRequest("GET", cls.STATUS_URLS[domainType].format(job_id=jobID))
+        if resp.status_code == 404:
+            logger.debug("Leaving function "+str(function_name))
+            return None
+        if resp.status_code != 200:
+            raise RuntimeError("Reading "+str(domainType)+" "+str(jobID)+" failed with status code "+str(resp.status_code))
+        dataDict=cmkAccess.decodeResponse(resp)
+        dataDict.setdefault('domainType', domainType)
+        dataDict.setdefault('id', jobID)
+
+        logger.debug("Leaving function "+str(function_name))
+        return cls.from_dict(dataDict)
+
+    @classmethod
+    def ListRunningActivations(cls, cmkAccess=None):
+        # All running activation runs with one request, or None if the site
+        # has no collection of running activations.
+        if not isinstance(cmkAccess, RestAPIcredentials): raise ValueError("cmkAccess is not of type RestAPIcredentials")
+        resp = cmkAccess.apiRequest("GET", cls.RUNNING_ACTIVATIONS_URL)
+        if resp.status_code in [404, 405]:
+            return None
+        if resp.status_code != 200:
+            raise RuntimeError("Reading the running activations failed with status code "+str(resp.status_code))
+        jobs=[]
+        for dataDict in cmkAccess.decodeResponse(resp).get('value', []):
+            dataDict.setdefault('domainType', "activation_run")
+            jobs.append(cls.from_dict(dataDict))
+        return jobs
+
+    @classmethod
+    def from_dict(cls, dataDict=None):
+        if dataDict is None:
+            raise ValueError("dataDict is None")
         linkArray=[]
         for linkDataDict in dataDict.get('links', []):
             link=Link(domainType=linkDataDict.get('domainType',''),
                       href=linkDataDict.get('href',''),
                       method=linkDataDict.get('method',''),
                       rel=linkDataDict.get('rel',''),
-                      type=linkDataDict.get('type',''))
+                      type=linkDataDict.get('type','')
+            )
             linkArray.append(link)
-
-        serviceDiscovery=ServiceDiscovery(
+        return cls(
             domainType=dataDict.get('domainType', ""),
             id=dataDict.get('id', ""),
-            links=linkArray,
             title=dataDict.get('title', ""),
-            members=dataDict.get('members', {}),
-            extensions=ServiceDiscoveryExtensions(
-                check_table=dataDict['extensions'].get('check_table', {}),
-                host_labels=dataDict['extensions'].get('host_labels', {}),
-                vanished_labels=dataDict['extensions'].get('vanished_labels', {}),
-                changed_labels=dataDict['extensions'].get('changed_labels', {})
-            )
+            links=linkArray,
+            extensions=dataDict.get('extensions', {})
         )
 
-        logger.debug("Leaving function "+str(function_name))
-        return serviceDiscovery
+    def to_dict(self):
+        return {
+            "domainType": self._domainType,
+            "id": self._id,
+            "title": self._title,
+            "links": [link.to_dict() for link in self._links],
+            "extensions": self._extensions
+        }
 
 class ServiceDiscoveryExtensions:
     def __init__(self, 
@@ -1143,13 +2665,16 @@ class Connection:
                  host="", 
                  port=6557, 
                  encrypted=True, 
-                 verify=False):
+                 verify=False,
+                 path=""):
          
         self._socket_type = socket_type
         self._host = host
         self._port = port
         self._encrypted = encrypted
         self._verify = verify
+        # Socket path of socket_type "unix"
+        self._path = path
 
     @property
     def socket_type(self):
@@ -1190,15 +2715,26 @@ class Connection:
     @verify.setter
     def verify(self, value):
         self._verify = value
+
+    @property
+    def path(self):
+        return self._path
+
+    @path.setter
+    def path(self, value):
+        self._path = value
     
     def to_dict(self):
-        return {
+        dataDict = {
             "socket_type": self._socket_type,
             "host": self._host,
             "port": self._port,
             "encrypted": self._encrypted,
             "verify": self._verify
         }
+        if self._socket_type == "unix":
+            dataDict["path"] = self._path
+        return dataDict
 
 class ProxyParams:
     def __init__(self, 
@@ -1548,7 +3084,7 @@ class Heartbeat:
 
     @interval.setter
     def interval(self, value):
-        self._timeout = value
+        self._interval = value
 
     @property
     def timeout(self):
@@ -1599,14 +3135,14 @@ class ConfigurationConnection:
         if not isinstance(user_sync,UserSync):
             user_sync=UserSync()
         self._enable_replication = enable_replication
-        if self._enable_replication:
-            self._url_of_remote_site = url_of_remote_site
-            self._disable_remote_configuration = disable_remote_configuration
-            self._ignore_tls_errors = ignore_tls_errors
-            self._direct_login_to_web_gui_allowed = direct_login_to_web_gui_allowed
-            self._user_sync = user_sync
-            self._replicate_event_console = replicate_event_console
-            self._replicate_extensions = replicate_extensions
+        # Kept without replication as well, the 2.2 payload always sends them
+        self._url_of_remote_site = url_of_remote_site
+        self._disable_remote_configuration = disable_remote_configuration
+        self._ignore_tls_errors = ignore_tls_errors
+        self._direct_login_to_web_gui_allowed = direct_login_to_web_gui_allowed
+        self._user_sync = user_sync
+        self._replicate_event_console = replicate_event_console
+        self._replicate_extensions = replicate_extensions
         
     @property
     def enable_replication(self):
@@ -1672,9 +3208,10 @@ class ConfigurationConnection:
     def replicate_extensions(self, value):
         self._replicate_extensions = value
     
-    def to_dict(self):
-        if VERSION.checkmk_version<="2.2":return self.to_dict_2_2()
-        if VERSION.checkmk_version>="2.3":return self.to_dict_2_3()
+    def to_dict(self, version=None):
+        version=Version.resolve(version)
+        if APICapabilities.dialectFor(version)=="2.2":return self.to_dict_2_2()
+        return self.to_dict_2_3()
 
     def to_dict_2_2(self):
         localDict={
@@ -1748,11 +3285,11 @@ class Extensions:
     def configuration_connection(self, value):
         self._configuration_connection = value
     
-    def to_dict(self):
+    def to_dict(self, version=None):
         return {
             "basic_settings": self._basic_settings.to_dict(),
             "status_connection": self._status_connection.to_dict(),
-            "configuration_connection": self._configuration_connection.to_dict()
+            "configuration_connection": self._configuration_connection.to_dict(version=version)
         }    
 
 class SiteConnection:
@@ -1769,6 +3306,11 @@ class SiteConnection:
         self._title = title
         self._members = members if members is not None else {}
         self._extensions = extensions if extensions is not None else Extensions()
+        # Settings as last read from or written to the site, see changedFields
+        self._knownExtensions = None
+        self._etag = ""
+        # Version of the site the connection was read from or written to
+        self._version = None
 
     @property
     def links(self):
@@ -1817,16 +3359,119 @@ class SiteConnection:
     @extensions.setter
     def extensions(self, value):
         self._extensions = value
+
+    @property
+    def etag(self):
+        return self._etag
+
+    @etag.setter
+    def etag(self, value):
+        self._etag = value
+
+    @property
+    def version(self):
+        return self._version
+
+    @version.setter
+    def version(self, value):
+        if value is not None and not isinstance(value, Version):
+            raise TypeError("version must be an instance of Version")
+        self._version = value
     
-    def to_dict(self):
+    def to_dict(self, version=None):
+        version=version if version is not None else self._version
         return {
             "links": [link.to_dict() for link in self._links],
             "id": self._id,
             "domainType": self._domainType,
             "title": self._title,
-            "extensions": self._extensions.to_dict(),
+            "extensions": self._extensions.to_dict(version=version),
         }
 
+    def markUnchanged(self):
+        # Remembers the current settings as the state known to the site.
+        self._knownExtensions = copy.deepcopy(self._extensions)
+
+    def stateHash(self, version=None):
+        # Canonical hash of the settings as they would be sent to the site.
+        version=version if version is not None else self._version
+        return hashlib.sha256(
+            json.dumps(self._extensions.to_dict(version=version), sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+    def changedFields(self, version=None):
+        # Dotted paths of all settings differing from the state known to the
+        # site. Without a known state every field counts as changed.
+        version=version if version is not None else self._version
+        current=self._flatten(self._extensions.to_dict(version=version))
+        if self._knownExtensions is None:
+            return sorted(current.keys())
+        known=self._flatten(self._knownExtensions.to_dict(version=version))
+        return sorted(key for key in set(current) | set(known) if current.get(key) != known.get(key))
+
+    @classmethod
+    def _flatten(cls, dataDict, prefix=""):
+        flat={}
+        for key, value in dataDict.items():
+            if isinstance(value, dict) and len(value) > 0:
+                flat.update(cls._flatten(value, prefix+key+"."))
+            else:
+                flat[prefix+key]=value
+        return flat
+
+    @staticmethod
+    def _unflatten(flat):
+        dataDict={}
+        for path, value in flat.items():
+            keys=path.split(".")
+            node=dataDict
+            for key in keys[:-1]:
+                node=node.setdefault(key, {})
+            node[keys[-1]]=value
+        return dataDict
+
+    @classmethod
+    def ShowSiteConnection(cls, siteID="", cmkAccess=None):
+        function_name = inspect.currentframe().f_code.co_name
+        logger.debug("Entering function "+str(function_name))
+
+        if not isinstance(cmkAccess, RestAPIcredentials): raise ValueError("cmkAccess is not of type RestAPIcredentials")
+        if siteID == "": raise ValueError("siteID is empty")
+
+        site_connection=None
+        resp = cmkAccess.apiRequest("GET", "/objects/site_connection/"+siteID)
+        if resp.status_code == 200:
+            site_connection=cls.from_dict(dataDict=cmkAccess.decodeResponse(resp))
+            site_connection.etag=resp.headers.get("ETag", "")
+            site_connection.version=cmkAccess.version
+        elif resp.status_code == 404:
+            logger.warning("Site connection "+str(siteID)+" not found")
+        else:
+            logger.error(pprint.pformat(cmkAccess.decodeResponse(resp)))
+            raise RuntimeError(pprint.pformat(cmkAccess.decodeResponse(resp)))
+
+        logger.debug("Leaving function "+str(function_name))
+        return site_connection
+
+    def rebase(self, cmkAccess=None):
+        # Re-reads the connection and re-applies the locally changed fields
+        # on top of the current settings of the site.
+        version=cmkAccess.version
+        changes=self._flatten(self._extensions.to_dict(version=version))
+        changedFields=self.changedFields(version=version)
+        current=self.ShowSiteConnection(siteID=self._id, cmkAccess=cmkAccess)
+        if current is None:
+            raise RuntimeError("Site connection "+str(self._id)+" not found")
+        merged=self._flatten(current.extensions.to_dict(version=version))
+        for key in changedFields:
+            if key in changes:
+                merged[key]=changes[key]
+            else:
+                merged.pop(key, None)
+        self._extensions=self.from_dict(dataDict={"extensions": self._unflatten(merged)}).extensions
+        self._knownExtensions=current.extensions
+        self._etag=current.etag
+        return changedFields
 
     @classmethod 
     def from_dict(cls, dataDict):
@@ -1857,7 +3502,8 @@ class SiteConnection:
                     host=dataDict['extensions'].get('status_connection', {}).get('connection', {}).get('host', ""),
                     port=dataDict['extensions'].get('status_connection', {}).get('connection', {}).get('port', 0),
                     encrypted=dataDict['extensions'].get('status_connection', {}).get('connection', {}).get('encrypted', True),
-                    verify=dataDict['extensions'].get('status_connection', {}).get('connection', {}).get('verify', False)
+                    verify=dataDict['extensions'].get('status_connection', {}).get('connection', {}).get('verify', False),
+                    path=dataDict['extensions'].get('status_connection', {}).get('connection', {}).get('path', "")
                 ),
                 proxy=Proxy(
                     use_livestatus_daemon=dataDict['extensions'].get('status_connection', {}).get('proxy', {}).get('use_livestatus_daemon', "with_proxy"),
@@ -1902,7 +3548,7 @@ class SiteConnection:
                 replicate_extensions=dataDict['extensions'].get('configuration_connection', {}).get('replicate_extensions', True)
             )
         )
-        return cls(
+        site_connection=cls(
             links=links,
             domainType=domainType,
             id=id,
@@ -1910,6 +3556,8 @@ class SiteConnection:
             members=members,
             extensions=extensions,
         )
+        site_connection.markUnchanged()
+        return site_connection
 
 
     def createSiteConnection(
@@ -1931,13 +3579,12 @@ class SiteConnection:
 
             ):
 
-            apiUrl=cmkAccess.get_apiUrl()
             requestUrl="/domain-types/site_connection/collections/all"
 
             linkArray=[]
             
             for methodType in ['GET', 'PUT', 'DELETE']:
-                httpReference="http://"+cmkAccess.cmkHostname+"/"+cmkAccess.cmkSite+"/check_mk/api/1.0/objects/site_connection/"+newSite
+                httpReference="http://"+cmkAccess.cmkHostname+"/"+cmkAccess.cmkSiteName+"/check_mk/api/1.0/objects/site_connection/"+newSite
                 if methodType=="GET": rel="self"
                 if methodType=="PUT": rel="urn:org.restfulobjects:rels/update"
                 if methodType=="DELETE": rel="urn:org.restfulobjects:rels/delete"
@@ -1958,23 +3605,11 @@ class SiteConnection:
             self.extensions.status_connection.url_prefix="http://"+newSite+"."+ovpnNetwork+"."+ovpnNetworkDomain+"/"
             self.extensions.configuration_connection.url_of_remote_site="http://"+newSite+"."+ovpnNetwork+"."+ovpnNetworkDomain+"/check_mk/"
         
-            session = requests.session()
-            session.headers['Authorization'] = f"{cmkAccess.credentials}"
-            session.headers['Accept'] = 'application/json'
-            API_URL=apiUrl+requestUrl
-            
-            jsonString='{"site_config": '+ \
-                json.dumps(self.extensions.to_dict()) + \
-            '}'
+            payLoad=cmkAccess.codec.encode({"site_config": self.extensions.to_dict(version=cmkAccess.version)})
 
-            payLoad=json.loads(jsonString)
-
-            resp = session.post(apiUrl+requestUrl,
-                headers={"Content-Type": 'application/json'},
-                json=payLoad
-            )
+            resp = cmkAccess.apiRequest("POST", requestUrl, data=payLoad)
             if resp.status_code == 200:
-                response_data=resp.json()
+                response_data=cmkAccess.decodeResponse(resp)
                 logger.debug("API request status_code : "+str(resp.status_code))
                 logger.debug(str(response_data))
                 logger.debug("The following dataDicts are available")
@@ -1985,8 +3620,8 @@ class SiteConnection:
                 logger.warning("API request status_code : "+str(resp.status_code))
                 raise RuntimeWarning(resp.status_code)
             else:
-                logger.debug (pprint(resp.__dict__))
-                raise RuntimeError(str(resp.json()))    
+                logger.debug (pprint.pformat(resp.__dict__, indent=4))
+                raise RuntimeError(str(cmkAccess.decodeResponse(resp)))    
             return
 
         def createSiteConnection_V2_3(
@@ -1996,7 +3631,6 @@ class SiteConnection:
                 ovpnNetworkDomain=""
             ):
 
-            apiUrl=cmkAccess.get_apiUrl()
             requestUrl="/domain-types/site_connection/collections/all"
 
             linkArray=[]
@@ -2023,23 +3657,11 @@ class SiteConnection:
             self.extensions.status_connection.url_prefix="http://"+newSite+"."+ovpnNetwork+"."+ovpnNetworkDomain+"/"
             self.extensions.configuration_connection.url_of_remote_site="http://"+newSite+"."+ovpnNetwork+"."+ovpnNetworkDomain+"/check_mk/"
         
-            session = requests.session()
-            session.headers['Authorization'] = f"{cmkAccess.credentials}"
-            session.headers['Accept'] = 'application/json'
-            API_URL=apiUrl+requestUrl
-            
-            jsonString='{"site_config": '+ \
-                json.dumps(self.extensions.to_dict()) + \
-            '}'
+            payLoad=cmkAccess.codec.encode({"site_config": self.extensions.to_dict(version=cmkAccess.version)})
 
-            payLoad=json.loads(jsonString)
-
-            resp = session.post(apiUrl+requestUrl,
-                headers={"Content-Type": 'application/json'},
-                json=payLoad
-            )
+            resp = cmkAccess.apiRequest("POST", requestUrl, data=payLoad)
             if resp.status_code == 200:
-                response_data=resp.json()
+                response_data=cmkAccess.decodeResponse(resp)
                 logger.debug("API request status_code : "+str(resp.status_code))
                 logger.debug(str(response_data))
                 logger.debug("The following dataDicts are available")
@@ -2050,8 +3672,8 @@ class SiteConnection:
                 logger.warning("API request status_code : "+str(resp.status_code))
                 raise RuntimeWarning(resp.status_code)
             else:
-                logger.debug (pprint.pprint(resp.__dict__))
-                raise RuntimeError(str(resp.json()))    
+                logger.debug (pprint.pformat(resp.__dict__, indent=4))
+                raise RuntimeError(str(cmkAccess.decodeResponse(resp)))    
             return
         #####################################################################
         ################# end of internal functions #########################
@@ -2064,72 +3686,119 @@ class SiteConnection:
             logger.error("cmkAccess is not of type RestAPIcredentials")
             raise ValueError("cmkAccess is not of type RESTAPIcredentials")
 
-        cmkVersion=str(VERSION.checkmk_version)
-        if cmkVersion.startswith("2.2."):
+        capabilities=cmkAccess.capabilities
+        if not capabilities.siteConnections:
+            logger.error("cmkVersion is not supported")
+            raise ValueError("cmkVersion is not supported")
+        if capabilities.payloadDialect=="2.2":
             createSiteConnection_V2_2(
                 cmkAccess=cmkAccess,
                 newSite=newSite,
                 ovpnNetwork=ovpnNetwork,
                 ovpnNetworkDomain=ovpnNetworkDomain
             )
-        elif cmkVersion.startswith("2.3."):
+        else:
             createSiteConnection_V2_3(
                 cmkAccess=cmkAccess,
                 newSite=newSite,
                 ovpnNetwork=ovpnNetwork,
                 ovpnNetworkDomain=ovpnNetworkDomain
             )
-        else:
-            logger.error("cmkVersion is not supported")
-            raise ValueError("cmkVersion is not supported")
+        self._version=cmkAccess.version
+        self.markUnchanged()
         return
 
 
     def updateSiteConnection(
             self, 
-            cmkAccess=None
+            cmkAccess=None,
+            force=False,
+            retries=3
         ):
+        # Returns the changed fields. Nothing is sent when no field differs
+        # from the state last read from the site, as every PUT creates a
+        # pending change and with it an activation of the remote core.
+        # The write carries the ETag of the last read; connections read
+        # without one (e.g. through SiteAllConnections) and connections
+        # changed concurrently (412) are re-read and the changed fields
+        # re-applied on top of the current settings.
 
         if not isinstance (cmkAccess, RestAPIcredentials):
             raise ValueError("cmkAccess is not of type RestAPIcredentials")
-        apiUrl=cmkAccess.get_apiUrl()   
         requestUrl="/objects/site_connection/"+self.id
-       
-        session = requests.session()
-        session.headers['Authorization'] = f"{cmkAccess.credentials}"
-        session.headers['Accept'] = 'application/json'
-        API_URL=apiUrl+requestUrl
-        
-        jsonString='{"site_config": '+ \
-            json.dumps(self.extensions.to_dict()) + \
-        '}'
 
-        payLoad=json.loads(jsonString)
-        logger.debug (pprint.pformat(jsonString,indent=4))
+        changedFields=self.changedFields(version=cmkAccess.version)
+        if len(changedFields) == 0 and not force:
+            logger.info("Site connection "+str(self.id)+" is unchanged, skipping update")
+            return changedFields
+        logger.info("Updating site connection "+str(self.id)+", changed fields: "+", ".join(changedFields))
 
-        resp = session.put(
-            f"{API_URL}",
-            headers={"Content-Type": 'application/json'},
-            json=payLoad
-        )
-        if resp.status_code == 200:
-            pass
-        elif resp.status_code == 204:
-            logger.warning("API request status_code : "+str(resp.status_code))
-            raise RuntimeWarning(resp.status_code)
+        for attempt in range(retries+1):
+            if self._etag == "" and self._knownExtensions is not None:
+                self.rebase(cmkAccess=cmkAccess)
+                if len(self.changedFields(version=cmkAccess.version)) == 0 and not force:
+                    logger.info("Site connection "+str(self.id)+" already has the requested settings")
+                    return changedFields
+            headers={"If-Match": self._etag} if self._etag != "" else None
+
+            payLoad=cmkAccess.codec.encode({"site_config": self.extensions.to_dict(version=cmkAccess.version)})
+            logger.debug (payLoad.decode("utf-8"))
+
+            resp = cmkAccess.apiRequest("PUT", requestUrl, headers=headers, data=payLoad)
+            if resp.status_code == 200:
+                self._etag=resp.headers.get("ETag", "")
+                break
+            elif resp.status_code == 204:
+                logger.warning("API request status_code : "+str(resp.status_code))
+                raise RuntimeWarning(resp.status_code)
+            elif resp.status_code == 412:
+                logger.info("Site connection "+str(self.id)+" was changed concurrently, re-applying the update")
+                self._etag=""
+            else:
+                logger.debug (pprint.pformat(resp.__dict__, indent=4))
+                raise RuntimeError(str(cmkAccess.decodeResponse(resp)))    
         else:
-            logger.debug (pprint.pformat(resp.__dict__),indent=4)
-            raise RuntimeError(str(resp.json()))    
+            raise ConcurrentModificationError("Site connection "+str(self.id)+" changed on each of "+str(retries+1)+" update attempts")
 
+        self._version=cmkAccess.version
+        self.markUnchanged()
+        return changedFields
 
-        return
+    def deleteSiteConnection(self, cmkAccess=None, retries=3):
+        # Returns False when the connection did not exist.
+        function_name = inspect.currentframe().f_code.co_name
+        logger.debug("Entering function "+str(function_name))
+
+        if not isinstance (cmkAccess, RestAPIcredentials):
+            raise ValueError("cmkAccess is not of type RestAPIcredentials")
+
+        requestUrl="/objects/site_connection/"+self.id+"/actions/delete/invoke"
+        for attempt in range(retries+1):
+            headers={"If-Match": self._etag} if self._etag != "" else None
+            resp = cmkAccess.apiRequest("POST", requestUrl, headers=headers)
+            if resp.status_code == 204:
+                logger.debug("Leaving function "+str(function_name))
+                return True
+            elif resp.status_code == 404:
+                logger.warning("Site connection "+str(self.id)+" not found")
+                return False
+            elif resp.status_code == 412:
+                logger.info("Site connection "+str(self.id)+" was changed concurrently, re-reading it")
+                current=self.ShowSiteConnection(siteID=self.id, cmkAccess=cmkAccess)
+                if current is None:
+                    return False
+                self._etag=current.etag
+            else:
+                logger.error(pprint.pformat(cmkAccess.decodeResponse(resp)))
+                raise RuntimeError(pprint.pformat(cmkAccess.decodeResponse(resp)))
+
+        raise ConcurrentModificationError("Site connection "+str(self.id)+" changed on each of "+str(retries+1)+" delete attempts")
 
 class SiteAllConnections:
     def __init__(self,cmkAccess=None):
         if cmkAccess == None: raise ValueError("cmkAccess is empty")
         if type(cmkAccess) != RestAPIcredentials: raise ValueError("cmkAccess are not of type RESTAPIcredentials")
         
-        apiUrl=cmkAccess.get_apiUrl()
         requestUrl="/domain-types/site_connection/collections/all"
 
         self._links=[]
@@ -2137,14 +3806,11 @@ class SiteAllConnections:
         self._id=""
         self._title=""
         self._value=[]
+        self._cmkAccess=cmkAccess
 
-        session = requests.session()
-        session.headers['Authorization'] = cmkAccess.credentials
-        session.headers['Accept'] = 'application/json'
-
-        resp = session.get(apiUrl+requestUrl)
+        resp = cmkAccess.apiRequest("GET", requestUrl)
         if resp.status_code == 200:
-            response_data=resp.json()
+            response_data=cmkAccess.decodeResponse(resp)
             logger.info ("Successfully read all Site Connections")
             logger.info ("API request status_code : "+str(resp.status_code))
 
@@ -2152,7 +3818,7 @@ class SiteAllConnections:
             logger.warning("API request status_code : "+str(resp.status_code))
             raise RuntimeWarning(resp.status_code)
         else:
-            raise RuntimeError(print(resp.json()))    
+            raise RuntimeError(pprint.pformat(cmkAccess.decodeResponse(resp)))
         
         
         linkArray=[]
@@ -2172,6 +3838,7 @@ class SiteAllConnections:
         
         for dataDict in response_data.get('value', []):
             site_connection=SiteConnection.from_dict(dataDict=dataDict)
+            site_connection.version=cmkAccess.version
             self._value.append(site_connection)
     
         self._extensions=response_data.get('extensions', {})
@@ -2233,13 +3900,13 @@ class SiteAllConnections:
         self._requestUrl=value
 
     
-    def to_dict(self):
+    def to_dict(self, version=None):
         return {
             "links": [link.to_dict() for link in self._links],
             "id": self._id,
             "domainType": self._domainType,
             "title": self._title,
-            "value": [val.to_dict() for val in self._value],
+            "value": [val.to_dict(version=version) for val in self._value],
             "extensions": self._extensions
         }
 
@@ -2272,6 +3939,148 @@ class SiteAllConnections:
         logger.debug("Leaving function "+str(function_name))
         return returnSite
 
+    def checkHealth(self, timeout=5, maxWorkers=16, viaProxy=False, proxyHost=""):
+        # Probes the status connection (a Livestatus status query) and the
+        # configuration URL of every site concurrently. Use the report's
+        # healthySiteIDs as sites= of activatePendingChanges to keep dead
+        # sites from blocking an activation.
+        # Unix and local sockets are only reachable on the central site
+        # itself; when this process cannot reach the socket, the central
+        # site is probed through its REST API instead.
+        function_name = inspect.currentframe().f_code.co_name
+        logger.debug("Entering function "+str(function_name))
+        from dwlab_cmkapi import cmkLivestatus
+
+        def probeCentralSite():
+            started=time.monotonic()
+            resp=self._cmkAccess.apiRequest("GET", "/version", apiVersion="1.0.0", timeout=timeout)
+            latency=time.monotonic()-started
+            if resp.status_code != 200:
+                raise RuntimeError("HTTP status code "+str(resp.status_code))
+            return latency, resp.status_code
+
+        def probeStatus(site_connection):
+            connection=site_connection.extensions.status_connection.connection
+            if not viaProxy and connection.socket_type in ["unix", "local"]:
+                socketPath=cmkLivestatus.cmkLivestatusConnection.socketPath(connection)
+                if socketPath == "" or not os.path.exists(socketPath):
+                    return probeCentralSite()
+            started=time.monotonic()
+            connection=cmkLivestatus.cmkLivestatusConnection.fromSiteConnection(
+                site_connection, viaProxy=viaProxy, proxyHost=proxyHost,
+                connectTimeout=timeout, queryTimeout=timeout, keepAlive=False
+            )
+            try:
+                connection.query(cmkLivestatus.cmkLivestatusQuery("status").columns("program_start"))
+            finally:
+                connection.close()
+            return time.monotonic()-started, None
+
+        def probeConfiguration(site_connection):
+            configuration_connection=site_connection.extensions.configuration_connection
+            started=time.monotonic()
+            resp=requests.get(
+                configuration_connection.url_of_remote_site,
+                timeout=timeout,
+                verify=not configuration_connection.ignore_tls_errors,
+                allow_redirects=False
+            )
+            latency=time.monotonic()-started
+            if resp.status_code >= 500:
+                raise RuntimeError("HTTP status code "+str(resp.status_code))
+            return latency, resp.status_code
+
+        tasks=[]
+        for site_connection in self._value:
+            tasks.append((site_connection.id, "status", probeStatus, site_connection))
+            if site_connection.extensions.configuration_connection.enable_replication:
+                tasks.append((site_connection.id, "configuration", probeConfiguration, site_connection))
+
+        healthReport=SiteHealthReport()
+        for site_connection in self._value:
+            healthReport.sites[site_connection.id]=SiteHealth(siteID=site_connection.id)
+        with ThreadPoolExecutor(max_workers=max(1, min(maxWorkers, len(tasks)))) as executor:
+            futures=[(siteID, probe, executor.submit(function, site_connection)) for siteID, probe, function, site_connection in tasks]
+            for siteID, probe, future in futures:
+                try:
+                    latency, statusCode=future.result()
+                    healthReport.sites[siteID].record(probe, latency=latency, statusCode=statusCode)
+                except Exception as e:
+                    healthReport.sites[siteID].record(probe, error=str(e) or type(e).__name__)
+
+        for siteID in healthReport.unhealthySiteIDs:
+            logger.warning("Site "+str(siteID)+" is unhealthy: "+str(healthReport.sites[siteID].to_dict()))
+        logger.debug("Leaving function "+str(function_name))
+        return healthReport
+
+class SiteHealth:
+    def __init__(self, siteID=""):
+        self._siteID = siteID
+        # probe name -> {"ok", "latency", "statusCode", "error"}
+        self._probes = {}
+
+    @property
+    def siteID(self):
+        return self._siteID
+
+    @property
+    def probes(self):
+        return self._probes
+
+    @property
+    def healthy(self):
+        return len(self._probes) > 0 and all(probe["ok"] for probe in self._probes.values())
+
+    @property
+    def latency(self):
+        # Slowest successful probe
+        latencies=[probe["latency"] for probe in self._probes.values() if probe["ok"]]
+        return max(latencies) if len(latencies) > 0 else None
+
+    def record(self, probe, latency=None, statusCode=None, error=None):
+        self._probes[probe] = {
+            "ok": error is None,
+            "latency": latency,
+            "statusCode": statusCode,
+            "error": error
+        }
+
+    def to_dict(self):
+        return {
+            "siteID": self._siteID,
+            "healthy": self.healthy,
+            "probes": self._probes
+        }
+
+class SiteHealthReport:
+    def __init__(self):
+        self._sites = {}
+        self._created = time.time()
+
+    @property
+    def sites(self):
+        return self._sites
+
+    @property
+    def created(self):
+        return self._created
+
+    @property
+    def healthySiteIDs(self):
+        return sorted(siteID for siteID, health in self._sites.items() if health.healthy)
+
+    @property
+    def unhealthySiteIDs(self):
+        return sorted(siteID for siteID, health in self._sites.items() if not health.healthy)
+
+    def to_dict(self):
+        return {
+            "created": self._created,
+            "healthy": self.healthySiteIDs,
+            "unhealthy": self.unhealthySiteIDs,
+            "sites": {siteID: health.to_dict() for siteID, health in self._sites.items()}
+        }
+
 class AllActivationsExtensions:
     def __init__(self, 
                  changes=[], 
@@ -2422,9 +4231,21 @@ class Change:
         return change
 
 class AllActivations:
+    PENDING_CHANGES_URL="/domain-types/activation_run/collections/pending_changes"
+
+    # Last ETag of the pending changes per site, with the writeGeneration
+    # of the credentials object it was read through: siteKey -> (etag, cmkAccess, generation)
+    _etags={}
+    # Sites answering HEAD on the pending changes collection
+    _headSupported={}
+    _etagsLock=threading.Lock()
+
     def __init__(self,
-                 cmkAccess=None
+                 cmkAccess=None,
+                 loadChanges=True
         ):
+        # With loadChanges=False the pending changes are not downloaded;
+        # activatePendingChanges then only fetches the ETag when needed.
         logger.debug("Entering function "+str(inspect.currentframe().f_code.co_name))
         logger.debug("cmkAccess: "+str(cmkAccess))
         if cmkAccess == None: raise ValueError("cmkAccess is empty")
@@ -2435,8 +4256,12 @@ class AllActivations:
         self._id=""
         self._title=""
         self._members={}
-        self._retryActivationCount=0
-        self.loadPendingChanges(cmkAccess)     
+        self._value=[]
+        self._extensions=AllActivationsExtensions()
+        self._ETag=None
+        self._lastActivationRun=None
+        if loadChanges:
+            self.loadPendingChanges(cmkAccess)     
     
     @property
     def links(self):
@@ -2480,6 +4305,16 @@ class AllActivations:
     def extensions(self, value):
         self._extensions = value
 
+    @property
+    def ETag(self):
+        return self._ETag
+
+    @property
+    def lastActivationRun(self):
+        # ActivationRun started by the last activatePendingChanges call with
+        # redirect=False
+        return self._lastActivationRun
+
 
     def loadPendingChanges(self,cmkAccess):
         function_name = inspect.currentframe().f_code.co_name
@@ -2487,7 +4322,6 @@ class AllActivations:
 
         if not isinstance(cmkAccess, RestAPIcredentials): raise ValueError("cmkAccess is not of type RestAPIcredentials")
 
-        apiUrl=cmkAccess.get_apiUrl()
         requestUrl="/domain-types/activation_run/collections/pending_changes"
 
         self._links=None
@@ -2498,13 +4332,9 @@ class AllActivations:
         self._members={}
         self._extensions=AllActivationsExtensions()
 
-        session = requests.session()
-        session.headers['Authorization'] = cmkAccess.credentials
-        session.headers['Accept'] = 'application/json'
-
-        resp = session.get(apiUrl+requestUrl)
+        resp = cmkAccess.apiRequest("GET", requestUrl)
         if resp.status_code == 200:
-            response_data=resp.json()
+            response_data=cmkAccess.decodeResponse(resp)
             logger.info ("Successfully read all Site Connections")
             logger.info ("API request status_code : "+str(resp.status_code))
 
@@ -2515,10 +4345,12 @@ class AllActivations:
             logger.warning("The requests accept headers can not be satisfied : "+str(resp.status_code))
             raise RuntimeWarning(resp.status_code)
         else:
-            raise RuntimeError(print(resp.json()))    
+            raise RuntimeError(pprint.pformat(cmkAccess.decodeResponse(resp)))
         
         
-        self._ETag=resp.headers["ETag"]
+        self._ETag=resp.headers.get("ETag") or None
+        if self._ETag is not None:
+            self.storeETag(cmkAccess, self._ETag)
         self.from_dict_pendingChanges(dataDict=response_data)
 
         logger.debug("Leaving function "+str(function_name))
@@ -2557,37 +4389,119 @@ class AllActivations:
             "extensions": self._extensions.to_dict()
         }
 
-    def activatePendingChanges(self, cmkAccess=None, redirect=True, sites=[], force_foreign_changes=False):
+    @classmethod
+    def storeETag(cls, cmkAccess, etag):
+        with cls._etagsLock:
+            cls._etags[cmkAccess.siteKey]=(etag, cmkAccess, cmkAccess.writeGeneration)
+
+    @classmethod
+    def cachedETag(cls, cmkAccess):
+        # The last ETag read through the same credentials object, as long
+        # as no write was sent through it since. Writes by other clients
+        # still invalidate it; activatePendingChanges recovers from the 412.
+        with cls._etagsLock:
+            entry=cls._etags.get(cmkAccess.siteKey)
+        if entry is None:
+            return None
+        etag, etagAccess, generation=entry
+        if etagAccess is not cmkAccess or generation != cmkAccess.writeGeneration:
+            return None
+        return etag
+
+    @classmethod
+    def fetchETag(cls, cmkAccess=None):
+        # Reads only the headers of the pending changes collection: HEAD
+        # where the site answers it, otherwise a GET whose body is not read.
+        # Returns None, and caches nothing, when the site sent no ETag.
+        function_name = inspect.currentframe().f_code.co_name
+        logger.debug("Entering function "+str(function_name))
+
+        if not isinstance(cmkAccess, RestAPIcredentials): raise ValueError("cmkAccess is not of type RestAPIcredentials")
+
+        resp=None
+        with cls._etagsLock:
+            headSupported=cls._headSupported.get(cmkAccess.siteKey, True)
+        if headSupported:
+            resp = cmkAccess.apiRequest("HEAD", cls.PENDING_CHANGES_URL)
+            if resp.status_code in [405, 501]:
+                logger.debug("HEAD on the pending changes is not supported, using GET")
+                with cls._etagsLock:
+                    cls._headSupported[cmkAccess.siteKey]=False
+            if resp.status_code != 200:
+                logger.debug("HEAD on the pending changes answered "+str(resp.status_code)+", using GET")
+                resp=None
+        if resp is None:
+            resp = cmkAccess.apiRequest("GET", cls.PENDING_CHANGES_URL, stream=True)
+            resp.close()
+            if resp.status_code != 200:
+                raise RuntimeError("Reading the pending changes failed with status code "+str(resp.status_code))
+        etag=resp.headers.get("ETag") or None
+        if etag is not None:
+            cls.storeETag(cmkAccess, etag)
+
+        logger.debug("Leaving function "+str(function_name))
+        return etag
+
+    @classmethod
+    def pendingChangeCount(cls, cmkAccess=None):
+        # Number of pending changes without building Change objects. The
+        # API has no count of its own, so this still downloads and decodes
+        # the whole list.
+        if not isinstance(cmkAccess, RestAPIcredentials): raise ValueError("cmkAccess is not of type RestAPIcredentials")
+        resp = cmkAccess.apiRequest("GET", cls.PENDING_CHANGES_URL)
+        if resp.status_code != 200:
+            raise RuntimeError("Reading the pending changes failed with status code "+str(resp.status_code))
+        if resp.headers.get("ETag", "") != "":
+            cls.storeETag(cmkAccess, resp.headers["ETag"])
+        return len(cmkAccess.decodeResponse(resp).get('value', []))
+
+    def activatePendingChanges(self, cmkAccess=None, redirect=True, sites=[], force_foreign_changes=False, useWildcard=False, retries=3):
+        # Uses the ETag of loadPendingChanges, else the cached one of the
+        # site, else fetches only the ETag. useWildcard sends "If-Match: *"
+        # and skips the check where the site accepts it; the wildcard is
+        # also sent when the site reports no ETag. On 412 the ETag is
+        # fetched again, up to retries times.
         function_name = inspect.currentframe().f_code.co_name
         logger.debug("Entering function "+str(function_name))
         
         if cmkAccess == None: raise ValueError("cmkAccess is empty")
         if type(cmkAccess) != RestAPIcredentials: raise ValueError("cmkAccess are not of type RESTAPIcredentials")
 
-        apiUrl=cmkAccess.get_apiUrl()
         requestUrl="/domain-types/activation_run/actions/activate-changes/invoke"
 
-        session = requests.session()
-        session.headers['Authorization'] = f"{cmkAccess.credentials}"
-        session.headers['Accept'] = 'application/json'
-        session.headers['If-Match'] = f"{self._ETag}"
-
         payLoad=dict()
         payLoad["redirect"]=redirect
         payLoad["sites"]=sites
         payLoad["force_foreign_changes"]=force_foreign_changes
 
-        resp = session.post(apiUrl+requestUrl,json=payLoad)
+        if useWildcard:
+            etag="*"
+        else:
+            etag=self._ETag if self._ETag is not None else self.cachedETag(cmkAccess)
+            if etag is None:
+                etag=self.fetchETag(cmkAccess) or "*"
+        for attempt in range(retries+1):
+            resp = cmkAccess.apiRequest("POST", requestUrl,
+                headers={"If-Match": f"{etag}"},
+                jsonBody=payLoad
+            )
+            if resp.status_code != 412 or attempt == retries:
+                break
+            logger.warning("The list of pending changes changed, fetching its ETag again")
+            etag=self.fetchETag(cmkAccess) or "*"
+        self._ETag=etag if etag != "*" else self._ETag
+
         if resp.status_code in [200]:
-            response_data=resp.json()
+            response_data=cmkAccess.decodeResponse(resp)
             logger.debug("API request status_code : "+str(resp.status_code))
             logger.debug(str(response_data))
+            self._lastActivationRun=ActivationRun.from_dict(dataDict=response_data)
             activationResponse="Started"
         elif resp.status_code == 204:
             logger.info("Activation completed successfully")
             activationResponse="Done"
         elif resp.status_code == 409:
-            problemDetails=resp.json()
+            problemDetails=cmkAccess.decodeResponse(resp)
             logger.warning(function_name+" responded:")
             logger.warning("Conflict        : Some sites could not be activated.")
             logger.warning("API status code : "+str(resp.status_code))
@@ -2595,20 +4509,15 @@ class AllActivations:
             logger.warning("Response details: "+str(problemDetails.get('details',"")))
             activationResponse=resp.status_code
         elif resp.status_code == 412:
-            problemDetails=resp.json()
+            problemDetails=cmkAccess.decodeResponse(resp)
             logger.warning(function_name+" responded:")
-            logger.warning("The list of Activations changed")
+            logger.warning("The list of Activations kept changing")
             logger.warning("API status code : "+str(resp.status_code))
             logger.warning("Response title  : "+str(problemDetails.get('title',"")))
             logger.warning("Response details: "+str(problemDetails.get('details',"")))
             activationResponse=resp.status_code
-            if self._retryActivationCount <= 3:
-                self._retryActivationCount+=1
-                logger.warning("Reloading the list of Activations")
-                self.loadPendingChanges(cmkAccess)
-                activationResponse=self.activatePendingChanges(cmkAccess, redirect, sites, force_foreign_changes)
         elif resp.status_code == 422:
-            problemDetails=resp.json()
+            problemDetails=cmkAccess.decodeResponse(resp)
             logger.warning(function_name+" responded:")
             logger.warning("No pending activations.")
             logger.warning("API status code : "+str(resp.status_code))
@@ -2616,11 +4525,112 @@ class AllActivations:
             logger.warning("Response details: "+str(problemDetails.get('details',"")))
             activationResponse=resp.status_code
         else:
-            logger.error(print(resp.json()))
+            logger.error(pprint.pformat(cmkAccess.decodeResponse(resp)))
             logger.error("API request status_code : "+str(resp.status_code))      
             raise RuntimeError(function_name+" failed")
         
         logger.debug("Leaving function "+str(function_name))
         return activationResponse
 
+class ActivationRun:
+    def __init__(self,
+                 id="",
+                 title="",
+                 sites=None,
+                 is_running=False,
+                 force_foreign_changes=False,
+                 time_started="",
+                 status_per_site=None
+        ):
+        self._id = id
+        self._title = title
+        self._sites = sites if sites is not None else []
+        self._is_running = is_running
+        self._force_foreign_changes = force_foreign_changes
+        self._time_started = time_started
+        # Reported from Checkmk 2.3 on: site id -> {"phase", "state", "status_text", ...}
+        self._status_per_site = status_per_site if status_per_site is not None else {}
+
+    @property
+    def id(self):
+        return self._id
+
+    @property
+    def title(self):
+        return self._title
+
+    @property
+    def sites(self):
+        return self._sites
+
+    @property
+    def is_running(self):
+        return self._is_running
+
+    @property
+    def force_foreign_changes(self):
+        return self._force_foreign_changes
+
+    @property
+    def time_started(self):
+        return self._time_started
+
+    @property
+    def status_per_site(self):
+        return self._status_per_site
+
+    def siteFailed(self, siteID):
+        status=self._status_per_site.get(siteID)
+        if status is None:
+            return False
+        return status.get("state", "success") not in ["success", ""]
+
+    @classmethod
+    def from_dict(cls, dataDict=None):
+        if dataDict is None:
+            raise ValueError("dataDict is None")
+        extensionsDict=dataDict.get('extensions', {})
+        status_per_site={}
+        for siteStatus in extensionsDict.get('status_per_site', []):
+            status_per_site[siteStatus.get('site', "")]=siteStatus
+        return cls(
+            id=dataDict.get('id', ""),
+            title=dataDict.get('title', ""),
+            sites=extensionsDict.get('sites', []),
+            is_running=extensionsDict.get('is_running', False),
+            force_foreign_changes=extensionsDict.get('force_foreign_changes', False),
+            time_started=extensionsDict.get('time_started', ""),
+            status_per_site=status_per_site
+        )
+
+    def to_dict(self):
+        return {
+            "id": self._id,
+            "title": self._title,
+            "extensions": {
+                "sites": self._sites,
+                "is_running": self._is_running,
+                "force_foreign_changes": self._force_foreign_changes,
+                "time_started": self._time_started,
+                "status_per_site": list(self._status_per_site.values())
+            }
+        }
+
+    @classmethod
+    def ShowActivation(cls, activationID="", cmkAccess=None):
+        function_name = inspect.currentframe().f_code.co_name
+        logger.debug("Entering function "+str(function_name))
+
+        if not isinstance(cmkAccess, RestAPIcredentials): raise ValueError("cmkAccess is not of type RestAPIcredentials")
+        if activationID == "": raise ValueError("activationID is empty")
 
+        requestUrl=APICapabilities.ACTIVATION_STATUS_URL.format(activation_id=activationID)
+        resp = cmkAccess.apiRequest("GET", requestUrl)
+        if resp.status_code == 200:
+            activationRun=cls.from_dict(dataDict=cmkAccess.decodeResponse(resp))
+        else:
+            logger.error(pprint.pformat(cmkAccess.decodeResponse(resp)))
+            raise RuntimeError(pprint.pformat(cmkAccess.decodeResponse(resp)))
+
+        logger.debug("Leaving function "+str(function_name))
+        return activationRun
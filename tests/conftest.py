@@ -0,0 +1,170 @@
+import gzip
+import json
+import socket
+import threading
+import socketserver
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+import dwlab_cmkapi
+
+
+class FakeLivestatusServer:
+    # Answers LQL requests with fixed16 headers and JSON bodies. rows maps a
+    # table to its rows, queries collects the request lines of every query.
+
+    def __init__(self, address):
+        self.rows={"services": [["h1", "CPU", 2], ["h2", "Disk", 0]]}
+        self.queries=[]
+        self.connections=0
+        self.handlers=[]
+        super().__init__(address, FakeLivestatusHandler)
+
+    def dropConnections(self):
+        # Closes every open client connection, like a restarted site
+        for handler in list(self.handlers):
+            try:
+                handler.request.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class FakeLivestatus(socketserver.ThreadingMixIn, FakeLivestatusServer, socketserver.TCPServer):
+    daemon_threads=True
+    allow_reuse_address=True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0))
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+
+class FakeUnixLivestatus(socketserver.ThreadingMixIn, FakeLivestatusServer, socketserver.UnixStreamServer):
+    daemon_threads=True
+
+    @property
+    def path(self):
+        return self.server_address
+
+
+class FakeLivestatusHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        self.server.connections+=1
+        self.server.handlers.append(self)
+        requestFile=self.request.makefile("rb")
+        while True:
+            lines=[]
+            while True:
+                line=requestFile.readline()
+                if not line:
+                    return
+                line=line.decode("utf-8").rstrip("\n")
+                if line == "":
+                    break
+                lines.append(line)
+            self.server.queries.append(lines)
+            table=lines[0].split()[1]
+            if table not in self.server.rows and table != "status":
+                status, body=404, ("Table "+table+" does not exist\n").encode("utf-8")
+            elif any(line.startswith("Stats:") for line in lines):
+                statsCount=sum(1 for line in lines if line.startswith("Stats:"))
+                status, body=200, json.dumps([[5]*statsCount]).encode("utf-8")
+            else:
+                status, body=200, json.dumps(self.server.rows.get(table, [[0]])).encode("utf-8")
+            self.request.sendall(("%03d %11d\n" % (status, len(body))).encode("utf-8")+body)
+            if "KeepAlive: on" not in lines:
+                return
+
+
+def serve(server):
+    thread=threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def livestatusServer():
+    yield from serve(FakeLivestatus())
+
+
+@pytest.fixture
+def unixLivestatusServer(tmp_path):
+    yield from serve(FakeUnixLivestatus(str(tmp_path/"live")))
+
+
+class FakeCheckmkHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _handle(self):
+        length=int(self.headers.get("Content-Length") or 0)
+        body=self.rfile.read(length) if length else b""
+        site, path=self.path.split("/check_mk/api/", 1)
+        site=site.strip("/")
+        path, _, queryString=("/"+path.split("/", 1)[-1]).partition("?")
+        self.server.requests.append((self.command, path, body, site))
+        self.server.queryStrings.append(queryString)
+        self.server.requestHeaders.append(dict(self.headers))
+        self.server.current.headers=dict(self.headers)
+        if self.headers.get("Content-Encoding") == "gzip":
+            body=gzip.decompress(body)
+        route=self.server.routes.get((self.command, path, site), self.server.routes.get((self.command, path)))
+        if route is None:
+            status, data, headers=404, {"title": "Not found"}, {}
+        else:
+            status, data, headers=route(body)
+        content=b"" if data is None else json.dumps(data).encode("utf-8")
+        if headers.get("Content-Encoding") == "gzip":
+            content=gzip.compress(content)
+        self.send_response(status)
+        for name in headers:
+            self.send_header(name, headers[name])
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(content)
+
+    do_GET=do_POST=do_PUT=do_DELETE=do_HEAD=_handle
+
+
+@pytest.fixture
+def cmkServer(monkeypatch):
+    # A fake REST API; routes maps (method, path) or, for one site only,
+    # (method, path, site) to a function of the request body returning
+    # (status, data, headers). requests records (method, path, body, site)
+    # as sent, requestHeaders and queryStrings the matching request headers
+    # and URL query strings; current.headers holds the headers of the
+    # request a route is answering. Responses are gzipped when the route
+    # sets Content-Encoding: gzip.
+    server=ThreadingHTTPServer(("127.0.0.1", 0), FakeCheckmkHandler)
+    server.requests=[]
+    server.requestHeaders=[]
+    server.queryStrings=[]
+    server.current=threading.local()
+    server.routes={
+        ("GET", "/version"): lambda body: (200, {
+            "site": "central",
+            "group": "",
+            "rest_api": {"revision": "0"},
+            "versions": {"checkmk": "2.3.0p1"},
+            "edition": "cre",
+            "demo": False
+        }, {})
+    }
+    port=server.server_address[1]
+    monkeypatch.setattr(
+        dwlab_cmkapi.RestAPIcredentials, "get_apiUrl",
+        lambda self, apiVersion="": "http://127.0.0.1:"+str(port)+"/"+str(self.cmkSiteName)+"/check_mk/api/1.0"
+    )
+    yield from serve(server)
+
+
+@pytest.fixture
+def cmkAccess(cmkServer):
+    return dwlab_cmkapi.RestAPIcredentials(cmkHostname="cmk", cmkDomain="example.com", cmkSiteName="central", credentials="Bearer automation secret")
@@ -0,0 +1,274 @@
+import json
+import time
+import sqlite3
+import threading
+
+import pytest
+
+from dwlab_cmkapi import AllActivations, SiteConnection, Version, cmkActivationCoordinator, cmkActivationEvent, cmkActivationOrchestrator
+
+PENDING_CHANGES_URL="/domain-types/activation_run/collections/pending_changes"
+ACTIVATE_URL="/domain-types/activation_run/actions/activate-changes/invoke"
+
+
+@pytest.fixture(autouse=True)
+def emptyCaches(monkeypatch):
+    monkeypatch.setattr(AllActivations, "_etags", {})
+    monkeypatch.setattr(AllActivations, "_headSupported", {})
+
+
+def routeActivation(cmkServer, failures=None):
+    # Every activation finishes at once; a site listed in failures fails
+    # that many times before it succeeds.
+    failures=dict(failures or {})
+    cmkServer.routes[("HEAD", PENDING_CHANGES_URL)]=lambda body: (200, None, {"ETag": '"changes"'})
+    def activate(body):
+        sites=json.loads(body)["sites"]
+        status_per_site=[]
+        for siteID in sites:
+            failed=failures.get(siteID, 0) > 0
+            failures[siteID]=failures.get(siteID, 0)-1
+            status_per_site.append({"site": siteID, "state": "error" if failed else "success", "status_details": "Unreachable" if failed else ""})
+        return (200, {"id": "run-"+"-".join(sites), "extensions": {"sites": sites, "is_running": False, "status_per_site": status_per_site}}, {})
+    cmkServer.routes[("POST", ACTIVATE_URL)]=activate
+
+
+def activatedSiteGroups(cmkServer):
+    return [json.loads(request[2])["sites"] for request in cmkServer.requests if request[:2] == ("POST", ACTIVATE_URL)]
+
+
+def test_sites_are_activated_in_groups(cmkServer, cmkAccess):
+    routeActivation(cmkServer)
+    seen=[]
+    orchestrator=cmkActivationOrchestrator(cmkAccess=cmkAccess, groupSize=2, maxParallel=2, pollInterval=0, onEvent=seen.append)
+    result=orchestrator.activate(sites=["s1", "s2", "s3"])
+    assert result.ok
+    assert result.done == ["s1", "s2", "s3"]
+    assert sorted(activatedSiteGroups(cmkServer)) == [["s1", "s2"], ["s3"]]
+    assert [event.state for event in result.events if event.siteID == "s3"] == [
+        cmkActivationEvent.QUEUED, cmkActivationEvent.RUNNING, cmkActivationEvent.DONE
+    ]
+    assert seen == result.events
+
+
+def test_only_failed_sites_are_retried(cmkServer, cmkAccess):
+    routeActivation(cmkServer, failures={"s2": 1})
+    orchestrator=cmkActivationOrchestrator(cmkAccess=cmkAccess, groupSize=2, pollInterval=0, retries=1)
+    result=orchestrator.activate(sites=["s1", "s2", "s3"])
+    assert result.ok
+    assert activatedSiteGroups(cmkServer)[-1] == ["s2"]
+    assert [event.attempt for event in result.events if event.siteID == "s1"] == [0, 0, 0]
+
+
+def test_sites_failing_every_attempt_are_reported(cmkServer, cmkAccess):
+    routeActivation(cmkServer, failures={"s2": 5})
+    orchestrator=cmkActivationOrchestrator(cmkAccess=cmkAccess, pollInterval=0, retries=2)
+    result=orchestrator.activate(sites=["s1", "s2"])
+    assert result.done == ["s1"]
+    assert result.failed == {"s2": "Unreachable"}
+    assert activatedSiteGroups(cmkServer).count(["s2"]) == 3
+
+
+def test_empty_sites_activate_all_connected_sites(cmkServer, cmkAccess):
+    routeActivation(cmkServer)
+    version=Version(site="central", group="", rest_api={"revision": "0"}, versions={"checkmk": "2.3.0p1"}, edition="cre", demo=False)
+    siteConnections=[]
+    for siteID in ["central", "remote1"]:
+        site_connection=SiteConnection()
+        site_connection.id=siteID
+        site_connection.extensions.basic_settings.site_id=siteID
+        siteConnections.append(site_connection.to_dict(version=version))
+    cmkServer.routes[("GET", "/domain-types/site_connection/collections/all")]=lambda body: (200, {"value": siteConnections}, {})
+    result=cmkActivationOrchestrator(cmkAccess=cmkAccess, pollInterval=0).activate(sites=[])
+    assert result.done == ["central", "remote1"]
+    assert sorted(activatedSiteGroups(cmkServer)) == [["central"], ["remote1"]]
+
+
+def test_concurrent_groups_do_not_fail_each_other_with_412(cmkServer, cmkAccess):
+    # Every started activation changes the ETag; s3 keeps answering 412
+    generation=[0]
+    def etag():
+        return '"changes-'+str(generation[0])+'"'
+    def activate(body):
+        sites=json.loads(body)["sites"]
+        if cmkServer.current.headers.get("If-Match") != etag() or "s3" in sites:
+            return (412, {"title": "Precondition failed"}, {})
+        generation[0]+=1
+        return (200, {"id": "run-"+"-".join(sites), "extensions": {"sites": sites, "is_running": False, "status_per_site": [{"site": siteID, "state": "success", "status_details": ""} for siteID in sites]}}, {})
+    cmkServer.routes[("HEAD", PENDING_CHANGES_URL)]=lambda body: (200, None, {"ETag": etag()})
+    cmkServer.routes[("POST", ACTIVATE_URL)]=activate
+    orchestrator=cmkActivationOrchestrator(cmkAccess=cmkAccess, groupSize=1, maxParallel=4, pollInterval=0, retries=0)
+    result=orchestrator.activate(sites=["s1", "s2", "s3", "s4"])
+    assert result.done == ["s1", "s2", "s4"]
+    assert list(result.failed) == ["s3"]
+    assert generation[0] == 3
+
+
+def activationHeaders(cmkServer):
+    return [headers["If-Match"] for request, headers in zip(cmkServer.requests, cmkServer.requestHeaders) if request[:2] == ("POST", ACTIVATE_URL)]
+
+
+def methodsOnPendingChanges(cmkServer):
+    return [request[0] for request in cmkServer.requests if request[1] == PENDING_CHANGES_URL]
+
+
+def test_activation_fetches_only_the_etag(cmkServer, cmkAccess):
+    cmkServer.routes[("HEAD", PENDING_CHANGES_URL)]=lambda body: (200, None, {"ETag": '"changes"'})
+    cmkServer.routes[("POST", ACTIVATE_URL)]=lambda body: (204, None, {})
+    activation=AllActivations(cmkAccess=cmkAccess, loadChanges=False)
+    assert activation.activatePendingChanges(cmkAccess=cmkAccess) == "Done"
+    assert methodsOnPendingChanges(cmkServer) == ["HEAD"]
+    assert activationHeaders(cmkServer) == ['"changes"']
+
+
+def test_etag_is_read_with_get_where_head_is_refused(cmkServer, cmkAccess):
+    cmkServer.routes[("HEAD", PENDING_CHANGES_URL)]=lambda body: (405, None, {})
+    cmkServer.routes[("GET", PENDING_CHANGES_URL)]=lambda body: (200, {"value": [{"id": "c1"}]}, {"ETag": '"changes"'})
+    assert AllActivations.fetchETag(cmkAccess=cmkAccess) == '"changes"'
+    assert AllActivations.fetchETag(cmkAccess=cmkAccess) == '"changes"'
+    assert methodsOnPendingChanges(cmkServer) == ["HEAD", "GET", "GET"]
+
+
+def test_other_head_failures_are_not_remembered(cmkServer, cmkAccess):
+    statuses=[503]
+    cmkServer.routes[("HEAD", PENDING_CHANGES_URL)]=lambda body: (statuses.pop(0), None, {}) if statuses else (200, None, {"ETag": '"head"'})
+    cmkServer.routes[("GET", PENDING_CHANGES_URL)]=lambda body: (200, {"value": []}, {"ETag": '"get"'})
+    assert AllActivations.fetchETag(cmkAccess=cmkAccess) == '"get"'
+    assert AllActivations.fetchETag(cmkAccess=cmkAccess) == '"head"'
+    assert methodsOnPendingChanges(cmkServer) == ["HEAD", "GET", "HEAD"]
+
+
+def test_missing_etag_is_fetched_again_or_wildcarded(cmkServer, cmkAccess):
+    cmkServer.routes[("HEAD", PENDING_CHANGES_URL)]=lambda body: (405, None, {})
+    cmkServer.routes[("GET", PENDING_CHANGES_URL)]=lambda body: (200, {"value": []}, {})
+    cmkServer.routes[("POST", ACTIVATE_URL)]=lambda body: (204, None, {})
+    assert AllActivations.fetchETag(cmkAccess=cmkAccess) is None
+    assert AllActivations.cachedETag(cmkAccess) is None
+    activation=AllActivations(cmkAccess=cmkAccess, loadChanges=False)
+    assert activation.activatePendingChanges(cmkAccess=cmkAccess) == "Done"
+    assert activationHeaders(cmkServer) == ["*"]
+    assert methodsOnPendingChanges(cmkServer) == ["HEAD", "GET", "GET"]
+
+
+def test_cached_etag_is_reused_until_a_write(cmkServer, cmkAccess):
+    cmkServer.routes[("GET", PENDING_CHANGES_URL)]=lambda body: (200, {"value": [{"id": "c1"}, {"id": "c2"}]}, {"ETag": '"counted"'})
+    cmkServer.routes[("HEAD", PENDING_CHANGES_URL)]=lambda body: (200, None, {"ETag": '"fetched"'})
+    cmkServer.routes[("POST", ACTIVATE_URL)]=lambda body: (204, None, {})
+    assert AllActivations.pendingChangeCount(cmkAccess=cmkAccess) == 2
+    AllActivations(cmkAccess=cmkAccess, loadChanges=False).activatePendingChanges(cmkAccess=cmkAccess)
+    # The activation was a write, so the next one fetches the ETag again
+    AllActivations(cmkAccess=cmkAccess, loadChanges=False).activatePendingChanges(cmkAccess=cmkAccess)
+    assert activationHeaders(cmkServer) == ['"counted"', '"fetched"']
+    assert methodsOnPendingChanges(cmkServer) == ["GET", "HEAD"]
+
+
+def test_missing_etag_is_not_cached(cmkServer, cmkAccess):
+    cmkServer.routes[("GET", PENDING_CHANGES_URL)]=lambda body: (200, {"value": []}, {})
+    assert AllActivations.pendingChangeCount(cmkAccess=cmkAccess) == 0
+    assert AllActivations.cachedETag(cmkAccess) is None
+    activation=AllActivations(cmkAccess=cmkAccess)
+    assert activation.ETag is None
+    assert AllActivations.cachedETag(cmkAccess) is None
+
+
+def test_stale_etag_is_fetched_again(cmkServer, cmkAccess):
+    statuses=[412]
+    cmkServer.routes[("HEAD", PENDING_CHANGES_URL)]=lambda body: (200, None, {"ETag": '"v"'+str(len(cmkServer.requests))})
+    cmkServer.routes[("POST", ACTIVATE_URL)]=lambda body: ((statuses.pop(0), {"title": "Precondition Failed"}, {}) if statuses else (204, None, {}))
+    activation=AllActivations(cmkAccess=cmkAccess, loadChanges=False)
+    assert activation.activatePendingChanges(cmkAccess=cmkAccess) == "Done"
+    first, second=activationHeaders(cmkServer)
+    assert first != second
+    assert activation.ETag == second
+
+
+def test_wildcard_skips_the_etag(cmkServer, cmkAccess):
+    cmkServer.routes[("POST", ACTIVATE_URL)]=lambda body: (204, None, {})
+    activation=AllActivations(cmkAccess=cmkAccess, loadChanges=False)
+    assert activation.activatePendingChanges(cmkAccess=cmkAccess, useWildcard=True) == "Done"
+    assert activationHeaders(cmkServer) == ["*"]
+    assert methodsOnPendingChanges(cmkServer) == []
+
+
+def test_colliding_activations_are_folded(cmkServer, cmkAccess, tmp_path):
+    cmkServer.routes[("HEAD", PENDING_CHANGES_URL)]=lambda body: (200, None, {"ETag": '"changes"'})
+    def slowActivation(body):
+        time.sleep(0.3)
+        return (204, None, {})
+    cmkServer.routes[("POST", ACTIVATE_URL)]=slowActivation
+    coordinator=cmkActivationCoordinator(path=tmp_path/"activation.db", pollInterval=0.05)
+    results=[]
+    workers=[threading.Thread(target=lambda: results.append(coordinator.activate(cmkAccess=cmkAccess))) for _ in range(6)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert results == ["Done"]*6
+    assert 1 <= len(activatedSiteGroups(cmkServer)) <= 2
+
+
+def test_expired_lease_is_taken_over(cmkServer, cmkAccess, tmp_path):
+    routeActivation(cmkServer)
+    coordinator=cmkActivationCoordinator(path=tmp_path/"activation.db", pollInterval=0)
+    # A worker died while activating s1
+    db=sqlite3.connect(str(coordinator.path), isolation_level=None)
+    db.execute("INSERT INTO leases (site, holder, expires) VALUES (?, ?, ?)", (cmkAccess.siteKey, "dead", time.time()-1))
+    db.execute("INSERT INTO tickets (site, sites, force, state, batch, requested) VALUES (?, ?, 0, ?, ?, ?)",
+        (cmkAccess.siteKey, json.dumps(["s1"]), cmkActivationCoordinator.RUNNING, "dead", time.time()))
+    assert coordinator.activate(cmkAccess=cmkAccess, sites=["s2"]) == "Done"
+    assert activatedSiteGroups(cmkServer) == [["s1", "s2"]]
+    assert db.execute("SELECT state FROM tickets").fetchall() == [(cmkActivationCoordinator.DONE,)]*2
+    db.close()
+
+
+def test_nothing_pending_counts_as_done(cmkServer, cmkAccess, tmp_path):
+    cmkServer.routes[("HEAD", PENDING_CHANGES_URL)]=lambda body: (200, None, {"ETag": '"changes"'})
+    cmkServer.routes[("POST", ACTIVATE_URL)]=lambda body: (422, {"title": "No pending changes"}, {})
+    coordinator=cmkActivationCoordinator(path=tmp_path/"activation.db", pollInterval=0)
+    assert coordinator.activate(cmkAccess=cmkAccess) == "Done"
+
+
+def test_waiting_for_a_held_lease_times_out(cmkServer, cmkAccess, tmp_path):
+    coordinator=cmkActivationCoordinator(path=tmp_path/"activation.db", pollInterval=0.05, timeout=0.2)
+    db=sqlite3.connect(str(coordinator.path), isolation_level=None)
+    db.execute("INSERT INTO leases (site, holder, expires) VALUES (?, ?, ?)", (cmkAccess.siteKey, "busy", time.time()+60))
+    with pytest.raises(RuntimeError):
+        coordinator.activate(cmkAccess=cmkAccess)
+    assert db.execute("SELECT COUNT(*) FROM tickets").fetchone() == (0,)
+    assert activatedSiteGroups(cmkServer) == []
+    db.close()
+
+
+def test_lease_is_derived_from_the_request_timeout(cmkServer, cmkAccess, tmp_path):
+    coordinator=cmkActivationCoordinator(path=tmp_path/"activation.db", retries=3)
+    assert coordinator.leaseTimeFor(cmkAccess) > 120*4
+    assert cmkActivationCoordinator(path=tmp_path/"activation.db", leaseTime=5).leaseTimeFor(cmkAccess) == 5
+
+
+def test_leader_stops_when_its_lease_was_taken_over(cmkServer, cmkAccess, tmp_path):
+    coordinator=cmkActivationCoordinator(path=tmp_path/"activation.db", pollInterval=0.05)
+    db=sqlite3.connect(str(coordinator.path), isolation_level=None)
+    def takeOver(body):
+        if len(activatedSiteGroups(cmkServer)) > 1:
+            return (204, None, {})
+        # Another worker took the lease over while the activation started
+        db.execute("UPDATE leases SET holder = ?, expires = ?", ("other", time.time()+0.2))
+        db.execute("UPDATE tickets SET state = ?, batch = NULL", (cmkActivationCoordinator.WAITING,))
+        return (200, {"id": "run-1", "extensions": {"sites": [], "is_running": True, "status_per_site": []}}, {})
+    cmkServer.routes[("HEAD", PENDING_CHANGES_URL)]=lambda body: (200, None, {"ETag": '"changes"'})
+    cmkServer.routes[("POST", ACTIVATE_URL)]=takeOver
+    assert coordinator.activate(cmkAccess=cmkAccess) == "Done"
+    assert len(activatedSiteGroups(cmkServer)) == 2
+    assert not any(request[0] == "GET" and "run-1" in request[1] for request in cmkServer.requests)
+    db.close()
+
+
+def test_orchestrator_activates_through_the_coordinator(cmkServer, cmkAccess, tmp_path):
+    routeActivation(cmkServer)
+    coordinator=cmkActivationCoordinator(path=tmp_path/"activation.db", pollInterval=0.05)
+    orchestrator=cmkActivationOrchestrator(cmkAccess=cmkAccess, groupSize=1, maxParallel=2, pollInterval=0, coordinator=coordinator)
+    result=orchestrator.activate(sites=["s1", "s2"])
+    assert result.done == ["s1", "s2"]
+    db=sqlite3.connect(str(coordinator.path), isolation_level=None)
+    assert db.execute("SELECT state FROM tickets").fetchall() == [(cmkActivationCoordinator.DONE,)]*2
+    db.close()
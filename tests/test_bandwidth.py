@@ -0,0 +1,59 @@
+import gzip
+import json
+
+from dwlab_cmkapi import BandwidthStats, RestAPIcredentials
+
+HOSTS_URL="/domain-types/host_config/collections/all"
+
+
+def credentials(**kwargs):
+    return RestAPIcredentials(cmkHostname="cmk", cmkDomain="example.com", cmkSiteName="central", credentials="Bearer automation secret", **kwargs)
+
+
+def test_object_ids_share_one_endpoint():
+    stats=BandwidthStats()
+    stats.record("get", "/objects/host_config/web1?effective_attributes=true", responseBytes=10, responseBytesUncompressed=40)
+    stats.record("GET", "/objects/host_config/db1", responseBytes=5, responseBytesUncompressed=20)
+    assert stats.to_dict() == {"GET /objects/host_config/{id}": {
+        "requests": 2,
+        "requestBytes": 0,
+        "requestBytesUncompressed": 0,
+        "responseBytes": 15,
+        "responseBytesUncompressed": 60
+    }}
+    assert stats.totals()["requests"] == 2
+    stats.reset()
+    assert stats.totals()["requests"] == 0
+
+
+def test_compressed_responses_are_negotiated_and_accounted(cmkServer):
+    cmkAccess=credentials()
+    value=[{"id": "host"+str(index), "extensions": {"folder": "/"}} for index in range(200)]
+    cmkServer.routes[("GET", HOSTS_URL)]=lambda body: (200, {"value": value}, {"Content-Encoding": "gzip"})
+    resp=cmkAccess.apiRequest("GET", HOSTS_URL)
+    assert cmkAccess.decodeResponse(resp)["value"] == value
+    assert "gzip" in cmkServer.requestHeaders[-1]["Accept-Encoding"]
+    stats=cmkAccess.bandwidth.to_dict()["GET "+HOSTS_URL]
+    assert stats["responseBytesUncompressed"] == len(json.dumps({"value": value}))
+    assert 0 < stats["responseBytes"] < stats["responseBytesUncompressed"]
+
+
+def test_large_request_bodies_are_gzipped_when_enabled(cmkServer):
+    cmkAccess=credentials(compressRequests=True, compressThreshold=1024)
+    received=[]
+    cmkServer.routes[("POST", HOSTS_URL)]=lambda body: (received.append(json.loads(body)) or (200, {}, {}))
+    payLoad={"entries": [{"host_name": "host"+str(index), "folder": "/"} for index in range(100)]}
+    cmkAccess.apiRequest("POST", HOSTS_URL, jsonBody=payLoad)
+    assert received == [payLoad]
+    assert cmkServer.requestHeaders[-1]["Content-Encoding"] == "gzip"
+    assert json.loads(gzip.decompress(cmkServer.requests[-1][2])) == payLoad
+    stats=cmkAccess.bandwidth.to_dict()["POST "+HOSTS_URL]
+    assert stats["requestBytes"] == len(cmkServer.requests[-1][2])
+    assert stats["requestBytes"] < stats["requestBytesUncompressed"]
+
+
+def test_small_or_default_request_bodies_are_sent_uncompressed(cmkServer):
+    cmkServer.routes[("POST", HOSTS_URL)]=lambda body: (200, {}, {})
+    credentials(compressRequests=True, compressThreshold=1024).apiRequest("POST", HOSTS_URL, jsonBody={"entries": []})
+    credentials().apiRequest("POST", HOSTS_URL, jsonBody={"entries": ["x"]*1000})
+    assert [headers.get("Content-Encoding") for headers in cmkServer.requestHeaders[-2:]] == [None, None]
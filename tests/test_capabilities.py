@@ -0,0 +1,67 @@
+import json
+
+import pytest
+
+from dwlab_cmkapi import APICapabilities, HostConfig, Version
+
+HOSTS_URL="/domain-types/host_config/collections/all"
+
+
+@pytest.fixture(autouse=True)
+def emptyCache(monkeypatch):
+    monkeypatch.setattr(APICapabilities, "_cache", {})
+
+
+def version(checkmk):
+    return Version(site="central", group="", rest_api={"revision": "0"}, versions={"checkmk": checkmk}, edition="cre", demo=False)
+
+
+def test_flags_from_version():
+    old=APICapabilities.fromVersion(version("2.1.0p30"))
+    assert old.payloadDialect == "2.2"
+    assert old.bulkCreateHosts and not old.bulkDiscovery and not old.siteConnections
+    new=APICapabilities.fromVersion(version("2.3.0p1"))
+    assert new.payloadDialect == "2.3"
+    assert new.bulkDiscovery and new.siteConnections
+    unknown=APICapabilities.fromVersion(version("master"))
+    assert not unknown.bulkCreateHosts
+
+
+def test_probe_refines_flags_and_is_cached(cmkServer, cmkAccess):
+    paths={APICapabilities.SITE_CONNECTIONS_URL: {}, APICapabilities.BULK_UPDATE_HOSTS_URL: {}}
+    cmkServer.routes[("GET", "/openapi-doc.json")]=lambda body: (200, {"paths": paths}, {})
+    capabilities=APICapabilities.forSite(cmkAccess, probe=True)
+    assert capabilities.probed
+    assert capabilities.bulkUpdateHosts and capabilities.siteConnections
+    assert not capabilities.bulkCreateHosts and not capabilities.bulkDiscovery
+    assert APICapabilities.forSite(cmkAccess) is capabilities
+    assert APICapabilities.forSite(cmkAccess, probe=True) is capabilities
+    assert len([request for request in cmkServer.requests if request[1] == "/openapi-doc.json"]) == 1
+
+
+def test_probe_without_spec_keeps_version_flags(cmkServer, cmkAccess):
+    capabilities=APICapabilities.forSite(cmkAccess, probe=True)
+    assert capabilities.probed
+    assert capabilities.to_dict() == dict(APICapabilities.fromVersion(cmkAccess.version).to_dict(), probed=True)
+
+
+def createdHosts(body):
+    entries=json.loads(body)["entries"]
+    return (200, {"value": [{"id": entry["host_name"], "extensions": {"folder": entry["folder"], "attributes": entry["attributes"]}} for entry in entries]}, {})
+
+
+def test_bulk_create_is_used_when_available(cmkServer, cmkAccess):
+    cmkServer.routes[("POST", APICapabilities.BULK_CREATE_HOSTS_URL)]=createdHosts
+    host_configs=HostConfig.CreateHosts(newHosts=["h1", "h2", "h3"], cmkAccess=cmkAccess, chunkSize=2)
+    assert sorted(host_configs) == ["h1", "h2", "h3"]
+    assert len([request for request in cmkServer.requests if request[1] == APICapabilities.BULK_CREATE_HOSTS_URL]) == 2
+    assert [request for request in cmkServer.requests if request[:2] == ("POST", HOSTS_URL)] == []
+
+
+def test_single_creates_without_bulk_endpoint(cmkServer, cmkAccess):
+    cmkServer.routes[("GET", "/openapi-doc.json")]=lambda body: (200, {"paths": {}}, {})
+    cmkServer.routes[("POST", HOSTS_URL)]=lambda body: (200, {"id": json.loads(body)["host_name"], "extensions": {"folder": "/", "attributes": {}}}, {})
+    APICapabilities.forSite(cmkAccess, probe=True)
+    host_configs=HostConfig.CreateHosts(newHosts=["h1", "h2"], cmkAccess=cmkAccess)
+    assert sorted(host_configs) == ["h1", "h2"]
+    assert [request for request in cmkServer.requests if request[1] == APICapabilities.BULK_CREATE_HOSTS_URL] == []
@@ -0,0 +1,68 @@
+import pytest
+
+from dwlab_cmkapi import HostConfig, HostExtensions, HostStatus, JSONCodec, RestAPIcredentials, StatusQuery, cmkSnapshotStore
+from dwlab_cmkapi import cmk_RESTAPI
+
+
+class CountingCodec(JSONCodec):
+    def __init__(self, backend=None):
+        super().__init__(backend=backend)
+        self.encoded=[]
+        self.decoded=0
+
+    def encode(self, obj, sortKeys=False):
+        self.encoded.append(obj)
+        return super().encode(obj, sortKeys=sortKeys)
+
+    def decode(self, data):
+        self.decoded+=1
+        return super().decode(data)
+
+
+def test_stdlib_backend_round_trips_bytes():
+    codec=JSONCodec(backend="json")
+    data=codec.encode({"b": 1, "a": ["x", None]}, sortKeys=True)
+    assert data == b'{"a":["x",null],"b":1}'
+    assert codec.decode(data) == {"a": ["x", None], "b": 1}
+    assert codec.decode(data.decode("utf-8")) == {"a": ["x", None], "b": 1}
+
+
+def test_unknown_or_missing_backend_is_rejected(monkeypatch):
+    with pytest.raises(ValueError):
+        JSONCodec(backend="yaml")
+    monkeypatch.setattr(cmk_RESTAPI, "orjson", None)
+    assert JSONCodec().backend == "json"
+    with pytest.raises(ValueError):
+        JSONCodec(backend="orjson")
+
+
+def test_orjson_backend_matches_stdlib():
+    pytest.importorskip("orjson")
+    dataDict={"b": 1, "a": {"d": [1.5, True], "c": "x"}}
+    assert JSONCodec(backend="orjson").encode(dataDict, sortKeys=True) == JSONCodec(backend="json").encode(dataDict, sortKeys=True)
+
+
+def test_request_bodies_and_responses_go_through_the_codec(cmkServer):
+    codec=CountingCodec(backend="json")
+    cmkAccess=RestAPIcredentials(cmkHostname="cmk", cmkDomain="example.com", cmkSiteName="central", credentials="Bearer automation secret", codec=codec)
+    cmkServer.routes[("POST", "/domain-types/host/collections/all")]=lambda body: (200, {"value": [{"extensions": {"name": "h1", "state": 0}}]}, {})
+    query=StatusQuery.equals("name", "h"*HostStatus.MAX_QUERY_LENGTH)
+    rows=HostStatus.Query(query=query, cmkAccess=cmkAccess)
+    assert rows == [{"name": "h1", "state": 0}]
+    # The query is encoded to measure it and the payload once for the body
+    assert codec.encoded[0] == query.to_dict()
+    assert codec.encoded[1]["query"] == query.to_dict()
+    assert cmkServer.requests[-1][2] == codec.encode(codec.encoded[1])
+    # /version and the status response
+    assert codec.decoded == 2
+
+
+def test_snapshot_store_uses_the_given_codec(tmp_path):
+    with pytest.raises(TypeError):
+        cmkSnapshotStore(path=tmp_path/"snapshot.db", codec="json")
+    codec=CountingCodec(backend="json")
+    with cmkSnapshotStore(path=tmp_path/"snapshot.db", codec=codec) as store:
+        store.saveHosts([HostConfig(id="web1", extensions=HostExtensions(folder="/", attributes={"alias": "Web"}))])
+        decoded=codec.decoded
+        assert store.getHost("web1").extensions.attributes == {"alias": "Web"}
+        assert codec.decoded == decoded+1
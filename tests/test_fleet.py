@@ -0,0 +1,51 @@
+from dwlab_cmkapi import cmkSiteFleet
+
+HOSTS_URL="/domain-types/host_config/collections/all"
+
+
+def version(site, checkmk):
+    return lambda body: (200, {
+        "site": site,
+        "group": "",
+        "rest_api": {"revision": "0"},
+        "versions": {"checkmk": checkmk},
+        "edition": "cre",
+        "demo": False
+    }, {})
+
+
+def hosts(*hostNames):
+    return lambda body: (200, {"value": [{"id": hostName, "extensions": {"folder": "/", "attributes": {}}} for hostName in hostNames]}, {})
+
+
+def credentials(siteName):
+    return {"cmkHostname": "cmk", "cmkDomain": "example.com", "cmkSiteName": siteName, "credentials": "Bearer automation secret"}
+
+
+def test_sites_keep_their_own_version(cmkServer):
+    cmkServer.routes[("GET", "/version", "remote1")]=version("remote1", "2.2.0p5")
+    cmkServer.routes[("GET", "/version", "dead")]=lambda body: (500, {"title": "Internal Server Error"}, {})
+    fleet=cmkSiteFleet.fromCredentials({siteName: credentials(siteName) for siteName in ["central", "remote1", "dead"]})
+
+    assert sorted(fleet.siteNames) == ["central", "remote1"]
+    versions=fleet.getVersions()
+    assert versions.ok
+    assert versions["central"].checkmk_version == "2.3.0p1"
+    assert versions["remote1"].checkmk_version == "2.2.0p5"
+
+
+def test_queries_run_on_every_site(cmkServer):
+    cmkServer.routes[("GET", HOSTS_URL, "central")]=hosts("c1", "c2")
+    cmkServer.routes[("GET", HOSTS_URL, "remote1")]=hosts("r1")
+    cmkServer.routes[("GET", HOSTS_URL, "remote2")]=lambda body: (500, {"title": "Internal Server Error"}, {})
+    fleet=cmkSiteFleet.fromCredentials({siteName: credentials(siteName) for siteName in ["central", "remote1", "remote2"]})
+
+    result=fleet.getHostLists()
+    assert not result.ok
+    assert sorted(result) == ["central", "remote1"]
+    assert [host_config.id for host_config in result["central"]] == ["c1", "c2"]
+    assert [host_config.id for host_config in result["remote1"]] == ["r1"]
+    assert isinstance(result.errors["remote2"], RuntimeError)
+
+    selected=fleet.getHostLists(sites=["remote1"])
+    assert list(selected) == ["remote1"]
@@ -0,0 +1,56 @@
+from dwlab_cmkapi import FolderConfig, FolderExtensions, HostConfig, HostExtensions, cmkFolderTree
+
+
+def folder(path, title=""):
+    return FolderConfig(id=path.replace("/", "~"), title=title, extensions=FolderExtensions(path=path))
+
+
+def host(name, path):
+    return HostConfig(id=name, extensions=HostExtensions(folder=path))
+
+
+def tree():
+    return cmkFolderTree(
+        folderConfigs=[folder("/", "Main"), folder("/web", "Web"), folder("/web/prod"), folder("/web/test"), folder("/db")],
+        hostConfigs=[host("w1", "/web"), host("p2", "/web/prod"), host("p1", "~web~prod"), host("t1", "/web/test"), host("d1", "/db"), host("r1", "/")]
+    )
+
+
+def test_hosts_in_folder_and_below():
+    folderTree=tree()
+    assert folderTree.hostsIn("/") == ["r1", "d1", "w1", "p1", "p2", "t1"]
+    assert folderTree.hostsIn("/web") == ["w1", "p1", "p2", "t1"]
+    assert folderTree.hostsIn("~web", recursive=False) == ["w1"]
+    assert folderTree.hostsIn("/web/prod") == ["p1", "p2"]
+    assert folderTree.hostCount("/web") == 4
+    assert folderTree.folderOf("p1") == "/web/prod"
+    assert folderTree.hostConfig("t1").id == "t1"
+
+
+def test_path_index():
+    folderTree=tree()
+    assert folderTree.paths == ["/", "/db", "/web", "/web/prod", "/web/test"]
+    assert list(folderTree.walk("/web")) == ["/web", "/web/prod", "/web/test"]
+    assert [child.title for child in folderTree.children("/")] == ["", "Web"]
+    assert folderTree.parent("/web/prod").title == "Web"
+    assert folderTree.parent("/") is None
+    assert "~web~test" in folderTree and "/web/stage" not in folderTree
+
+
+def test_missing_parents_are_synthesized_with_their_path():
+    folderTree=cmkFolderTree(folderConfigs=[folder("/a/b/c")], hostConfigs=[host("h1", "/a/b/c")])
+    assert folderTree.paths == ["/", "/a", "/a/b", "/a/b/c"]
+    synthesized=folderTree.folder("/a/b")
+    assert synthesized.id == "~a~b"
+    assert synthesized.title == "b"
+    assert synthesized.extensions.path == "/a/b"
+    assert folderTree.folder("/").title == "Main"
+    assert folderTree.hostsIn("/a") == ["h1"]
+
+
+def test_deep_trees_are_indexed_without_recursion():
+    path="/"+"/".join("f"+str(depth) for depth in range(3000))
+    folderTree=cmkFolderTree(folderConfigs=[folder(path)], hostConfigs=[host("deep", path)])
+    assert len(folderTree) == 3001
+    assert folderTree.hostsIn("/") == ["deep"]
+    assert folderTree.hostsIn("/f0/f1", recursive=False) == []
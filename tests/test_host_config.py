@@ -0,0 +1,122 @@
+import json
+
+import pytest
+
+from dwlab_cmkapi import APICapabilities, BulkOperationError, ConcurrentModificationError, HostConfig, HostExtensions
+
+HOST_URL="/objects/host_config/web1"
+MOVE_URL=HOST_URL+"/actions/move/invoke"
+
+
+@pytest.fixture(autouse=True)
+def emptyCache(monkeypatch):
+    monkeypatch.setattr(APICapabilities, "_cache", {})
+
+
+def hostDict(**attributes):
+    return {"id": "web1", "domainType": "host_config", "extensions": {"folder": "/", "attributes": attributes}}
+
+
+def hostConfig(etag='"v1"', **attributes):
+    return HostConfig(id="web1", etag=etag, extensions=HostExtensions(folder="/", attributes=attributes))
+
+
+def requestsTo(cmkServer, method, path=HOST_URL):
+    return [index for index, request in enumerate(cmkServer.requests) if request[:2] == (method, path)]
+
+
+def routeUpdate(cmkServer, statuses):
+    # Answers the PUTs with the given statuses in turn, then with 200
+    statuses=list(statuses)
+    def update(body):
+        status=statuses.pop(0) if len(statuses) > 0 else 200
+        if status == 412:
+            return (412, {"title": "Precondition Failed"}, {})
+        return (200, hostDict(alias=json.loads(body)["update_attributes"]["alias"], tag_env="prod"), {"ETag": '"v3"'})
+    cmkServer.routes[("PUT", HOST_URL)]=update
+    cmkServer.routes[("GET", HOST_URL)]=lambda body: (200, hostDict(tag_env="prod"), {"ETag": '"v2"'})
+
+
+def test_update_carries_the_known_etag(cmkServer, cmkAccess):
+    routeUpdate(cmkServer, [])
+    host_config=hostConfig().updateAttributes(attributes={"alias": "Web"}, cmkAccess=cmkAccess)
+    assert requestsTo(cmkServer, "GET") == []
+    assert cmkServer.requestHeaders[requestsTo(cmkServer, "PUT")[0]]["If-Match"] == '"v1"'
+    assert host_config.etag == '"v3"'
+    assert host_config.extensions.attributes == {"alias": "Web", "tag_env": "prod"}
+
+
+def test_host_without_etag_is_read_first(cmkServer, cmkAccess):
+    routeUpdate(cmkServer, [])
+    hostConfig(etag="").updateAttributes(attributes={"alias": "Web"}, cmkAccess=cmkAccess)
+    assert requestsTo(cmkServer, "GET")[0] < requestsTo(cmkServer, "PUT")[0]
+    assert cmkServer.requestHeaders[requestsTo(cmkServer, "PUT")[0]]["If-Match"] == '"v2"'
+
+
+def test_concurrent_change_is_reread_and_reapplied(cmkServer, cmkAccess):
+    routeUpdate(cmkServer, [412])
+    host_config=hostConfig().updateAttributes(attributes={"alias": "Web"}, cmkAccess=cmkAccess)
+    puts=requestsTo(cmkServer, "PUT")
+    assert [cmkServer.requestHeaders[index]["If-Match"] for index in puts] == ['"v1"', '"v2"']
+    assert [json.loads(cmkServer.requests[index][2]) for index in puts] == [{"update_attributes": {"alias": "Web"}}]*2
+    assert host_config.etag == '"v3"'
+
+
+def test_update_gives_up_after_retries(cmkServer, cmkAccess):
+    routeUpdate(cmkServer, [412]*3)
+    with pytest.raises(ConcurrentModificationError):
+        hostConfig().updateHost(update_attributes={"alias": "Web"}, cmkAccess=cmkAccess, retries=2)
+    assert len(requestsTo(cmkServer, "PUT")) == 3
+
+
+def test_move_invokes_the_move_action_with_the_folder_id(cmkServer, cmkAccess):
+    cmkServer.routes[("POST", MOVE_URL)]=lambda body: (200, dict(hostDict(), extensions={"folder": "/web/prod", "attributes": {}}), {"ETag": '"v2"'})
+    host_config=hostConfig().moveHost(targetFolder="/web/prod", cmkAccess=cmkAccess)
+    assert json.loads(cmkServer.requests[-1][2]) == {"target_folder": "~web~prod"}
+    assert cmkServer.requestHeaders[-1]["If-Match"] == '"v1"'
+    assert host_config.extensions.folder == "/web/prod"
+    assert host_config.etag == '"v2"'
+
+
+def test_delete_reports_missing_hosts(cmkServer, cmkAccess):
+    cmkServer.routes[("DELETE", HOST_URL)]=lambda body: (204, None, {})
+    assert hostConfig().deleteHost(cmkAccess=cmkAccess)
+    assert cmkServer.requestHeaders[-1]["If-Match"] == '"v1"'
+    cmkServer.routes[("DELETE", HOST_URL)]=lambda body: (404, {"title": "Not Found"}, {})
+    assert not hostConfig(etag="").deleteHost(cmkAccess=cmkAccess)
+    assert "If-Match" not in cmkServer.requestHeaders[-1]
+
+
+def test_bulk_delete_is_chunked_and_keeps_partial_results(cmkServer, cmkAccess):
+    chunks=[]
+    def bulkDelete(body):
+        chunks.append(json.loads(body)["entries"])
+        return (204, None, {}) if len(chunks) < 3 else (500, {"title": "Internal Server Error"}, {})
+    cmkServer.routes[("POST", APICapabilities.BULK_DELETE_HOSTS_URL)]=bulkDelete
+    assert HostConfig.BulkDeleteHosts(hostNames=["h1", "h2", "h3", "h4"], cmkAccess=cmkAccess, chunkSize=2) == ["h1", "h2", "h3", "h4"]
+    assert chunks == [["h1", "h2"], ["h3", "h4"]]
+    with pytest.raises(BulkOperationError) as excinfo:
+        HostConfig.BulkDeleteHosts(hostNames=["h5", "h6", "h7"], cmkAccess=cmkAccess, chunkSize=2)
+    assert sorted(excinfo.value.results) == []
+    assert sorted(excinfo.value.errors) == ["h5", "h6"]
+
+
+def test_bulk_delete_falls_back_to_single_deletes(cmkServer, cmkAccess):
+    cmkServer.routes[("GET", "/openapi-doc.json")]=lambda body: (200, {"paths": {}}, {})
+    APICapabilities.forSite(cmkAccess, probe=True)
+    for hostName in ["h1", "h2"]:
+        cmkServer.routes[("DELETE", "/objects/host_config/"+hostName)]=lambda body: (204, None, {})
+    assert HostConfig.BulkDeleteHosts(hostNames=["h1", "h2", "h3"], cmkAccess=cmkAccess) == ["h1", "h2"]
+    assert [request for request in cmkServer.requests if request[1] == APICapabilities.BULK_DELETE_HOSTS_URL] == []
+
+
+def test_bulk_update_is_chunked(cmkServer, cmkAccess):
+    def bulkUpdate(body):
+        entries=json.loads(body)["entries"]
+        return (200, {"value": [{"id": entry["host_name"], "extensions": {"folder": "/", "attributes": entry["update_attributes"]}} for entry in entries]}, {})
+    cmkServer.routes[("POST", APICapabilities.BULK_UPDATE_HOSTS_URL)]=bulkUpdate
+    updates=[{"host_name": "h"+str(index), "update_attributes": {"alias": str(index)}} for index in range(5)]
+    host_configs=HostConfig.BulkUpdateHosts(updates=updates, cmkAccess=cmkAccess, chunkSize=2)
+    assert sorted(host_configs) == ["h0", "h1", "h2", "h3", "h4"]
+    assert host_configs["h3"].extensions.attributes == {"alias": "3"}
+    assert len([request for request in cmkServer.requests if request[1] == APICapabilities.BULK_UPDATE_HOSTS_URL]) == 3
@@ -0,0 +1,70 @@
+import pytest
+
+from dwlab_cmkapi import cmkJobTracker
+
+DISCOVERY_URL="/objects/service_discovery_run/host1"
+
+
+def discoveryStatus(active):
+    return {"id": "host1", "domainType": "service_discovery_run", "extensions": {"active": active, "state": "running" if active else "finished"}}
+
+
+def routeDiscovery(cmkServer, responses):
+    # Answers the status reads with the given (status, active) pairs, the
+    # last one repeated
+    def status(body):
+        statusCode, active=responses[0] if len(responses) == 1 else responses.pop(0)
+        return (statusCode, discoveryStatus(active) if statusCode == 200 else {"title": "Error"}, {})
+    cmkServer.routes[("GET", DISCOVERY_URL)]=status
+
+
+def statusReads(cmkServer):
+    return [request for request in cmkServer.requests if request[:2] == ("GET", DISCOVERY_URL)]
+
+
+def test_job_finishes(cmkServer, cmkAccess):
+    routeDiscovery(cmkServer, [(200, True), (200, False)])
+    tracker=cmkJobTracker(cmkAccess=cmkAccess, interval=0.01, maxInterval=0.05)
+    job=tracker.trackDiscovery("host1").result(timeout=5)
+    assert not job.active
+    assert len(statusReads(cmkServer)) == 2
+    assert tracker.pending == 0
+
+
+def test_failed_reads_are_retried(cmkServer, cmkAccess):
+    routeDiscovery(cmkServer, [(500, None), (500, None), (200, False)])
+    tracker=cmkJobTracker(cmkAccess=cmkAccess, interval=0.01, maxInterval=0.05, retries=3)
+    job=tracker.trackDiscovery("host1").result(timeout=5)
+    assert not job.active
+    assert len(statusReads(cmkServer)) == 3
+
+
+def test_persistent_read_failure_fails_future(cmkServer, cmkAccess):
+    routeDiscovery(cmkServer, [(500, None)])
+    tracker=cmkJobTracker(cmkAccess=cmkAccess, interval=0.01, maxInterval=0.05, retries=2)
+    with pytest.raises(RuntimeError):
+        tracker.trackDiscovery("host1").result(timeout=5)
+    assert len(statusReads(cmkServer)) == 3
+
+
+def test_update_error_fails_future(monkeypatch, cmkServer, cmkAccess):
+    routeDiscovery(cmkServer, [(200, True)])
+    tracker=cmkJobTracker(cmkAccess=cmkAccess, interval=0.01)
+    def update(tracked, job):
+        raise KeyError("extensions")
+    monkeypatch.setattr(tracker, "_update", update)
+    with pytest.raises(KeyError):
+        tracker.trackDiscovery("host1").result(timeout=5)
+    assert tracker.pending == 0
+
+
+def test_poll_error_fails_futures_and_tracker_recovers(monkeypatch, cmkServer, cmkAccess):
+    routeDiscovery(cmkServer, [(200, False)])
+    tracker=cmkJobTracker(cmkAccess=cmkAccess, interval=0.01)
+    def poll(due):
+        raise ValueError("broken round")
+    monkeypatch.setattr(tracker, "_poll", poll)
+    with pytest.raises(ValueError):
+        tracker.trackDiscovery("host1").result(timeout=5)
+    monkeypatch.delattr(tracker, "_poll")
+    assert not tracker.trackDiscovery("host1").result(timeout=5).active
@@ -0,0 +1,102 @@
+import time
+
+import pytest
+import requests
+
+from dwlab_cmkapi import AdaptiveLimiter
+
+
+def test_limiter_increases_on_stable_latency():
+    limiter=AdaptiveLimiter(initialLimit=4, maxLimit=6, windowSize=5)
+    for _ in range(4):
+        limiter.record(0.1)
+    assert limiter.limit == 4
+    limiter.record(0.1)
+    assert limiter.limit == 5
+    assert limiter.p95 == pytest.approx(0.1)
+    # A new window has to be collected before the next change
+    for _ in range(4):
+        limiter.record(0.1)
+    assert limiter.limit == 5
+    limiter.record(0.1)
+    assert limiter.limit == 6
+    for _ in range(5):
+        limiter.record(0.1)
+    assert limiter.limit == 6
+
+
+def test_limiter_decreases_on_latency_rise():
+    limiter=AdaptiveLimiter(initialLimit=8, windowSize=5, latencyTolerance=1.5, backoffFactor=0.5)
+    for _ in range(5):
+        limiter.record(0.1)
+    assert limiter.limit == 9
+    for _ in range(5):
+        limiter.record(1.0)
+    assert limiter.limit == 4
+    assert limiter.metrics()["decreases"] == 1
+
+
+def test_limiter_decreases_once_per_generation():
+    limiter=AdaptiveLimiter(initialLimit=8, minLimit=1, backoffFactor=0.5)
+    for _ in range(7):
+        limiter.record(0.1, statusCode=429)
+    assert limiter.limit == 8
+    limiter.record(0.1, statusCode=503)
+    assert limiter.limit == 4
+    for _ in range(3):
+        limiter.record(0.1, timedOut=True)
+    assert limiter.limit == 4
+    limiter.record(0.1, failed=True)
+    assert limiter.limit == 2
+    metrics=limiter.metrics()
+    assert metrics["errors"] == 12
+    assert metrics["decreases"] == 2
+
+
+def test_limiter_respects_min_limit():
+    limiter=AdaptiveLimiter(initialLimit=1, minLimit=1)
+    for _ in range(3):
+        limiter.record(0.1, timedOut=True)
+    assert limiter.limit == 1
+    assert limiter.metrics()["decreases"] == 0
+
+
+def test_limiter_map_keeps_order_and_errors():
+    limiter=AdaptiveLimiter(initialLimit=2)
+    def square(value):
+        if value == 3:
+            raise ValueError("three")
+        return value*value
+    results=limiter.map(square, range(5))
+    assert [item for item, result, error in results] == [0, 1, 2, 3, 4]
+    assert [result for item, result, error in results] == [0, 1, 4, None, 16]
+    assert isinstance(results[3][2], ValueError)
+    assert limiter.inFlight == 0
+
+
+def test_timeouts_and_connection_errors_are_recorded(cmkServer, cmkAccess, monkeypatch):
+    def slow(body):
+        time.sleep(0.5)
+        return (200, {}, {})
+    cmkServer.routes[("GET", "/slow")]=slow
+    errors=cmkAccess.adaptiveLimiter.metrics()["errors"]
+    with pytest.raises(requests.Timeout):
+        cmkAccess.apiRequest("GET", "/slow", timeout=(1, 0.1))
+    assert cmkAccess.adaptiveLimiter.metrics()["errors"] == errors+1
+
+    # Nothing listens on port 1
+    monkeypatch.setattr(type(cmkAccess), "get_apiUrl", lambda self, apiVersion="": "http://127.0.0.1:1/central/check_mk/api/1.0")
+    with pytest.raises(requests.ConnectionError):
+        cmkAccess.apiRequest("GET", "/version")
+    assert cmkAccess.adaptiveLimiter.metrics()["errors"] == errors+2
+
+
+def test_default_timeout(cmkServer, cmkAccess, monkeypatch):
+    sent={}
+    request=requests.Session.request
+    def recordingRequest(session, method, url, **kwargs):
+        sent.update(kwargs)
+        return request(session, method, url, **kwargs)
+    monkeypatch.setattr(requests.Session, "request", recordingRequest)
+    cmkAccess.apiRequest("GET", "/version")
+    assert sent["timeout"] == cmkAccess.timeout
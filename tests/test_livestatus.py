@@ -0,0 +1,190 @@
+import time
+
+import pytest
+
+from dwlab_cmkapi import (
+    LivestatusError,
+    StatusQuery,
+    cmkLivestatusConnection,
+    cmkLivestatusMultisite,
+    cmkLivestatusPool,
+    cmkLivestatusQuery,
+)
+
+
+def connectionArguments(server, **kwargs):
+    arguments={"socketType": "tcp", "host": "127.0.0.1", "port": server.port}
+    arguments.update(kwargs)
+    return arguments
+
+
+def test_query_lql():
+    query=cmkLivestatusQuery("services").columns("host_name", "state").filter("state", "=", 2).limit(10)
+    assert query.to_lql(keepAlive=True) == (
+        "GET services\n"
+        "Columns: host_name state\n"
+        "Filter: state = 2\n"
+        "Limit: 10\n"
+        "OutputFormat: json\n"
+        "ResponseHeader: fixed16\n"
+        "KeepAlive: on\n\n"
+    )
+
+
+def test_fixed16_response(livestatusServer):
+    connection=cmkLivestatusConnection(**connectionArguments(livestatusServer))
+    rows=connection.query(cmkLivestatusQuery("services").columns("host_name", "description", "state"))
+    assert rows == [
+        {"host_name": "h1", "description": "CPU", "state": 2},
+        {"host_name": "h2", "description": "Disk", "state": 0},
+    ]
+    assert livestatusServer.queries[0][-1] == "ResponseHeader: fixed16"
+    assert not connection.connected
+
+
+def test_error_status(livestatusServer):
+    connection=cmkLivestatusConnection(**connectionArguments(livestatusServer))
+    with pytest.raises(LivestatusError) as excinfo:
+        connection.execute(cmkLivestatusQuery("missing").to_lql())
+    assert excinfo.value.statusCode == 404
+    assert "missing" in str(excinfo.value)
+
+
+def test_keepalive_reuses_socket(livestatusServer):
+    with cmkLivestatusConnection(**connectionArguments(livestatusServer, keepAlive=True)) as connection:
+        for _ in range(3):
+            connection.query(cmkLivestatusQuery("services").columns("host_name", "description", "state"))
+        assert connection.connected
+    assert livestatusServer.connections == 1
+    assert len(livestatusServer.queries) == 3
+
+
+def test_pool_reuses_connections(livestatusServer):
+    with cmkLivestatusPool(connectionArguments=connectionArguments(livestatusServer), persistent=True, channels=2) as pool:
+        for _ in range(5):
+            pool.query(cmkLivestatusQuery("services").columns("host_name", "description", "state"))
+        metrics=pool.metrics()
+    assert metrics["queries"] == 5
+    assert metrics["connects"] == 1
+    assert livestatusServer.connections == 1
+
+
+def test_pool_reconnects_closed_connection(livestatusServer):
+    query=cmkLivestatusQuery("services").columns("host_name", "description", "state")
+    with cmkLivestatusPool(connectionArguments=connectionArguments(livestatusServer), persistent=True, channels=1) as pool:
+        pool.query(query)
+        livestatusServer.dropConnections()
+        rows=pool.query(query)
+        metrics=pool.metrics()
+    assert len(rows) == 2
+    assert metrics["reconnects"] == 1
+    assert livestatusServer.connections == 2
+
+
+def test_pool_channel_timeout(livestatusServer):
+    with cmkLivestatusPool(connectionArguments=connectionArguments(livestatusServer), channels=1, channelTimeout=0.1) as pool:
+        with pool.connection():
+            with pytest.raises(LivestatusError):
+                with pool.connection():
+                    pass
+        assert pool.metrics()["channelTimeouts"] == 1
+
+
+def test_pool_connect_retry():
+    # Nothing listens on port 1, the second attempt is not even tried
+    with cmkLivestatusPool(connectionArguments={"host": "127.0.0.1", "port": 1}, persistent=False, connectRetry=60) as pool:
+        with pytest.raises(OSError):
+            pool.query(cmkLivestatusQuery("hosts"))
+        with pytest.raises(LivestatusError):
+            pool.query(cmkLivestatusQuery("hosts"))
+        assert pool.metrics()["connectFailures"] == 1
+
+
+def test_line_breaks_are_rejected():
+    with pytest.raises(ValueError):
+        cmkLivestatusQuery("hosts").filter("name", "=", "h1\nColumns: name")
+    with pytest.raises(ValueError):
+        cmkLivestatusQuery("hosts").columns("name\r")
+    with pytest.raises(ValueError):
+        cmkLivestatusQuery("hosts").stats("state = 2\n")
+    with pytest.raises(ValueError):
+        cmkLivestatusQuery("hosts").filter(StatusQuery.equals("name", "h1\n"))
+    with pytest.raises(ValueError):
+        cmkLivestatusConnection(host="127.0.0.1").command("SCHEDULE_FORCED_HOST_CHECK;h1;0\n\nGET hosts")
+
+
+def test_injected_request_does_not_reach_a_pooled_connection(livestatusServer):
+    query=cmkLivestatusQuery("services").columns("host_name", "description", "state")
+    with cmkLivestatusPool(connectionArguments=connectionArguments(livestatusServer), persistent=True, channels=1) as pool:
+        pool.query(query)
+        with pytest.raises(ValueError):
+            pool.query(cmkLivestatusQuery("services").columns("host_name").filter("host_name", "=", "h1\n\nGET status\nColumns: program_start"))
+        rows=pool.query(query)
+    assert rows[0] == {"host_name": "h1", "description": "CPU", "state": 2}
+    assert [lines[0] for lines in livestatusServer.queries] == ["GET services", "GET services"]
+
+
+def test_pool_heartbeat_drops_dead_connections(livestatusServer):
+    with cmkLivestatusPool(connectionArguments=connectionArguments(livestatusServer), persistent=True, channels=1, heartbeatInterval=0.05) as pool:
+        pool.query(cmkLivestatusQuery("services").columns("host_name"))
+        time.sleep(0.3)
+        assert any(query[0] == "GET status" for query in livestatusServer.queries)
+        assert pool.metrics()["idle"] == 1
+        livestatusServer.dropConnections()
+        time.sleep(0.3)
+        metrics=pool.metrics()
+    assert metrics["heartbeatFailures"] == 1
+    assert metrics["idle"] == 0
+
+
+def test_pool_heartbeat_holds_a_channel(livestatusServer, monkeypatch):
+    execute=cmkLivestatusConnection.execute
+    def slowExecute(self, lql, timeout=None):
+        if lql == cmkLivestatusPool.HEARTBEAT_QUERY:
+            time.sleep(0.5)
+        return execute(self, lql, timeout=timeout)
+    monkeypatch.setattr(cmkLivestatusConnection, "execute", slowExecute)
+    query=cmkLivestatusQuery("services").columns("host_name")
+    with cmkLivestatusPool(connectionArguments=connectionArguments(livestatusServer), persistent=True, channels=1, heartbeatInterval=0.05) as pool:
+        pool.query(query)
+        time.sleep(0.2)
+        # The query waits for the checked connection instead of opening one
+        pool.query(query)
+    assert livestatusServer.connections == 1
+
+
+def test_stats_functions():
+    query=(cmkLivestatusQuery("services")
+           .stats("state", "=", 2)
+           .stats("state = 2")
+           .stats("sum latency")
+           .stats("avginv execution_time")
+           .stats("host_name ~ web"))
+    assert query.statsFunctions == ["count", "count", "sum", "avginv", "count"]
+    assert "Stats: state = 2\nStats: state = 2\nStats: sum latency\n" in query.to_lql()
+
+
+def test_merge_stats():
+    query=cmkLivestatusQuery("services").columns("state").stats("state = 2").stats("max latency").stats("min latency").stats("sum latency")
+    rows=[
+        {"state": 2, "stats_1": 3, "stats_2": 1.5, "stats_3": 1.0, "stats_4": 3.0, "site": "b"},
+        {"state": 2, "stats_1": 4, "stats_2": 0.5, "stats_3": 0.2, "stats_4": 1.0, "site": "a"},
+        {"state": 0, "stats_1": 0, "stats_2": None, "stats_3": None, "stats_4": 0, "site": "a"},
+    ]
+    merged=cmkLivestatusMultisite.mergeStats(query, rows)
+    assert merged == [
+        {"state": 2, "site": "a,b", "sites": ["a", "b"], "stats_1": 7, "stats_2": 1.5, "stats_3": 0.2, "stats_4": 4.0},
+        {"state": 0, "site": "a", "sites": ["a"], "stats_1": 0, "stats_2": None, "stats_3": None, "stats_4": 0},
+    ]
+
+
+def test_averages_are_not_merged(livestatusServer):
+    query=cmkLivestatusQuery("services").stats("avg latency").stats("std latency")
+    with pytest.raises(ValueError):
+        cmkLivestatusMultisite.mergeStats(query, [])
+    pool=cmkLivestatusPool(connectionArguments=connectionArguments(livestatusServer), persistent=False)
+    with cmkLivestatusMultisite(pools={"a": pool, "b": pool}) as multisite:
+        result=multisite.query(query)
+    pool.close()
+    assert sorted(row["site"] for row in result.rows) == ["a", "b"]
+    assert all(row["stats_1"] == 5 for row in result.rows)
\ No newline at end of file
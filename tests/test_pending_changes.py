@@ -0,0 +1,97 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+from dwlab_cmkapi import AllActivations, cmkPendingChangeEvent, cmkPendingChangesWatcher
+
+PENDING_CHANGES_URL="/domain-types/activation_run/collections/pending_changes"
+
+
+@pytest.fixture(autouse=True)
+def emptyCaches(monkeypatch):
+    monkeypatch.setattr(AllActivations, "_etags", {})
+    monkeypatch.setattr(AllActivations, "_headSupported", {})
+
+
+@pytest.fixture
+def pendingChanges(cmkServer):
+    # The site's pending changes; the ETag follows their ids
+    changes=[]
+    def etag():
+        return '"'+"-".join(change["id"] for change in changes)+'"'
+    cmkServer.routes[("GET", PENDING_CHANGES_URL)]=lambda body: (200, {"value": list(changes)}, {"ETag": etag()})
+    cmkServer.routes[("HEAD", PENDING_CHANGES_URL)]=lambda body: (200, None, {"ETag": etag()})
+    return changes
+
+
+def change(changeID, changeTime=""):
+    return {"id": changeID, "action_name": "edit-host", "text": "Modified host "+changeID, "user_id": "automation", "time": changeTime}
+
+
+def methodsOnPendingChanges(cmkServer):
+    return [request[0] for request in cmkServer.requests if request[1] == PENDING_CHANGES_URL]
+
+
+def test_only_new_and_removed_changes_are_reported(cmkServer, cmkAccess, pendingChanges):
+    pendingChanges.append(change("c1"))
+    seen=[]
+    watcher=cmkPendingChangesWatcher(cmkAccess=cmkAccess, onEvent=seen.append)
+    assert watcher.poll() == []
+    assert list(watcher.changes) == ["c1"]
+    pendingChanges[:]=[change("c2")]
+    events=watcher.poll()
+    assert [(event.kind, event.change.id) for event in events] == [
+        (cmkPendingChangeEvent.ADDED, "c2"), (cmkPendingChangeEvent.REMOVED, "c1")
+    ]
+    assert seen == events
+
+
+def test_unchanged_list_costs_only_headers(cmkServer, cmkAccess, pendingChanges):
+    pendingChanges.append(change("c1"))
+    watcher=cmkPendingChangesWatcher(cmkAccess=cmkAccess)
+    for _ in range(3):
+        watcher.poll()
+    assert methodsOnPendingChanges(cmkServer) == ["GET", "HEAD", "HEAD"]
+
+
+def test_site_without_etags_is_read_in_full(cmkServer, cmkAccess):
+    changes=[change("c1")]
+    cmkServer.routes[("GET", PENDING_CHANGES_URL)]=lambda body: (200, {"value": list(changes)}, {})
+    watcher=cmkPendingChangesWatcher(cmkAccess=cmkAccess)
+    assert watcher.poll() == []
+    changes.append(change("c2"))
+    assert [(event.kind, event.change.id) for event in watcher.poll()] == [(cmkPendingChangeEvent.ADDED, "c2")]
+    assert methodsOnPendingChanges(cmkServer) == ["GET", "GET"]
+
+
+def test_initial_changes_can_be_emitted(cmkServer, cmkAccess, pendingChanges):
+    pendingChanges.append(change("c1"))
+    watcher=cmkPendingChangesWatcher(cmkAccess=cmkAccess, emitInitial=True, attribute=lambda change: change.user_id)
+    events=watcher.poll()
+    assert [(event.kind, event.job) for event in events] == [(cmkPendingChangeEvent.ADDED, "automation")]
+
+
+def test_changes_are_attributed_to_the_job_running_at_their_time(cmkServer, cmkAccess, pendingChanges):
+    watcher=cmkPendingChangesWatcher(cmkAccess=cmkAccess)
+    watcher.poll()
+    with watcher.job("onboarding"):
+        onboarded=datetime.now(timezone.utc).isoformat()
+        time.sleep(0.01)
+    with watcher.job("offboarding"):
+        time.sleep(0.01)
+        # No parsable time: attributed to the jobs open since the last poll
+        pendingChanges[:]=[change("c1", onboarded), change("c2")]
+    events={event.change.id: event.job for event in watcher.poll()}
+    assert events == {"c1": "onboarding", "c2": "offboarding"}
+
+
+def test_watch_and_stream_stop_after_max_polls(cmkServer, cmkAccess, pendingChanges):
+    watcher=cmkPendingChangesWatcher(cmkAccess=cmkAccess, interval=0, emitInitial=True)
+    pendingChanges.append(change("c1"))
+    assert [event.change.id for event in watcher.watch(maxPolls=2)] == ["c1"]
+    pendingChanges.append(change("c2"))
+    async def collect():
+        return [event.change.id async for event in watcher.stream(maxPolls=2)]
+    assert asyncio.run(collect()) == ["c2"]
@@ -0,0 +1,95 @@
+import json
+
+import pytest
+
+from dwlab_cmkapi import AllActivations, APICapabilities, cmkDesiredState, cmkReconciler
+
+HOSTS_URL="/domain-types/host_config/collections/all"
+ACTIVATE_URL="/domain-types/activation_run/actions/activate-changes/invoke"
+
+
+@pytest.fixture(autouse=True)
+def emptyCaches(monkeypatch):
+    monkeypatch.setattr(AllActivations, "_etags", {})
+    monkeypatch.setattr(APICapabilities, "_cache", {})
+
+
+def routeHosts(cmkServer, *hosts):
+    value=[{"id": hostName, "extensions": {"folder": folder, "attributes": attributes}} for hostName, folder, attributes in hosts]
+    cmkServer.routes[("GET", HOSTS_URL)]=lambda body: (200, {"value": value}, {})
+
+
+def routeWrites(cmkServer):
+    def createdHosts(body):
+        entries=json.loads(body)["entries"]
+        return (200, {"value": [{"id": entry["host_name"], "extensions": {"folder": entry["folder"], "attributes": entry["attributes"]}} for entry in entries]}, {})
+    cmkServer.routes[("POST", APICapabilities.BULK_CREATE_HOSTS_URL)]=createdHosts
+    cmkServer.routes[("POST", APICapabilities.BULK_UPDATE_HOSTS_URL)]=lambda body: (200, {"value": []}, {})
+    cmkServer.routes[("POST", APICapabilities.BULK_DISCOVERY_URL)]=lambda body: (200, {"id": "bulk1", "domainType": "discovery_run", "extensions": {"active": True}}, {})
+    cmkServer.routes[("HEAD", AllActivations.PENDING_CHANGES_URL)]=lambda body: (200, None, {"ETag": '"pending"'})
+    cmkServer.routes[("POST", ACTIVATE_URL)]=lambda body: (204, None, {})
+
+
+def writes(cmkServer):
+    return [request[:2] for request in cmkServer.requests if request[0] in ["POST", "PUT", "DELETE"]]
+
+
+def test_unchanged_state_writes_nothing(cmkServer, cmkAccess):
+    routeHosts(cmkServer, ("web1", "/web", {"alias": "Web"}))
+    desiredState=cmkDesiredState()
+    desiredState.addHost(hostName="web1", folder="~web", attributes={"alias": "Web"})
+    plan=cmkReconciler(cmkAccess=cmkAccess).reconcile(desiredState=desiredState)
+    assert plan.isEmpty
+    assert writes(cmkServer) == []
+    # /version and the one host collection call
+    assert len(cmkServer.requests) == 2
+
+
+def test_differences_are_planned_and_applied_in_bulk(cmkServer, cmkAccess):
+    routeHosts(cmkServer, ("web1", "/", {"alias": "Old"}))
+    routeWrites(cmkServer)
+    desiredState=cmkDesiredState()
+    desiredState.addHost(hostName="web1", folder="/", attributes={"alias": "Web"})
+    desiredState.addHost(hostName="db1")
+    desiredState.addHost(hostName="db2")
+    plan=cmkReconciler(cmkAccess=cmkAccess).reconcile(desiredState=desiredState)
+    assert plan.to_dict()["hostsToCreate"] == ["db1", "db2"]
+    assert plan.to_dict()["hostsToUpdate"] == ["web1"]
+    assert writes(cmkServer) == [
+        ("POST", APICapabilities.BULK_CREATE_HOSTS_URL),
+        ("POST", APICapabilities.BULK_UPDATE_HOSTS_URL),
+        ("POST", ACTIVATE_URL)
+    ]
+
+
+def test_new_hosts_are_discovered_after_the_activation(cmkServer, cmkAccess):
+    routeHosts(cmkServer)
+    routeWrites(cmkServer)
+    desiredState=cmkDesiredState()
+    desiredState.addHost(hostName="db1")
+    cmkReconciler(cmkAccess=cmkAccess).reconcile(desiredState=desiredState, discoverNewHosts=True)
+    assert writes(cmkServer) == [
+        ("POST", APICapabilities.BULK_CREATE_HOSTS_URL),
+        ("POST", ACTIVATE_URL),
+        ("POST", APICapabilities.BULK_DISCOVERY_URL),
+        ("POST", ACTIVATE_URL)
+    ]
+
+
+def test_second_activation_waits_for_the_discovery_job(cmkServer, cmkAccess):
+    routeHosts(cmkServer)
+    routeWrites(cmkServer)
+    # The bulk discovery is still running on the first two status reads
+    statusReads=[]
+    def discoveryStatus(body):
+        statusReads.append(len(cmkServer.requests)-1)
+        return (200, {"id": "bulk1", "domainType": "discovery_run", "extensions": {"active": len(statusReads) < 3}}, {})
+    cmkServer.routes[("GET", "/objects/discovery_run/bulk1")]=discoveryStatus
+    desiredState=cmkDesiredState()
+    desiredState.addHost(hostName="db1")
+    cmkReconciler(cmkAccess=cmkAccess, pollInterval=0).reconcile(desiredState=desiredState, discoverNewHosts=True)
+    requests=[request[:2] for request in cmkServer.requests]
+    activations=[index for index, request in enumerate(requests) if request == ("POST", ACTIVATE_URL)]
+    assert len(statusReads) == 3
+    assert len(activations) == 2
+    assert activations[0] < statusReads[0] and statusReads[-1] < activations[1]
@@ -0,0 +1,94 @@
+import json
+
+import pytest
+
+from dwlab_cmkapi import RequestThrottle, RestAPIcredentials, cmkCentralSite
+
+HOST_URL="/objects/host_config/inst.net.example.com"
+HOSTS_URL="/domain-types/host_config/collections/all"
+SITE_CONNECTIONS_URL="/domain-types/site_connection/collections/all"
+SITE_CONNECTION_URL="/objects/site_connection/inst"
+ACTIVATE_URL="/domain-types/activation_run/actions/activate-changes/invoke"
+DISCOVERY_URL="/domain-types/service_discovery_run/actions/start/invoke"
+
+
+@pytest.fixture
+def centralSite(cmkServer, cmkAccess, monkeypatch):
+    monkeypatch.setitem(RestAPIcredentials._throttles, cmkAccess.siteKey, RequestThrottle(writeRate=100, writeBurst=100, expensiveRate=100, expensiveBurst=100))
+    hosts=[]
+    connections=[]
+    host={"id": "inst.net.example.com", "extensions": {"folder": "/", "attributes": {}}}
+    def createHost(body):
+        hosts.append(host)
+        return (200, host, {"ETag": '"host"'})
+    def createConnection(body):
+        siteConfig=json.loads(body)
+        connections.append(siteConfig.get("site_config", siteConfig))
+        return (200, siteConfig, {"ETag": '"connection"'})
+    cmkServer.routes.update({
+        ("GET", HOST_URL): lambda body: (200, host, {"ETag": '"host"'}) if hosts else (404, {"title": "Not found"}, {}),
+        ("POST", HOSTS_URL): createHost,
+        ("GET", SITE_CONNECTIONS_URL): lambda body: (200, {"value": [{"id": "inst", "extensions": connection} for connection in connections]}, {}),
+        ("POST", SITE_CONNECTIONS_URL): createConnection,
+        ("GET", SITE_CONNECTION_URL): lambda body: (200, {"id": "inst", "extensions": connections[0]}, {"ETag": '"connection"'}),
+        ("PUT", SITE_CONNECTION_URL): lambda body: (200, json.loads(body), {"ETag": '"connection2"'}),
+        ("HEAD", "/domain-types/activation_run/collections/pending_changes"): lambda body: (200, None, {"ETag": '"pending"'}),
+        ("POST", ACTIVATE_URL): lambda body: (204, None, {}),
+        ("POST", DISCOVERY_URL): lambda body: (200, {"id": "discovery", "extensions": {}}, {}),
+    })
+    return cmkCentralSite(
+        cmkSiteName="central", centralHostname="cmk", centralDomain="example.com",
+        ovpnNetwork="net", ovpnNetworkDomain="example.com", cmkAccess=cmkAccess
+    )
+
+
+def requestIndex(cmkServer, method, path):
+    return [index for index, request in enumerate(cmkServer.requests) if request[:2] == (method, path)]
+
+
+def test_activation_follows_all_writes(cmkServer, centralSite):
+    centralSite.catalogSite("inst")
+    activations=requestIndex(cmkServer, "POST", ACTIVATE_URL)
+    assert len(activations) == 2
+    lastWrite=max(requestIndex(cmkServer, "POST", HOSTS_URL)+requestIndex(cmkServer, "POST", SITE_CONNECTIONS_URL)+requestIndex(cmkServer, "PUT", SITE_CONNECTION_URL))
+    assert activations[0] > lastWrite
+    assert activations[0] < requestIndex(cmkServer, "POST", DISCOVERY_URL)[0] < activations[1]
+
+
+def test_failed_site_connection_is_raised_without_activation(cmkServer, centralSite):
+    cmkServer.routes[("PUT", SITE_CONNECTION_URL)]=lambda body: (500, {"title": "Internal Server Error"}, {})
+    with pytest.raises(Exception):
+        centralSite.catalogSite("inst")
+    assert requestIndex(cmkServer, "POST", ACTIVATE_URL) == []
+
+
+def test_failed_host_creates_no_site_connection(cmkServer, centralSite):
+    cmkServer.routes[("POST", HOSTS_URL)]=lambda body: (500, {"title": "Internal Server Error"}, {})
+    with pytest.raises(RuntimeError):
+        centralSite.catalogSite("inst")
+    assert requestIndex(cmkServer, "POST", SITE_CONNECTIONS_URL) == []
+    assert requestIndex(cmkServer, "POST", ACTIVATE_URL) == []
+
+
+def test_failed_activations_are_logged_once(cmkServer, centralSite, monkeypatch, caplog):
+    responses=["Done", RuntimeError()]
+    def activatePendingChanges():
+        response=responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+    monkeypatch.setattr(centralSite, "activatePendingChanges", activatePendingChanges)
+    centralSite.catalogSite("inst")
+    errors=[record for record in caplog.records if record.levelname == "ERROR"]
+    assert len(errors) == 1
+    assert errors[0].exc_info is not None
+    assert not any("activated successfully" in record.getMessage() for record in caplog.records)
+
+
+def test_host_not_activated_is_not_discovered(cmkServer, centralSite, monkeypatch, caplog):
+    def activatePendingChanges():
+        raise RuntimeError()
+    monkeypatch.setattr(centralSite, "activatePendingChanges", activatePendingChanges)
+    centralSite.catalogSite("inst")
+    assert len([record for record in caplog.records if record.levelname == "ERROR"]) == 1
+    assert requestIndex(cmkServer, "POST", DISCOVERY_URL) == []
@@ -0,0 +1,96 @@
+import json
+import logging
+
+import pytest
+
+from dwlab_cmkapi import SiteConnection, Version
+
+SITE_URL="/objects/site_connection/remote1"
+VERSION=Version(site="central", group="", rest_api={"revision": "0"}, versions={"checkmk": "2.3.0p1"}, edition="cre", demo=False)
+
+
+def siteConnectionDict(alias="Remote 1", host="10.0.0.1"):
+    site_connection=SiteConnection()
+    site_connection.id="remote1"
+    site_connection.extensions.basic_settings.site_id="remote1"
+    site_connection.extensions.basic_settings.alias=alias
+    site_connection.extensions.status_connection.connection.host=host
+    site_connection.extensions.configuration_connection.enable_replication=False
+    return site_connection.to_dict(version=VERSION)
+
+
+def readSiteConnection(etag='"v1"', **settings):
+    site_connection=SiteConnection.from_dict(dataDict=siteConnectionDict(**settings))
+    site_connection.etag=etag
+    site_connection.version=VERSION
+    return site_connection
+
+
+def puts(cmkServer):
+    return [request for request in cmkServer.requests if request[:2] == ("PUT", SITE_URL)]
+
+
+def test_unchanged_connection_is_not_written(cmkServer, cmkAccess):
+    site_connection=readSiteConnection()
+    assert site_connection.changedFields() == []
+    assert site_connection.updateSiteConnection(cmkAccess=cmkAccess) == []
+    assert puts(cmkServer) == []
+
+
+def test_only_changed_fields_are_reported(cmkServer, cmkAccess):
+    cmkServer.routes[("PUT", SITE_URL)]=lambda body: (200, json.loads(body)["site_config"], {"ETag": '"v2"'})
+    site_connection=readSiteConnection()
+    site_connection.extensions.basic_settings.alias="Remote one"
+    assert site_connection.changedFields() == ["basic_settings.alias"]
+    assert site_connection.updateSiteConnection(cmkAccess=cmkAccess) == ["basic_settings.alias"]
+    assert json.loads(puts(cmkServer)[0][2])["site_config"]["basic_settings"]["alias"] == "Remote one"
+    # The written state is the new baseline
+    assert site_connection.changedFields() == []
+    assert site_connection.updateSiteConnection(cmkAccess=cmkAccess) == []
+    assert len(puts(cmkServer)) == 1
+
+
+def test_force_writes_unchanged_connection(cmkServer, cmkAccess):
+    cmkServer.routes[("PUT", SITE_URL)]=lambda body: (200, json.loads(body)["site_config"], {"ETag": '"v2"'})
+    readSiteConnection().updateSiteConnection(cmkAccess=cmkAccess, force=True)
+    assert len(puts(cmkServer)) == 1
+
+
+def test_rejected_update_raises_runtime_error(caplog, cmkServer, cmkAccess):
+    caplog.set_level(logging.DEBUG)
+    cmkServer.routes[("PUT", SITE_URL)]=lambda body: (400, {"title": "Bad Request"}, {})
+    site_connection=readSiteConnection()
+    site_connection.extensions.basic_settings.alias="Remote one"
+    with pytest.raises(RuntimeError):
+        site_connection.updateSiteConnection(cmkAccess=cmkAccess)
+
+
+def test_concurrent_change_is_rebased(cmkServer, cmkAccess):
+    # Another client moved the status connection to a new address; the
+    # local alias change is re-applied on top of it.
+    statuses=[412]
+    def update(body):
+        if len(statuses) > 0:
+            return (statuses.pop(0), {"title": "Precondition Failed"}, {})
+        return (200, json.loads(body)["site_config"], {"ETag": '"v3"'})
+    cmkServer.routes[("PUT", SITE_URL)]=update
+    cmkServer.routes[("GET", SITE_URL)]=lambda body: (200, siteConnectionDict(host="10.0.0.2"), {"ETag": '"v2"'})
+    site_connection=readSiteConnection()
+    site_connection.extensions.basic_settings.alias="Remote one"
+    assert site_connection.updateSiteConnection(cmkAccess=cmkAccess) == ["basic_settings.alias"]
+    indexes=[index for index, request in enumerate(cmkServer.requests) if request[:2] == ("PUT", SITE_URL)]
+    assert [cmkServer.requestHeaders[index]["If-Match"] for index in indexes] == ['"v1"', '"v2"']
+    written=json.loads(cmkServer.requests[indexes[-1]][2])["site_config"]
+    assert written["basic_settings"]["alias"] == "Remote one"
+    assert written["status_connection"]["connection"]["host"] == "10.0.0.2"
+    assert site_connection.etag == '"v3"'
+
+
+def test_connection_without_etag_is_read_before_writing(cmkServer, cmkAccess):
+    cmkServer.routes[("PUT", SITE_URL)]=lambda body: (200, json.loads(body)["site_config"], {"ETag": '"v3"'})
+    cmkServer.routes[("GET", SITE_URL)]=lambda body: (200, siteConnectionDict(), {"ETag": '"v2"'})
+    site_connection=readSiteConnection(etag="")
+    site_connection.extensions.basic_settings.alias="Remote one"
+    site_connection.updateSiteConnection(cmkAccess=cmkAccess)
+    assert [request[0] for request in cmkServer.requests if request[1] == SITE_URL] == ["GET", "PUT"]
+    assert cmkServer.requestHeaders[-1]["If-Match"] == '"v2"'
@@ -0,0 +1,47 @@
+from dwlab_cmkapi import SiteAllConnections, SiteConnection, Version
+
+SITE_CONNECTIONS_URL="/domain-types/site_connection/collections/all"
+
+
+def siteConnection(siteID, **connection):
+    site_connection=SiteConnection()
+    site_connection.id=siteID
+    site_connection.extensions.basic_settings.site_id=siteID
+    site_connection.extensions.configuration_connection.enable_replication=False
+    for name in connection:
+        setattr(site_connection.extensions.status_connection.connection, name, connection[name])
+    return site_connection.to_dict(version=Version(
+        site="central", group="", rest_api={"revision": "0"}, versions={"checkmk": "2.3.0p1"}, edition="cre", demo=False
+    ))
+
+
+def routeSiteConnections(cmkServer, *siteConnections):
+    cmkServer.routes[("GET", SITE_CONNECTIONS_URL)]=lambda body: (200, {"value": list(siteConnections)}, {})
+
+
+def test_local_socket_probes_central_site(monkeypatch, cmkServer, cmkAccess, livestatusServer):
+    monkeypatch.delenv("OMD_ROOT", raising=False)
+    routeSiteConnections(cmkServer,
+        siteConnection("central", socket_type="local"),
+        siteConnection("remote1", socket_type="tcp", host="127.0.0.1", port=livestatusServer.port, encrypted=False)
+    )
+    report=SiteAllConnections(cmkAccess=cmkAccess).checkHealth(timeout=2)
+    assert report.healthySiteIDs == ["central", "remote1"]
+    assert report.sites["central"].probes["status"]["statusCode"] == 200
+    assert len(livestatusServer.queries) == 1
+
+
+def test_unix_socket_is_queried(cmkServer, cmkAccess, unixLivestatusServer):
+    routeSiteConnections(cmkServer, siteConnection("central", socket_type="unix", path=unixLivestatusServer.path))
+    report=SiteAllConnections(cmkAccess=cmkAccess).checkHealth(timeout=2)
+    assert report.healthySiteIDs == ["central"]
+    assert unixLivestatusServer.queries[0][0] == "GET status"
+
+
+def test_unreachable_central_site_is_unhealthy(monkeypatch, cmkServer, cmkAccess):
+    monkeypatch.delenv("OMD_ROOT", raising=False)
+    routeSiteConnections(cmkServer, siteConnection("central", socket_type="local"))
+    siteConnections=SiteAllConnections(cmkAccess=cmkAccess)
+    cmkServer.routes[("GET", "/version")]=lambda body: (503, {"title": "Service Unavailable"}, {})
+    report=siteConnections.checkHealth(timeout=2)
+    assert report.unhealthySiteIDs == ["central"]
@@ -0,0 +1,97 @@
+import pytest
+
+from dwlab_cmkapi import (
+    Change,
+    HostConfig,
+    SiteConnection,
+    SnapshotVersionError,
+    Version,
+    cmkInventory,
+    cmkInventorySnapshot,
+)
+
+
+def version(checkmk="2.3.0p1"):
+    return Version(site="central", group="", rest_api={"revision": "0"}, versions={"checkmk": checkmk}, edition="cre", demo=False)
+
+
+def inventory():
+    hosts={}
+    for index in range(3):
+        host_config=HostConfig.from_dict(dataDict={
+            "domainType": "host_config",
+            "id": "host"+str(index),
+            "title": "host"+str(index),
+            "extensions": {"folder": "/", "attributes": {"ipaddress": "10.0.0."+str(index)}},
+            "links": [],
+            "members": []
+        })
+        host_config.etag='"etag'+str(index)+'"'
+        hosts[host_config.id]=host_config
+    site_connection=SiteConnection()
+    site_connection.version=version()
+    site_connection=SiteConnection.from_dict(dataDict=site_connection.to_dict())
+    site_connection.id="remote1"
+    return cmkInventory(
+        version=version(),
+        hosts=hosts,
+        siteConnections={"remote1": site_connection},
+        pendingChanges=[Change(id="c1", action_name="edit-host", text="Modified host host0", user_id="automation", time="2024-01-01T00:00:00")],
+        created=1700000000.0
+    )
+
+
+def test_round_trip(tmp_path):
+    path=cmkInventorySnapshot.save(inventory(), tmp_path/"inventory.snap")
+    with cmkInventorySnapshot.load(path) as loaded:
+        assert loaded.version.checkmk_version == "2.3.0p1"
+        assert loaded.created == 1700000000.0
+        assert sorted(loaded.hosts) == ["host0", "host1", "host2"]
+        assert loaded.hosts["host1"].extensions.attributes["ipaddress"] == "10.0.0.1"
+        assert loaded.hosts["host1"].etag == '"etag1"'
+        assert loaded.siteConnections["remote1"].id == "remote1"
+        assert loaded.siteConnections["remote1"].to_dict() == inventory().siteConnections["remote1"].to_dict(version=version())
+        assert [change.id for change in loaded.pendingChanges] == ["c1"]
+
+
+def test_records_are_decoded_lazily(tmp_path):
+    path=cmkInventorySnapshot.save(inventory(), tmp_path/"inventory.snap")
+    with cmkInventorySnapshot.load(path) as loaded:
+        assert len(loaded.hosts) == 3
+        assert "host2" in loaded.hosts
+        assert loaded.hosts._decoded == {}
+        loaded.hosts["host2"]
+        assert list(loaded.hosts._decoded) == ["host2"]
+
+
+def test_read_version(tmp_path):
+    path=cmkInventorySnapshot.save(inventory(), tmp_path/"inventory.snap")
+    assert cmkInventorySnapshot.readVersion(path).checkmk_version == "2.3.0p1"
+
+
+def test_rejects_other_checkmk_version(tmp_path):
+    path=cmkInventorySnapshot.save(inventory(), tmp_path/"inventory.snap")
+    with pytest.raises(SnapshotVersionError):
+        cmkInventorySnapshot.load(path, expectedVersion=version("2.4.0p1"))
+
+
+def test_rejects_other_python_version(tmp_path):
+    path=cmkInventorySnapshot.save(inventory(), tmp_path/"inventory.snap")
+    data=bytearray(path.read_bytes())
+    # Byte 13 holds the minor version of the writing interpreter
+    data[13]=(data[13]+1) % 256
+    path.write_bytes(bytes(data))
+    with pytest.raises(SnapshotVersionError):
+        cmkInventorySnapshot.load(path)
+
+
+def test_rejects_foreign_file(tmp_path):
+    path=tmp_path/"inventory.snap"
+    path.write_bytes(b"\0"*cmkInventorySnapshot.HEADER.size)
+    with pytest.raises(ValueError):
+        cmkInventorySnapshot.load(path)
+
+
+def test_read_version_requires_path():
+    with pytest.raises(ValueError):
+        cmkInventorySnapshot.readVersion()
@@ -0,0 +1,72 @@
+import pytest
+
+from dwlab_cmkapi import HostConfig, HostExtensions, SiteConnection, Version, cmkSnapshotStore
+
+VERSION=Version(site="central", group="", rest_api={"revision": "0"}, versions={"checkmk": "2.3.0p1"}, edition="cre", demo=False)
+
+
+def hostConfig(name, folder="/", etag="", **attributes):
+    return HostConfig(id=name, etag=etag, extensions=HostExtensions(folder=folder, attributes=attributes))
+
+
+def siteConnection(siteID, etag=""):
+    site_connection=SiteConnection()
+    site_connection.id=siteID
+    site_connection.etag=etag
+    site_connection.extensions.basic_settings.site_id=siteID
+    site_connection.extensions.basic_settings.alias="Site "+siteID
+    site_connection.extensions.configuration_connection.enable_replication=False
+    return site_connection
+
+
+@pytest.fixture
+def store(tmp_path):
+    with cmkSnapshotStore(path=tmp_path/"snapshot.db") as store:
+        yield store
+
+
+def test_hosts_round_trip_and_only_report_changes(store):
+    assert store.saveHosts([hostConfig("web1", folder="/web", tag_env="prod"), hostConfig("db1")]) == ["web1", "db1"]
+    assert store.saveHosts([hostConfig("web1", folder="/web", tag_env="prod"), hostConfig("db1", tag_env="test")]) == ["db1"]
+    host_config=store.getHost("web1")
+    assert host_config.extensions.folder == "/web"
+    assert host_config.extensions.attributes == {"tag_env": "prod"}
+    assert [host.id for host in store.queryHosts(attribute="tag_env", value="test")] == ["db1"]
+
+
+def test_missing_etag_is_stored_as_null_and_known_etag_is_kept(store):
+    store.saveHosts([hostConfig("web1", etag='"abc"')])
+    store.saveHosts([hostConfig("web1")])
+    assert store.getHost("web1").etag == '"abc"'
+    store.saveHosts([hostConfig("db1")])
+    assert store.getHost("db1").etag == ""
+
+
+def test_recursive_folder_query_treats_wildcards_literally(store):
+    store.saveHosts([
+        hostConfig("a", folder="/web*"),
+        hostConfig("b", folder="/web*/prod"),
+        hostConfig("c", folder="/webserver/prod"),
+        hostConfig("d", folder="/web[1]/x")
+    ])
+    assert [host.id for host in store.queryHosts(folder="/web*", recursive=True)] == ["a", "b"]
+    assert [host.id for host in store.queryHosts(folder="/web[1]", recursive=True)] == ["d"]
+    assert [host.id for host in store.queryHosts(folder="/web*")] == ["a"]
+
+
+def test_site_connections_are_read_back_with_their_version(store):
+    assert store.storedVersion() is None
+    store.saveSiteConnections([siteConnection("remote1", etag='"e1"')], version=VERSION)
+    site_connection=store.getSiteConnection("remote1")
+    assert site_connection.etag == '"e1"'
+    assert site_connection.version.checkmk_version == "2.3.0p1"
+    assert site_connection.extensions.basic_settings.alias == "Site remote1"
+
+
+def test_site_connections_fall_back_to_their_own_version(store):
+    site_connection=siteConnection("remote1")
+    with pytest.raises(ValueError):
+        store.saveSiteConnections([site_connection])
+    site_connection.version=VERSION
+    assert store.saveSiteConnections([site_connection]) == ["remote1"]
+    assert store.storedVersion().checkmk_version == "2.3.0p1"
@@ -0,0 +1,49 @@
+import json
+from urllib.parse import parse_qs
+
+import pytest
+
+from dwlab_cmkapi import HostStatus, ServiceStatus, StatusQuery
+
+SERVICES_URL="/domain-types/service/collections/all"
+
+
+def test_expressions_flatten_and_negate():
+    critical=StatusQuery.equals("state", 2)
+    query=critical & StatusQuery.matches("description", "^CPU") & ~StatusQuery.equals("acknowledged", 1)
+    assert query.to_dict() == {"op": "and", "expr": [
+        {"op": "=", "left": "state", "right": "2"},
+        {"op": "~~", "left": "description", "right": "^CPU"},
+        {"op": "not", "expr": {"op": "=", "left": "acknowledged", "right": "1"}}
+    ]}
+    assert (critical | StatusQuery.any(critical, critical)).to_dict()["expr"] == [critical.to_dict()]*3
+
+
+def test_invalid_expressions_are_rejected():
+    with pytest.raises(ValueError):
+        StatusQuery.compare("state", "==", 2)
+    with pytest.raises(ValueError):
+        StatusQuery.compare("", "=", 2)
+    with pytest.raises(TypeError):
+        StatusQuery.equals("state", 2) & {"op": "=", "left": "state", "right": "0"}
+
+
+def test_short_queries_are_sent_as_url_parameters(cmkServer, cmkAccess):
+    cmkServer.routes[("GET", SERVICES_URL)]=lambda body: (200, {"value": [
+        {"extensions": {"host_name": "h1", "description": "CPU", "state": 2}}
+    ]}, {})
+    query=StatusQuery.equals("state", 2)
+    rows=ServiceStatus.Query(query=query, sites=["remote1"], hostName="h1", cmkAccess=cmkAccess)
+    assert rows == [{"host_name": "h1", "description": "CPU", "state": 2}]
+    params=parse_qs(cmkServer.queryStrings[-1])
+    assert params["columns"] == ServiceStatus.DEFAULT_COLUMNS
+    assert params["sites"] == ["remote1"]
+    assert params["host_name"] == ["h1"]
+    assert json.loads(params["query"][0]) == query.to_dict()
+    assert cmkServer.requests[-1][2] == b""
+
+
+def test_failed_queries_raise(cmkServer, cmkAccess):
+    cmkServer.routes[("GET", "/domain-types/host/collections/all")]=lambda body: (400, {"title": "Bad Request"}, {})
+    with pytest.raises(RuntimeError):
+        HostStatus.Query(columns=["name"], cmkAccess=cmkAccess)
@@ -0,0 +1,90 @@
+import json
+import time
+import threading
+
+import pytest
+
+from dwlab_cmkapi import RequestBudget, RequestThrottle, TokenBucket
+
+
+def test_token_bucket_burst_then_rate(monkeypatch):
+    now=[100.0]
+    slept=[]
+    def sleep(seconds):
+        slept.append(seconds)
+        now[0]+=seconds
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(time, "sleep", sleep)
+
+    bucket=TokenBucket(rate=4.0, burst=2)
+    bucket.acquire()
+    bucket.acquire()
+    assert slept == []
+    bucket.acquire()
+    assert slept == [pytest.approx(0.25)]
+
+
+def test_token_bucket_refill_is_capped(monkeypatch):
+    now=[100.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    bucket=TokenBucket(rate=10.0, burst=3)
+    bucket.acquire()
+    now[0]+=60
+    bucket._refill()
+    assert bucket._tokens == 3.0
+
+
+def test_token_bucket_rejects_invalid_settings():
+    with pytest.raises(ValueError):
+        TokenBucket(rate=0)
+    with pytest.raises(ValueError):
+        TokenBucket(burst=0)
+
+
+def test_request_categories():
+    assert RequestThrottle.categoryOf("GET", "/domain-types/host_config/collections/all") == "read"
+    assert RequestThrottle.categoryOf("HEAD", "/domain-types/activation_run/collections/pending_changes") == "read"
+    assert RequestThrottle.categoryOf("POST", "/domain-types/host_config/collections/all") == "write"
+    assert RequestThrottle.categoryOf("POST", "/domain-types/activation_run/actions/activate-changes/invoke") == "expensive"
+    assert RequestThrottle.categoryOf("POST", "/domain-types/service_discovery_run/actions/start/invoke?x=1") == "expensive"
+
+
+def test_budget_caps_requests_in_flight():
+    budget=RequestBudget(rate=1000.0, burst=1000, maxInFlight=2)
+    inside=threading.Semaphore(0)
+    release=threading.Event()
+    peak=[0]
+    def request():
+        with budget.slot():
+            peak[0]=max(peak[0], budget.inFlight)
+            inside.release()
+            release.wait(5)
+    threads=[threading.Thread(target=request) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    assert inside.acquire(timeout=5) and inside.acquire(timeout=5)
+    assert not inside.acquire(timeout=0.2)
+    assert budget.inFlight == 2
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert peak[0] == 2
+    assert budget.inFlight == 0
+
+
+def test_throttle_is_shared_per_site(cmkAccess):
+    assert cmkAccess.throttle is type(cmkAccess).siteThrottle(cmkAccess.siteKey)
+
+
+def test_json_body_and_write_generation(cmkServer, cmkAccess):
+    cmkServer.routes[("POST", "/domain-types/host_config/collections/all")]=lambda body: (200, json.loads(body), {})
+    cmkServer.routes[("PUT", "/objects/host_config/missing")]=lambda body: (404, {"title": "Not found"}, {})
+    generation=cmkAccess.writeGeneration
+
+    resp=cmkAccess.apiRequest("POST", "/domain-types/host_config/collections/all", jsonBody={"host_name": "h1"})
+    assert cmkAccess.decodeResponse(resp) == {"host_name": "h1"}
+    assert cmkAccess.writeGeneration == generation+1
+
+    cmkAccess.apiRequest("PUT", "/objects/host_config/missing", jsonBody={"attributes": {}})
+    cmkAccess.apiRequest("GET", "/version")
+    assert cmkAccess.writeGeneration == generation+1
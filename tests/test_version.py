@@ -0,0 +1,51 @@
+import threading
+
+import pytest
+
+from dwlab_cmkapi import RestAPIcredentials, SiteAllConnections, SiteConnection, Version
+
+SITE_CONNECTIONS_URL="/domain-types/site_connection/collections/all"
+
+
+def version(checkmk):
+    return Version(site="central", group="", rest_api={"revision": "0"}, versions={"checkmk": checkmk}, edition="cre", demo=False)
+
+
+def credentials(siteName):
+    return RestAPIcredentials(cmkHostname="cmk", cmkDomain="example.com", cmkSiteName=siteName, credentials="Bearer automation secret")
+
+
+def test_resolve_requires_a_version():
+    assert Version.resolve(version("2.3.0p1")).checkmk_version == "2.3.0p1"
+    with pytest.raises(ValueError):
+        Version.resolve(None)
+    with pytest.raises(ValueError):
+        SiteConnection().to_dict()
+
+
+def test_sites_keep_their_own_payload_dialect(cmkServer):
+    cmkServer.routes[("GET", "/version", "old")]=lambda body: (200, version("2.2.0p5").to_dict(), {})
+    remote=SiteConnection()
+    remote.id="remote1"
+    remote.extensions.configuration_connection.enable_replication=False
+    remoteDict=remote.to_dict(version=version("2.2.0p5"))
+    cmkServer.routes[("GET", SITE_CONNECTIONS_URL)]=lambda body: (200, {"value": [remoteDict]}, {})
+
+    newSite=credentials("central")
+    oldSite=credentials("old")
+    assert newSite.version.checkmk_version == "2.3.0p1"
+    assert oldSite.version.checkmk_version == "2.2.0p5"
+
+    results={}
+    def read(name, cmkAccess):
+        for _ in range(20):
+            site_connection=SiteAllConnections(cmkAccess=cmkAccess).value[0]
+            results.setdefault(name, set()).add(tuple(sorted(site_connection.to_dict()["extensions"]["configuration_connection"])))
+    threads=[threading.Thread(target=read, args=(name, cmkAccess)) for name, cmkAccess in [("new", newSite), ("old", oldSite)]*2]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results["new"] == {("enable_replication",)}
+    assert len(results["old"]) == 1
+    assert "url_of_remote_site" in next(iter(results["old"]))